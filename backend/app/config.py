@@ -14,23 +14,124 @@ class Settings(BaseSettings):
     # MongoDB
     mongo_url: str = "mongodb://mongodb:27017"
     mongodb_db_name: str = "cyber_healthguard"
+    log_write_buffer_max_documents: int = 500  # flush when this many logs are pending
+    log_write_buffer_max_delay_ms: int = 10  # ...or this long after the first one
+    log_write_buffer_max_pending: int = 20000  # beyond this, logs go to the spool
+    mongo_write_timeout_seconds: float = 2.0  # slower ingest writes fall back to the spool
+    time_series_storage: bool = False  # store logs/telemetry as time-series collections
+    time_series_logs_granularity: str = "seconds"
+    time_series_telemetry_granularity: str = "minutes"
+
+    # On-disk ingest spool (used while MongoDB is slow or down)
+    spool_directory: str = "./spool"
+    spool_segment_max_bytes: int = 64 * 1024 * 1024
+    spool_fsync: bool = True
+    spool_replay_interval_seconds: float = 5.0
+    spool_replay_batch_size: int = 1000
 
     # Authentication
     secret_key: str = "your-secret-key-change-in-production-please-use-openssl-rand-hex-32"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 43200  # 30 days
 
+    # Ingestion
+    max_ingest_batch_size: int = 1000
+    ingest_stream_chunk_size: int = 500  # events per flush
+    ingest_stream_max_line_bytes: int = 1_048_576
+    ingest_stream_max_errors: int = 20  # rejection reasons echoed back
+    ingest_max_decoded_body_bytes: int = 64 * 1024 * 1024  # limit for gzip/zstd request bodies
+
+    # Response compression (gzip, when the client sends Accept-Encoding)
+    response_compression_enabled: bool = True
+    response_compression_min_bytes: int = 1024
+
+    # Duplicate (retried) event rejection
+    # Derive a fingerprint from the event content when the client sends none. Off by default:
+    # genuinely repeated events (e.g. failed logins within the same second) would be dropped as retries
+    ingest_dedup_content_fingerprint: bool = False
+    ingest_dedup_window_seconds: int = 86400
+    ingest_dedup_capacity: int = 1_000_000  # fingerprints per Bloom filter generation
+    ingest_dedup_error_rate: float = 0.001
+
+    # Ingest rate limits (token buckets; rates are events/sec, bursts are events)
+    rate_limit_enabled: bool = True
+    rate_limit_max_buckets: int = 100_000
+    rate_limit_logs_org_per_second: float = 1000.0
+    rate_limit_logs_org_burst: float = 5000.0
+    rate_limit_logs_host_per_second: float = 50.0
+    rate_limit_logs_host_burst: float = 500.0
+    rate_limit_telemetry_org_per_second: float = 100.0
+    rate_limit_telemetry_org_burst: float = 1000.0
+    rate_limit_telemetry_host_per_second: float = 0.2  # one payload every 5s
+    rate_limit_telemetry_host_burst: float = 5.0
+
+    # Async ingest queue
+    ingest_queue_maxsize: int = 10000
+    ingest_queue_workers: int = 4
+    ingest_queue_retry_after_seconds: int = 5
+
+    # Endpoint last_seen upserts are merged in memory and written this often
+    endpoint_flush_interval_seconds: float = 5.0
+
+    # Ingest policy per log event_type: "store", "on_change", "downsample[:<minutes>]"
+    # or "endpoint" (latest details kept on the endpoint document, never stored)
+    ingest_event_policies: dict = {
+        "system_info": "endpoint",
+        "process_snapshot": "downsample:15",
+        "network_snapshot": "downsample:15",
+    }
+    ingest_policy_cache_size: int = 100_000  # (organisation, host, event_type) keys remembered
+
+    # Last system_info hash remembered per (organisation, host)
+    system_info_cache_size: int = 50000
+
+    # Retention (days; 0 keeps documents forever) and hourly log rollups
+    log_retention_days: int = 0  # raw logs, by event timestamp
+    telemetry_retention_days: int = 0
+    alert_retention_days: int = 0  # by created_at
+    log_rollup_retention_days: int = 400
+    log_rollup_interval_seconds: float = 900.0
+    log_rollup_lookback_hours: int = 6  # recent hours recomputed each run (late events)
+
     # Anomaly Detection
     anomaly_threshold: float = 0.7
     min_samples_for_training: int = 100
+    anomaly_model_cache_mb: int = 256  # pickled size of the models cached per process (LRU)
+    anomaly_model_version_check_seconds: float = 30.0  # how often a cached model is checked for a retrain elsewhere
+    anomaly_training_workers: int = 1  # processes fitting models off the event loop
+    anomaly_training_retry_seconds: float = 600.0  # wait before retrying an organisation that could not be trained
 
     # Alert Rules
     failed_login_threshold: int = 5
+    multiple_host_threshold: int = 5  # distinct hosts per user within rule_window_minutes
+    # Repeats of an open alert (same organisation, rule, host and user) last seen within
+    # this many minutes update it instead of creating a new alert; 0 disables suppression
+    alert_suppression_window_minutes: int = 60
+    alert_related_ids_max: int = 100  # related log/telemetry ids kept on a folded alert
+    rule_window_state_enabled: bool = True  # answer the windowed rules from in-memory counters
+    rule_window_minutes: int = 60
+    rule_window_max_keys: int = 200_000  # (organisation, user) windows kept in memory
+    rule_latency_budget_ms: float = 50.0  # log rule evaluations slower than this (DB + CPU); 0 disables
+
+    # HyperLogLog distinct counts (hosts per user, users per host, hosts per organisation)
+    distinct_counts_enabled: bool = True
+    distinct_count_precision: int = 12  # 4096 registers, ~1.6% standard error
+    distinct_count_max_keys: int = 200_000  # per-user and per-host windows kept in memory
     suspicious_processes: list = [
         "mimikatz", "powershell -enc", "powershell -e",
         "cmd.exe /c", "wmic", "psexec", "net user",
         "net localgroup", "procdump", "pwdump"
     ]
+    suspicious_process_patterns_file: str = ""  # extra patterns, one per line; reloaded when modified
+
+    # Declarative detection rules (JSON, or YAML with PyYAML) plus the detection_rules collection
+    detection_rules_file: str = ""
+    detection_rules_reload_seconds: float = 30.0
+
+    # Multi-event sequence correlation (built-in sequences plus an optional JSON/YAML file)
+    correlation_enabled: bool = True
+    correlation_rules_file: str = ""
+    correlation_max_keys: int = 100_000  # partial matches kept per sequence
 
     # Pagination
     default_page_size: int = 20
@@ -1,6 +1,14 @@
 """Database configuration and connection"""
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError, OperationFailure, WriteError
+
 from .config import get_settings
+from .spool import spool
 
 settings = get_settings()
 
@@ -9,32 +17,374 @@ class Database:
     """Database connection manager"""
     client: AsyncIOMotorClient = None
     db: AsyncIOMotorDatabase = None
+    time_series: Set[str] = set()  # collections stored as time-series collections
 
 
 db = Database()
 
 
+# ============================================================================
+# Time-series storage
+# ============================================================================
+
+# Opt-in (``time_series_storage``) layout for the append-only event collections:
+# the time field, and the document fields copied into the ``meta`` field.
+# Documents keep their top-level copies so reads, distinct() and $group are
+# unchanged; filters are rewritten to the meta fields so MongoDB can prune
+# whole buckets.
+META_FIELD = "meta"
+TIME_SERIES_COLLECTIONS = {
+    "logs": {
+        "time_field": "timestamp",
+        "meta_fields": {"organisation_id": "organisation_id", "host": "host"},
+        "granularity": settings.time_series_logs_granularity,
+    },
+    "telemetry": {
+        "time_field": "collected_at",
+        "meta_fields": {"organisation_id": "organisation_id", "host": "hostname"},
+        "granularity": settings.time_series_telemetry_granularity,
+    },
+}
+
+
+def is_time_series(collection: str) -> bool:
+    """Whether ``collection`` is stored as a time-series collection."""
+    return collection in db.time_series
+
+
+def time_series_document(collection: str, document: Dict) -> Dict:
+    """
+    Add the meta field to a document, in place, and make its time field a date.
+
+    Telemetry ``collected_at`` arrives as a string ("2025-11-24 22:00:00");
+    it is parsed as ISO 8601, falling back to ``ingested_at`` when it can't be.
+    """
+    layout = TIME_SERIES_COLLECTIONS[collection]
+    document[META_FIELD] = {
+        meta_key: document.get(field) for meta_key, field in layout["meta_fields"].items()
+    }
+
+    time_field = layout["time_field"]
+    value = document.get(time_field)
+    if not isinstance(value, datetime):
+        try:
+            document[time_field] = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            document[time_field] = document.get("ingested_at") or datetime.utcnow()
+
+    return document
+
+
+def prepare_document(collection: str, document: Dict) -> Dict:
+    """Shape a document for ``collection``'s storage mode before it is written."""
+    if is_time_series(collection):
+        time_series_document(collection, document)
+    return document
+
+
+def meta_query(collection: str, query: Dict) -> Dict:
+    """
+    Rewrite top-level equality/operator filters on meta fields to ``meta.*``.
+
+    Returns ``query`` unchanged unless ``collection`` is time-series.
+    """
+    if not is_time_series(collection):
+        return query
+
+    fields = {field: meta_key for meta_key, field in TIME_SERIES_COLLECTIONS[collection]["meta_fields"].items()}
+    return {
+        f"{META_FIELD}.{fields[key]}" if key in fields else key: value
+        for key, value in query.items()
+    }
+
+
+async def ensure_time_series_collection(database: AsyncIOMotorDatabase, collection: str) -> bool:
+    """
+    Create ``collection`` as a time-series collection if it does not exist yet.
+
+    Returns:
+        True if the collection is time-series, False if it already exists as a
+        regular collection (migrate it with scripts/migrate_time_series.py)
+    """
+    layout = TIME_SERIES_COLLECTIONS[collection]
+    cursor = await database.list_collections(filter={"name": collection})
+    existing = await cursor.to_list(length=1)
+
+    if not existing:
+        await database.create_collection(
+            collection,
+            timeseries={
+                "timeField": layout["time_field"],
+                "metaField": META_FIELD,
+                "granularity": layout["granularity"],
+            }
+        )
+        return True
+
+    return existing[0].get("type") == "timeseries"
+
+
+def assign_ids(documents: List[Dict]) -> List[Dict]:
+    """
+    Give each document a client-side ``_id`` before its first write attempt.
+
+    A write that times out may still reach the server; with the ``_id``
+    fixed up front, the spooled copy is rejected as a duplicate on replay
+    instead of being inserted twice.
+    """
+    for document in documents:
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+    return documents
+
+
+def spool_copies(documents: List[Dict]) -> List[Dict]:
+    """Shallow copies for the spool; a cancelled insert_many may still be touching the originals."""
+    return [dict(document) for document in documents]
+
+
+class LogWriteBuffer:
+    """
+    Write-behind buffer that coalesces concurrent single-document inserts.
+
+    Documents from concurrent requests are collected and written with one
+    unordered insert_many once ``log_write_buffer_max_documents`` are pending
+    or ``log_write_buffer_max_delay_ms`` has passed since the first one.
+    Each caller's ``insert`` returns only after its own document has been
+    acknowledged, and raises that document's write error if it was rejected.
+
+    If the write times out, the connection fails, or more than
+    ``log_write_buffer_max_pending`` documents are already waiting, documents
+    go to the on-disk ingest spool instead and are replayed once MongoDB
+    recovers.
+    """
+
+    def __init__(self):
+        self.collection: Optional[AsyncIOMotorCollection] = None
+        self._pending: List[Tuple[Dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushes: set = set()
+        self._in_flight = 0
+
+    def bind(self, collection: AsyncIOMotorCollection):
+        """Attach the buffer to the collection it writes to."""
+        self.collection = collection
+
+    async def insert(self, document: Dict) -> bool:
+        """
+        Queue a document and wait until it has been written.
+
+        Returns:
+            True if the document was written to MongoDB, False if it was
+            spooled to disk for later replay
+        """
+        assign_ids([document])
+        if self._in_flight + len(self._pending) >= settings.log_write_buffer_max_pending:
+            await spool.append(self.collection.name, spool_copies([document]))
+            return False
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((document, future))
+
+        if len(self._pending) >= settings.log_write_buffer_max_documents:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(
+                settings.log_write_buffer_max_delay_ms / 1000,
+                self._schedule_flush
+            )
+
+        return await future
+
+    def _schedule_flush(self):
+        """Hand the pending documents to a background insert_many."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        self._in_flight += len(batch)
+        task = asyncio.create_task(self._write(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _write(self, batch: List[Tuple[Dict, asyncio.Future]]):
+        """Write one batch and resolve each caller's future with its own outcome."""
+        documents = [document for document, _ in batch]
+        errors: Dict[int, Exception] = {}
+        written = True
+
+        try:
+            await asyncio.wait_for(
+                self.collection.insert_many(documents, ordered=False),
+                timeout=settings.mongo_write_timeout_seconds
+            )
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                error_class = DuplicateKeyError if error.get("code") == 11000 else WriteError
+                errors[error["index"]] = error_class(error.get("errmsg"), error.get("code"), error)
+        except (asyncio.TimeoutError, ConnectionFailure):
+            # _ids were assigned in insert(), so a replay of documents that
+            # did reach the server is rejected as a duplicate
+            try:
+                await spool.append(self.collection.name, spool_copies(documents))
+                written = False
+            except Exception as e:
+                errors = {index: e for index in range(len(batch))}
+        except Exception as e:
+            errors = {index: e for index in range(len(batch))}
+        finally:
+            self._in_flight -= len(batch)
+
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(written)
+
+    async def flush(self):
+        """Write everything pending and wait for in-flight writes to finish."""
+        self._schedule_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+log_buffer = LogWriteBuffer()
+
+
+async def write_or_spool(collection: AsyncIOMotorCollection, documents: List[Dict]) -> bool:
+    """
+    Insert documents with an unordered insert_many, falling back to the spool.
+
+    Returns:
+        True if written to MongoDB, False if spooled because the write timed
+        out or the connection failed
+
+    Raises:
+        BulkWriteError: If MongoDB rejected some of the documents
+    """
+    assign_ids(documents)
+    try:
+        await asyncio.wait_for(
+            collection.insert_many(documents, ordered=False),
+            timeout=settings.mongo_write_timeout_seconds
+        )
+        return True
+    except (asyncio.TimeoutError, ConnectionFailure):
+        await spool.append(collection.name, spool_copies(documents))
+        return False
+
+
+async def ensure_ttl(collection: str, field: str, days: int):
+    """
+    Expire documents in ``collection`` ``days`` after ``field`` (0 disables expiry).
+
+    Time-series collections expire on their timeField through the collection
+    option; regular collections get a TTL index named ``<field>_ttl``, which
+    is updated in place when the retention changes.
+    """
+    seconds = days * 86400
+
+    if is_time_series(collection):
+        await db.db.command("collMod", collection, expireAfterSeconds=seconds or "off")
+        return
+
+    name = f"{field}_ttl"
+    if not seconds:
+        try:
+            await db.db[collection].drop_index(name)
+        except OperationFailure:
+            pass  # no TTL index to remove
+        return
+
+    try:
+        await db.db[collection].create_index(field, name=name, expireAfterSeconds=seconds)
+    except OperationFailure:
+        # Same index with a different retention
+        await db.db.command("collMod", collection, index={"name": name, "expireAfterSeconds": seconds})
+
+
 async def connect_to_mongo():
     """Connect to MongoDB"""
     db.client = AsyncIOMotorClient(settings.mongo_url)
     db.db = db.client[settings.mongodb_db_name]
 
+    db.time_series = set()
+    if settings.time_series_storage:
+        for collection in TIME_SERIES_COLLECTIONS:
+            if await ensure_time_series_collection(db.db, collection):
+                db.time_series.add(collection)
+            else:
+                print(f"⚠️  WARNING: '{collection}' is a regular collection; run scripts/migrate_time_series.py "
+                      "to convert it. Keeping regular storage for now.")
+
     # Create indexes
-    await db.db.logs.create_index([("organisation_id", 1), ("timestamp", -1)])
-    await db.db.logs.create_index([("organisation_id", 1), ("host", 1)])
-    await db.db.logs.create_index([("organisation_id", 1), ("event_type", 1)])
+    if is_time_series("logs"):
+        # Unique indexes are not supported on time-series collections; duplicate
+        # fingerprints are still rejected by the Bloom filter + lookup in dedup.py
+        await db.db.logs.create_index([("meta.organisation_id", 1), ("meta.host", 1), ("timestamp", -1)])
+        await db.db.logs.create_index([("meta.organisation_id", 1), ("event_type", 1), ("timestamp", -1)])
+        await db.db.logs.create_index([("meta.organisation_id", 1), ("fingerprint", 1)])
+    else:
+        await db.db.logs.create_index([("organisation_id", 1), ("timestamp", -1)])
+        await db.db.logs.create_index([("organisation_id", 1), ("host", 1)])
+        await db.db.logs.create_index([("organisation_id", 1), ("event_type", 1)])
+        await db.db.logs.create_index(
+            [("organisation_id", 1), ("fingerprint", 1)],
+            unique=True,
+            partialFilterExpression={"fingerprint": {"$exists": True}}
+        )
+
+    if is_time_series("telemetry"):
+        await db.db.telemetry.create_index([("meta.organisation_id", 1), ("meta.host", 1), ("collected_at", -1)])
+        await db.db.telemetry.create_index([("meta.organisation_id", 1), ("fingerprint", 1)])
+    else:
+        await db.db.telemetry.create_index(
+            [("organisation_id", 1), ("fingerprint", 1)],
+            unique=True,
+            partialFilterExpression={"fingerprint": {"$exists": True}}
+        )
 
     await db.db.alerts.create_index([("organisation_id", 1), ("created_at", -1)])
     await db.db.alerts.create_index([("organisation_id", 1), ("status", 1)])
     await db.db.alerts.create_index("alert_id", unique=True)
+    await db.db.alerts.create_index(
+        [("organisation_id", 1), ("suppression_key", 1), ("last_seen", -1)],
+        partialFilterExpression={"status": "open"}
+    )
 
     await db.db.endpoints.create_index([("organisation_id", 1), ("host", 1)], unique=True)
 
+    await db.db.system_info_snapshots.create_index([("organisation_id", 1), ("hash", 1)], unique=True)
+
+    await db.db.log_rollups.create_index([("organisation_id", 1), ("hour", -1)])
+    await db.db.log_rollups.create_index([("organisation_id", 1), ("host", 1), ("hour", -1)])
+
+    # Retention; regular telemetry documents keep collected_at as a string, so
+    # they expire by ingestion time
+    await ensure_ttl("logs", "timestamp", settings.log_retention_days)
+    await ensure_ttl(
+        "telemetry",
+        "collected_at" if is_time_series("telemetry") else "ingested_at",
+        settings.telemetry_retention_days
+    )
+    await ensure_ttl("alerts", "created_at", settings.alert_retention_days)
+    await ensure_ttl("log_rollups", "hour", settings.log_rollup_retention_days)
+
+    log_buffer.bind(db.db.logs)
+
     print("✅ Connected to MongoDB")
 
 
 async def close_mongo_connection():
     """Close MongoDB connection"""
+    await log_buffer.flush()
     if db.client:
         db.client.close()
         print("❌ Closed MongoDB connection")
@@ -43,3 +393,8 @@ async def close_mongo_connection():
 def get_database() -> AsyncIOMotorDatabase:
     """Get database instance"""
     return db.db
+
+
+def get_log_buffer() -> LogWriteBuffer:
+    """Get the shared write-behind buffer for log inserts"""
+    return log_buffer
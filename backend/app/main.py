@@ -4,13 +4,23 @@ import os
 from typing import List
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, Response
 
 from .config import get_settings
-from .database import connect_to_mongo, close_mongo_connection
-from .routers import logs, alerts, endpoints, compliance, auth, telemetry, agent
+from .database import connect_to_mongo, close_mongo_connection, get_database
+from .routers import logs, alerts, endpoints, compliance, auth, telemetry, agent, metrics
+from .services.anomaly_detection import model_trainer
+from .services.detection_rules import detection_rules
+from .services.distinct_counts import distinct_counts
+from .services.endpoint_tracker import endpoint_tracker
+from .services.ingest_queue import ingest_queue
+from .services.log_rollups import log_rollup_job
+from .services.rate_limiter import RateLimitExceeded
+from .services.window_state import window_state
+from .spool import spool
 
 settings = get_settings()
 
@@ -27,8 +37,24 @@ def _parse_allowed_origins(raw_origins: str | None, defaults: List[str]) -> List
 async def lifespan(app: FastAPI):
     """Manage startup and shutdown events."""
     await connect_to_mongo()
+    if settings.rule_window_state_enabled:
+        await window_state.rebuild(get_database())
+    if settings.distinct_counts_enabled:
+        await distinct_counts.rebuild(get_database())
+    await spool.start(get_database())
+    await endpoint_tracker.start(get_database())
+    await ingest_queue.start(get_database())
+    spool.on_replayed("logs", ingest_queue.submit_replayed)
+    await log_rollup_job.start(get_database())
+    await detection_rules.start(get_database())
     yield
+    await detection_rules.stop()
+    await model_trainer.stop()
+    await log_rollup_job.stop()
+    await ingest_queue.stop()
+    await endpoint_tracker.stop()
     await close_mongo_connection()
+    await spool.stop()
 
 
 app = FastAPI(
@@ -87,6 +113,14 @@ app.add_middleware(
     max_age=3600,
 )
 
+# -----------------------------
+# RESPONSE COMPRESSION
+# -----------------------------
+# Alert and endpoint listings are large; gzip them for clients that accept it
+
+if settings.response_compression_enabled:
+    app.add_middleware(GZipMiddleware, minimum_size=settings.response_compression_min_bytes)
+
 # -----------------------------
 # GLOBAL PRE-FLIGHT HANDLER
 # -----------------------------
@@ -98,6 +132,16 @@ async def preflight_handler(path: str):
     return Response(status_code=200)
 
 
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_handler(request: Request, exc: RateLimitExceeded):
+    """Throttled ingest requests get 429 and a Retry-After header."""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
 # -----------------------------
 # ROUTERS
 # -----------------------------
@@ -108,6 +152,7 @@ app.include_router(endpoints.router)
 app.include_router(compliance.router)
 app.include_router(telemetry.router)
 app.include_router(agent.router)
+app.include_router(metrics.router)
 
 
 @app.get("/", tags=["Health"])
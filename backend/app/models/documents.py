@@ -0,0 +1,114 @@
+"""TypedDict mirrors of the ingest schemas for the high-throughput validation path"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pydantic import Field, TypeAdapter
+from pydantic.functional_validators import AfterValidator
+from typing_extensions import Annotated, TypedDict
+
+# These mirror LogEvent and TelemetryPayload in schemas.py field for field.
+# Validating into plain dicts skips model construction and the model_dump()
+# that used to follow it, so the validated value is the MongoDB document.
+# Keep both in sync when a field changes.
+
+
+# ============================================================================
+# Log Events
+# ============================================================================
+
+class LogEventDocument(TypedDict):
+    """Validated log event (see LogEvent)"""
+    organisation_id: str
+    host: str
+    user: str
+    timestamp: Annotated[datetime, Field(default_factory=datetime.utcnow)]
+    event_type: str
+    source: str
+    details: Annotated[Dict[str, Any], Field(default_factory=dict)]
+    fingerprint: Annotated[Optional[str], Field(default=None)]
+
+
+# ============================================================================
+# Telemetry
+# ============================================================================
+
+class SecurityEventDocument(TypedDict):
+    """Validated security event (see SecurityEvent)"""
+    event_id: int
+    time_created: str
+    level: str
+    message: str
+    source: str
+    user: str
+
+
+class ProcessInfoDocument(TypedDict):
+    """Validated process information (see ProcessInfo)"""
+    name: str
+    pid: int
+    cpu: float
+    memory_mb: float
+    threads: int
+    start_time: str
+    path: str
+
+
+class SystemInfoDocument(TypedDict):
+    """Validated system information (see SystemInfo)"""
+    hostname: str
+    organisation_id: str
+    os_name: str
+    os_version: str
+    os_architecture: str
+    manufacturer: str
+    model: str
+    bios_version: str
+    cpu_name: str
+    cpu_cores: int
+    total_memory_gb: float
+    domain: str
+    uptime_hours: float
+    last_boot: str
+    agent_version: str
+    collected_at: str
+
+
+class TelemetryMetricsDocument(TypedDict):
+    """Validated collection metrics (see TelemetryMetrics)"""
+    total_events: int
+    total_processes: int
+    collection_duration_ms: int
+
+
+class TelemetryPayloadDocument(TypedDict):
+    """Validated telemetry payload (see TelemetryPayload)"""
+    agent_id: str
+    hostname: str
+    organisation_id: str
+    collected_at: str
+    system_info: Annotated[Optional[SystemInfoDocument], Field(default=None)]
+    system_info_hash: Annotated[Optional[str], Field(default=None)]
+    security_events: Annotated[List[SecurityEventDocument], Field(default_factory=list)]
+    process_info: Annotated[List[ProcessInfoDocument], Field(default_factory=list)]
+    metrics: TelemetryMetricsDocument
+    fingerprint: Annotated[Optional[str], Field(default=None)]
+
+
+def _require_system_info_or_hash(payload: TelemetryPayloadDocument) -> TelemetryPayloadDocument:
+    """Either the full system_info or the hash of an unchanged one must be sent"""
+    if payload["system_info"] is None and not payload["system_info_hash"]:
+        raise ValueError('Either system_info or system_info_hash is required')
+    return payload
+
+
+ValidatedTelemetryPayload = Annotated[TelemetryPayloadDocument, AfterValidator(_require_system_info_or_hash)]
+
+
+# ============================================================================
+# Cached adapters (building a TypeAdapter compiles a validator; do it once)
+# ============================================================================
+
+log_event_adapter = TypeAdapter(LogEventDocument)
+log_event_list_adapter = TypeAdapter(List[LogEventDocument])
+telemetry_payload_adapter = TypeAdapter(ValidatedTelemetryPayload)
+telemetry_payload_list_adapter = TypeAdapter(List[ValidatedTelemetryPayload])
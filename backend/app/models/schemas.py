@@ -1,5 +1,5 @@
 """Pydantic schemas for request/response models"""
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 from enum import Enum
@@ -18,6 +18,10 @@ class LogEvent(BaseModel):
     event_type: str = Field(..., description="Event type (e.g., login, process, network)")
     source: str = Field(..., description="Log source (e.g., EDR, SIEM, Syslog)")
     details: Dict[str, Any] = Field(default_factory=dict, description="Additional event details")
+    fingerprint: Optional[str] = Field(
+        None,
+        description="Idempotency key; retries with the same fingerprint are ignored. If omitted, one is derived from the content only when ingest_dedup_content_fingerprint is enabled"
+    )
 
     class Config:
         json_schema_extra = {
@@ -45,6 +49,32 @@ class LogEventResponse(BaseModel):
     alert_created: bool = False
     alert_id: Optional[str] = None
     anomaly_score: Optional[float] = None
+    duplicate: bool = False
+    aggregated: bool = False
+
+
+class LogBatchResponse(BaseModel):
+    """Batch log ingestion response schema"""
+    success: bool
+    message: str
+    accepted: int = 0
+    rejected: int = 0
+    duplicates: int = 0
+    aggregated: int = 0
+    alerts_created: int = 0
+    results: List[LogEventResponse] = Field(default_factory=list, description="Per-event results, in request order")
+
+
+class LogStreamSummary(BaseModel):
+    """Streaming (NDJSON) log ingestion summary"""
+    success: bool
+    message: str
+    accepted: int = 0
+    rejected: int = 0
+    duplicates: int = 0
+    aggregated: int = 0
+    alerts_created: int = 0
+    errors: List[str] = Field(default_factory=list, description="First rejection reasons, with line numbers")
 
 
 # ============================================================================
@@ -80,8 +110,11 @@ class Alert(BaseModel):
     anomaly_score: Optional[float] = None
     triggered_by: str = Field(..., description="rule or anomaly")
     rule_name: Optional[str] = None
+    matched_patterns: List[str] = Field(default_factory=list)
+    occurrence_count: int = Field(1, description="Times the alert was raised, including suppressed repeats")
     created_at: datetime
     updated_at: datetime
+    last_seen: Optional[datetime] = None
     comments: List[str] = Field(default_factory=list)
     related_log_ids: List[str] = Field(default_factory=list)
 
@@ -99,8 +132,10 @@ class Alert(BaseModel):
                 "event_type": "login",
                 "triggered_by": "rule",
                 "rule_name": "failed_login_threshold",
+                "occurrence_count": 3,
                 "created_at": "2025-11-19T10:30:00Z",
-                "updated_at": "2025-11-19T10:30:00Z"
+                "updated_at": "2025-11-19T10:42:00Z",
+                "last_seen": "2025-11-19T10:42:00Z"
             }
         }
 
@@ -120,6 +155,78 @@ class AlertListResponse(BaseModel):
     total_pages: int
 
 
+class DetectionRuleWindow(BaseModel):
+    """Window aggregation of a declarative detection rule"""
+    minutes: int = Field(default=60, ge=1, le=1440)
+    group_by: List[str] = Field(default_factory=lambda: ["user"], description="Fields the window is kept per, within the organisation")
+    distinct: Optional[str] = Field(default=None, description="Count distinct values of this field instead of events")
+    threshold: int = Field(..., ge=1)
+
+
+class DetectionRuleDefinition(BaseModel):
+    """Declarative detection rule (JSON/YAML file or detection_rules collection)"""
+    name: str
+    title: str = Field(..., description="Template, e.g. 'Failed logins - {user}'")
+    description: str = ""
+    severity: AlertSeverity = AlertSeverity.MEDIUM
+    event_types: List[str] = Field(default_factory=lambda: ["*"])
+    match: Dict[str, Any] = Field(default_factory=dict, description="Field predicates, all of which must hold")
+    window: Optional[DetectionRuleWindow] = None
+    organisation_id: Optional[str] = Field(default=None, description="Only for this organisation; overrides a global rule with the same name")
+    enabled: bool = True
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "name": "service_account_lateral_movement",
+                "title": "Service account on many hosts - {user}",
+                "description": "{user} logged on to {count} hosts in {window_minutes} minutes",
+                "severity": "high",
+                "event_types": ["login"],
+                "match": {"user": {"regex": "^svc_"}, "details.success": True},
+                "window": {"minutes": 15, "group_by": ["user"], "distinct": "host", "threshold": 10}
+            }
+        }
+
+
+class CorrelationStep(BaseModel):
+    """One step of a correlation sequence: events that must occur ``count`` times"""
+    event_types: List[str] = Field(default_factory=lambda: ["*"])
+    match: Dict[str, Any] = Field(default_factory=dict, description="Field predicates, as for detection rules")
+    count: int = Field(default=1, ge=1, le=1000)
+
+
+class CorrelationRuleDefinition(BaseModel):
+    """Multi-event sequence (e.g. failed logins followed by a success) tracked per key"""
+    name: str
+    title: str = Field(..., description="Template, e.g. 'Brute force succeeded - {user}'")
+    description: str = ""
+    severity: AlertSeverity = AlertSeverity.HIGH
+    technique: Optional[str] = Field(default=None, description="MITRE ATT&CK technique id")
+    key: List[str] = Field(default_factory=lambda: ["user"], description="Fields the sequence is tracked per, within the organisation")
+    steps: List[CorrelationStep] = Field(..., min_length=1)
+    within_minutes: int = Field(default=10, ge=1, le=1440, description="Maximum time from the first to the last event")
+    organisation_id: Optional[str] = Field(default=None, description="Only for this organisation; overrides a global rule with the same name")
+    enabled: bool = True
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "name": "failed_logins_then_success",
+                "title": "Successful login after repeated failures - {user}",
+                "description": "{user} logged on to {host} after {first_count} failed attempts within {duration_minutes} minutes",
+                "severity": "high",
+                "technique": "T1078",
+                "key": ["user"],
+                "steps": [
+                    {"event_types": ["login"], "match": {"details.success": False}, "count": 5},
+                    {"event_types": ["login"], "match": {"details.success": True}}
+                ],
+                "within_minutes": 10
+            }
+        }
+
+
 # ============================================================================
 # Endpoints
 # ============================================================================
@@ -146,6 +253,7 @@ class Endpoint(BaseModel):
     anomaly_count: int = 0
     critical_alerts: int = 0
     compliance_issues: int = 0
+    snapshots: Dict[str, Dict[str, Any]] = Field(default_factory=dict, description="Latest agent snapshot details by event type")
 
     class Config:
         json_schema_extra = {
@@ -723,10 +831,25 @@ class TelemetryPayload(BaseModel):
     hostname: str = Field(..., description="Endpoint hostname")
     organisation_id: str = Field(..., description="Organisation identifier")
     collected_at: str = Field(..., description="Collection timestamp")
-    system_info: SystemInfo = Field(..., description="System information")
+    system_info: Optional[SystemInfo] = Field(None, description="System information (omit when unchanged)")
+    system_info_hash: Optional[str] = Field(
+        None,
+        description="Hash returned by the previous ingest; send instead of system_info when nothing changed"
+    )
     security_events: List[SecurityEvent] = Field(default_factory=list, description="Security events")
     process_info: List[ProcessInfo] = Field(default_factory=list, description="Process information")
     metrics: TelemetryMetrics = Field(..., description="Collection metrics")
+    fingerprint: Optional[str] = Field(
+        None,
+        description="Idempotency key; retries with the same fingerprint are ignored. If omitted, one is derived from agent_id, hostname and collected_at only when ingest_dedup_content_fingerprint is enabled"
+    )
+
+    @model_validator(mode='after')
+    def require_system_info_or_hash(self):
+        """Either the full system_info or the hash of an unchanged one must be sent"""
+        if self.system_info is None and not self.system_info_hash:
+            raise ValueError('Either system_info or system_info_hash is required')
+        return self
 
     class Config:
         json_schema_extra = {
@@ -771,6 +894,9 @@ class TelemetryResponse(BaseModel):
     telemetry_id: Optional[str] = Field(None, description="Generated telemetry ID")
     endpoint_updated: bool = Field(False, description="Endpoint record updated")
     alerts_created: int = Field(0, description="Number of alerts created")
+    system_info_hash: Optional[str] = Field(None, description="Hash of the stored system_info; send it next time instead of unchanged system_info")
+    system_info_required: bool = Field(False, description="The sent system_info_hash is unknown; resend the full system_info")
+    duplicate: bool = Field(False, description="Payload was already ingested and has been ignored")
 
     class Config:
         json_schema_extra = {
@@ -779,6 +905,8 @@ class TelemetryResponse(BaseModel):
                 "message": "Telemetry data ingested successfully",
                 "telemetry_id": "tel_abc123",
                 "endpoint_updated": True,
-                "alerts_created": 0
+                "alerts_created": 0,
+                "system_info_hash": "9f86d081884c7d659a2feaa0c55ad015",
+                "system_info_required": False
             }
         }
@@ -6,6 +6,7 @@ from datetime import datetime
 from ..database import get_database
 from ..models.schemas import Endpoint, EndpointListResponse, RiskLevel
 from ..utils.auth import get_organisation_id
+from ..services.log_rollups import LogRollupService
 from ..services.risk_scoring import RiskScoringService
 
 router = APIRouter(prefix="/api/endpoints", tags=["Endpoints"])
@@ -26,8 +27,9 @@ async def list_endpoints(
     - Critical alert counts
     - Compliance issues
     """
-    # Get all unique hosts from logs
-    hosts = await db.logs.distinct("host", {"organisation_id": organisation_id})
+    # Get all unique hosts from logs (rollups keep hosts whose raw logs expired)
+    rollups = LogRollupService(db)
+    hosts = await rollups.distinct_hosts(organisation_id)
 
     risk_service = RiskScoringService(db)
     endpoints = []
@@ -55,15 +57,12 @@ async def list_endpoints(
             risk_data = await risk_service.calculate_endpoint_risk(organisation_id, host)
 
             # Get last seen timestamp
-            last_log = await db.logs.find_one(
-                {"organisation_id": organisation_id, "host": host},
-                sort=[("timestamp", -1)]
-            )
+            last_seen = await rollups.last_seen(organisation_id, host)
 
             endpoint_doc = {
                 "organisation_id": organisation_id,
                 "host": host,
-                "last_seen": last_log["timestamp"] if last_log else datetime.utcnow(),
+                "last_seen": last_seen or datetime.utcnow(),
                 **risk_data
             }
 
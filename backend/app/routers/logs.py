@@ -1,17 +1,21 @@
 """Log ingestion API endpoints"""
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from datetime import datetime
-import uuid
+from pymongo.errors import DuplicateKeyError
+from typing import List
 
-from ..database import get_database
-from ..models.schemas import LogEvent, LogEventResponse
-from ..services.anomaly_detection import AnomalyDetector
-from ..services.rule_engine import RuleEngine
-from ..services.risk_scoring import RiskScoringService
-from ..utils.auth import get_organisation_id
+from ..config import get_settings
+from ..database import get_database, get_log_buffer
+from ..models.documents import log_event_list_adapter
+from ..models.schemas import LogEvent, LogEventResponse, LogBatchResponse, LogStreamSummary
+from ..services.ingestion import IngestionService
+from ..services.ingest_policy import ingest_policies
+from ..services.ingest_queue import ingest_queue, IngestQueueFull
+from ..services.rate_limiter import log_rate_limiter
+from ..utils.wire import WireFormatRoute, request_body_openapi, validate_body
 
-router = APIRouter(prefix="/api/ingest", tags=["Log Ingestion"])
+router = APIRouter(prefix="/api/ingest", tags=["Log Ingestion"], route_class=WireFormatRoute)
+settings = get_settings()
 
 
 @router.post("/logs", response_model=LogEventResponse, status_code=status.HTTP_201_CREATED)
@@ -27,104 +31,155 @@ async def ingest_log(
     2. ML-based anomaly detection
     3. Automatic alert creation if threats are detected
 
+    Returns 429 with Retry-After when the organisation or host exceeds its ingest rate.
+
     Returns:
         LogEventResponse with log_id and alert information if generated
     """
+    log_rate_limiter.acquire([(log_event.organisation_id, log_event.host)])
+
     try:
-        # Generate log ID
-        log_id = f"log_{uuid.uuid4().hex[:16]}"
-
-        # Prepare log document
-        log_dict = log_event.model_dump()
-        log_dict["log_id"] = log_id
-        log_dict["ingested_at"] = datetime.utcnow()
-
-        # Insert log into database
-        await db.logs.insert_one(log_dict)
-
-        # Initialize detection services
-        rule_engine = RuleEngine(db)
-        anomaly_detector = AnomalyDetector(db)
-
-        # 1. Rule-based detection
-        rule_alerts = await rule_engine.evaluate_all_rules(log_event)
-
-        # 2. Anomaly detection
-        is_anomaly, anomaly_score = await anomaly_detector.predict_anomaly(log_event)
-
-        alert_created = False
-        alert_id = None
-
-        # Create alerts from rules
-        for alert in rule_alerts:
-            alert_dict = alert.model_dump()
-            alert_dict["related_log_ids"] = [log_id]
-            await db.alerts.insert_one(alert_dict)
-            alert_created = True
-            alert_id = alert.alert_id
-
-        # Create alert for anomaly if detected
-        if is_anomaly and not rule_alerts:  # Only if no rule-based alert was created
-            from ..models.schemas import Alert, AlertSeverity, AlertStatus
-
-            # Determine severity based on anomaly score
-            if anomaly_score > 0.9:
-                severity = AlertSeverity.CRITICAL
-            elif anomaly_score > 0.8:
-                severity = AlertSeverity.HIGH
-            elif anomaly_score > 0.7:
-                severity = AlertSeverity.MEDIUM
-            else:
-                severity = AlertSeverity.LOW
-
-            anomaly_alert = Alert(
-                alert_id=f"alert_{uuid.uuid4().hex[:16]}",
-                organisation_id=log_event.organisation_id,
-                title=f"Anomalous Behavior Detected - {log_event.host}",
-                description=f"ML model detected anomalous {log_event.event_type} event on {log_event.host} by {log_event.user} (score: {anomaly_score:.2f})",
-                severity=severity,
-                status=AlertStatus.OPEN,
-                host=log_event.host,
-                user=log_event.user,
-                event_type=log_event.event_type,
-                anomaly_score=anomaly_score,
-                triggered_by="anomaly",
-                created_at=datetime.utcnow(),
-                updated_at=datetime.utcnow(),
-                related_log_ids=[log_id]
-            )
-
-            await db.alerts.insert_one(anomaly_alert.model_dump())
-            alert_created = True
-            alert_id = anomaly_alert.alert_id
-
-        # Update endpoint last_seen
-        await db.endpoints.update_one(
-            {"organisation_id": log_event.organisation_id, "host": log_event.host},
-            {
-                "$set": {
-                    "last_seen": log_event.timestamp,
-                    "ip_address": log_event.details.get("ip_address"),
-                    "os_type": log_event.details.get("os_type")
-                }
-            },
-            upsert=True
+        return await IngestionService(db).ingest_event(log_event)
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to ingest log: {str(e)}"
         )
 
-        # Trigger background risk recalculation (simplified - in production use Celery/background tasks)
-        # For now, we'll calculate it on-demand in the endpoints API
 
-        return LogEventResponse(
-            success=True,
-            message="Log event ingested successfully",
-            log_id=log_id,
-            alert_created=alert_created,
-            alert_id=alert_id,
-            anomaly_score=anomaly_score if is_anomaly or anomaly_score > 0.5 else None
+@router.post("/logs/async", response_model=LogEventResponse, status_code=status.HTTP_202_ACCEPTED)
+async def ingest_log_async(
+    log_event: LogEvent,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """
+    Persist a log event and queue it for detection.
+
+    Returns 202 as soon as the raw event is stored; rule and anomaly detection
+    run on a bounded worker pool. When the queue is full the event is not
+    stored and 503 is returned with a Retry-After header; an event over its
+    organisation's or host's ingest rate gets 429 with Retry-After.
+
+    Returns:
+        LogEventResponse with the log_id of the stored event
+    """
+    log_rate_limiter.acquire([(log_event.organisation_id, log_event.host)])
+
+    service = IngestionService(db)
+    log_dict = service.build_log_document(log_event)
+    log_id = log_dict["log_id"]
+
+    if not ingest_policies.should_store(log_dict):
+        return service.build_aggregated_response()
+
+    if await service.is_duplicate(log_dict):
+        return service.build_duplicate_response()
+
+    try:
+        persisted = ingest_queue.reserve(log_event, log_id)
+    except IngestQueueFull as e:
+        ingest_policies.forget(log_dict)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Ingest queue is full, retry later",
+            headers={"Retry-After": str(e.retry_after)}
         )
 
+    try:
+        # Spooled events get detection when they are replayed, not from this slot
+        persisted.set_result(await get_log_buffer().insert(log_dict))
+
+    except DuplicateKeyError:
+        return service.build_duplicate_response()
+
     except Exception as e:
+        ingest_policies.forget(log_dict)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to ingest log: {str(e)}"
         )
+
+    finally:
+        # Release the slot on every other way out, including a cancelled request,
+        # or its worker would wait on it forever
+        if not persisted.done():
+            persisted.set_result(False)
+
+    return LogEventResponse(
+        success=True,
+        message="Log event accepted for detection",
+        log_id=log_id
+    )
+
+
+@router.post(
+    "/logs/batch",
+    response_model=LogBatchResponse,
+    status_code=status.HTTP_201_CREATED,
+    openapi_extra=request_body_openapi(List[LogEvent])
+)
+async def ingest_log_batch(
+    request: Request,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """
+    Ingest a batch of log events in one request.
+
+    The body is a list of LogEvent objects. It is validated straight into
+    MongoDB-ready dicts with a cached TypeAdapter instead of building a
+    LogEvent model per event.
+
+    All events are stored with a single insert_many, detection runs over the
+    whole batch, and alerts and endpoint updates are written with bulk_write.
+
+    Returns:
+        LogBatchResponse with one result per event, in request order
+    """
+    log_events = await validate_body(request, log_event_list_adapter)
+
+    if len(log_events) > settings.max_ingest_batch_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch exceeds the maximum of {settings.max_ingest_batch_size} events"
+        )
+
+    # Every event in the batch costs one token
+    log_rate_limiter.acquire((event["organisation_id"], event["host"]) for event in log_events)
+
+    try:
+        return await IngestionService(db).ingest_batch(log_events)
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to ingest log batch: {str(e)}"
+        )
+
+
+@router.post("/logs/stream", response_model=LogStreamSummary)
+async def ingest_log_stream(
+    request: Request,
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    """
+    Ingest newline-delimited JSON (NDJSON) log events from a streamed body.
+
+    Intended for backfills and SIEM forwarders. The body is parsed
+    incrementally and flushed to the database in fixed-size chunks while the
+    upload is still arriving, so arbitrarily large uploads use flat memory.
+    Invalid lines are rejected individually without aborting the stream.
+    Instead of 429, an upload over its organisation's or hosts' ingest rate
+    is paced: the next chunk is read once its tokens are available.
+
+    Returns:
+        LogStreamSummary with accepted, rejected and alert counts
+    """
+    try:
+        return await IngestionService(db).ingest_stream(request.stream())
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to ingest log stream: {str(e)}"
+        )
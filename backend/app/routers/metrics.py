@@ -0,0 +1,143 @@
+"""Operational metrics for sizing the ingest pipeline"""
+from fastapi import APIRouter
+
+from ..services.anomaly_detection import model_trainer
+from ..services.correlation import correlation_engine
+from ..services.detection_rules import detection_rules
+from ..services.distinct_counts import distinct_counts
+from ..services.ingest_policy import ingest_policies
+from ..services.ingest_queue import ingest_queue
+from ..services.model_registry import model_registry
+from ..services.rate_limiter import log_rate_limiter, telemetry_rate_limiter
+from ..services.rule_metrics import rule_metrics
+from ..services.window_state import window_state
+from ..spool import spool
+
+router = APIRouter(prefix="/api/metrics", tags=["Metrics"])
+
+
+@router.get("/ingest-queue")
+async def ingest_queue_metrics():
+    """
+    Async ingest queue metrics.
+
+    Reports queue depth and capacity, busy workers, cumulative worker
+    utilisation (0-1), processed/failed/rejected counts and the wait time
+    between enqueue and detection over the last 1000 events.
+    """
+    return ingest_queue.stats()
+
+
+@router.get("/spool")
+async def spool_metrics():
+    """
+    On-disk ingest spool metrics.
+
+    Documents spooled and replayed since startup, and the number of segments
+    still waiting to be replayed (non-zero while MongoDB is degraded).
+    """
+    return {
+        "spooled": spool.spooled,
+        "replayed": spool.replayed,
+        "pending_segments": spool.pending_segments,
+    }
+
+
+@router.get("/rate-limits")
+async def rate_limit_metrics():
+    """
+    Ingest rate limiter metrics.
+
+    Configured rates and bursts, events admitted, throttled (rejected with
+    429) and delayed (paced streamed uploads) since startup, and the
+    organisations throttled most, for the log and telemetry limiters.
+    """
+    return {
+        limiter.name: limiter.stats()
+        for limiter in (log_rate_limiter, telemetry_rate_limiter)
+    }
+
+
+@router.get("/ingest-policies")
+async def ingest_policy_metrics():
+    """
+    Per-event-type ingest policy metrics.
+
+    The configured policy for each event type and how many events were
+    stored, skipped (unchanged or downsampled) and folded into endpoint
+    documents since startup.
+    """
+    return ingest_policies.stats()
+
+
+@router.get("/rule-windows")
+async def rule_window_metrics():
+    """
+    Sliding-window rule state metrics.
+
+    Whether the windowed rules are answered from memory (``ready`` once the
+    startup rebuild succeeded) and how many per-user windows are held.
+    """
+    return window_state.stats()
+
+
+@router.get("/distinct-counts")
+async def distinct_count_metrics():
+    """
+    HyperLogLog distinct-count metrics.
+
+    Whether the sketches are in use, how many per-user, per-host and
+    per-organisation windows are held, and their register memory.
+    """
+    return distinct_counts.stats()
+
+
+@router.get("/rules")
+async def rule_metrics_endpoint():
+    """
+    Per-rule evaluation metrics.
+
+    For each built-in rule, and for the declarative and correlation stages:
+    events evaluated, alerts raised (hits and hit rate), evaluations slower
+    than ``rule_latency_budget_ms`` and latency histograms split into time
+    spent awaiting MongoDB and the rule's own CPU time, per event.
+    """
+    return rule_metrics.stats()
+
+
+@router.get("/detection-rules")
+async def detection_rule_metrics():
+    """
+    Declarative detection rule metrics.
+
+    Rules loaded (and how many keep window state), organisations with rule
+    sets of their own, when the rules were last reloaded, events evaluated
+    and the rules rejected by the last reload.
+    """
+    return detection_rules.stats()
+
+
+@router.get("/correlation")
+async def correlation_metrics():
+    """
+    Correlation engine metrics.
+
+    Sequence rules loaded, partial matches held and timer wheel entries,
+    events evaluated, sequences completed, partial matches expired or
+    evicted, and the rules rejected by the last reload.
+    """
+    return correlation_engine.stats()
+
+
+@router.get("/anomaly-models")
+async def anomaly_model_metrics():
+    """
+    Anomaly model registry metrics.
+
+    Models cached in this process and their pickled size against the memory
+    budget, cache hits, loads from MongoDB, reloads after a retrain on
+    another worker, LRU evictions and requests that waited on another's load,
+    plus the organisations being trained in the background and how many
+    training runs produced a model, had too few logs or failed.
+    """
+    return {**model_registry.stats(), "training": model_trainer.stats()}
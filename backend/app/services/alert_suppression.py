@@ -0,0 +1,174 @@
+"""Alert deduplication: repeats of an open alert are folded into it"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import ConnectionFailure
+
+from ..config import get_settings
+from ..database import assign_ids, spool_copies
+from ..spool import spool
+from .dedup import content_fingerprint
+
+settings = get_settings()
+
+# Fields refreshed on every repeat; everything else is kept from the first occurrence
+REPEAT_FIELDS = ("description", "updated_at")
+
+
+def suppression_key(alert_doc: Dict) -> str:
+    """Key of the alerts a document is a repeat of: (organisation, rule, host, user)."""
+    return content_fingerprint(
+        alert_doc["organisation_id"],
+        alert_doc.get("rule_name") or alert_doc.get("triggered_by"),
+        alert_doc.get("host"),
+        alert_doc.get("user")
+    )
+
+
+class AlertWriter:
+    """
+    Writes alert documents, folding repeats into the matching open alert.
+
+    An alert is a repeat when an open alert with the same suppression key
+    was last seen within ``alert_suppression_window_minutes``. Repeats are
+    applied with one upsert per key: ``occurrence_count`` is incremented,
+    ``last_seen`` is advanced, ``updated_at`` and ``description`` are
+    refreshed and the related log/telemetry ids are appended (capped at
+    ``alert_related_ids_max``). When no such alert exists the upsert inserts
+    the document as a new alert. Repeats within one call are merged before
+    the write, so a batch issues one update per key.
+
+    A window of 0 disables suppression and inserts every alert.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+
+    @staticmethod
+    def _merge(alert_docs: List[Dict]) -> "OrderedDict[str, Tuple[Dict, int, Dict[str, List[str]]]]":
+        """Group documents by suppression key: (document to insert, occurrences, related ids)."""
+        groups: "OrderedDict[str, Tuple[Dict, int, Dict[str, List[str]]]]" = OrderedDict()
+        for doc in alert_docs:
+            key = suppression_key(doc)
+            first, count, related = groups.get(key, (doc, 0, {}))
+            for field in ("related_log_ids", "related_telemetry_ids"):
+                if doc.get(field):
+                    related.setdefault(field, []).extend(doc[field])
+            # The first document is inserted if nothing matches; later ones only refresh REPEAT_FIELDS
+            if first is not doc:
+                first = {
+                    **first,
+                    **{field: doc[field] for field in REPEAT_FIELDS if field in doc},
+                    "last_seen": max(first["last_seen"], doc["last_seen"]),
+                }
+            groups[key] = (first, count + doc.get("occurrence_count", 1), related)
+        return groups
+
+    @staticmethod
+    def _upsert(key: str, doc: Dict, count: int, related: Dict[str, List[str]], since: datetime) -> UpdateOne:
+        repeat = {field: doc[field] for field in REPEAT_FIELDS if field in doc}
+        on_insert = {
+            field: value for field, value in doc.items()
+            if field not in repeat and field not in related
+            and field not in ("organisation_id", "suppression_key", "status", "last_seen", "occurrence_count")
+        }
+        update = {
+            "$setOnInsert": on_insert,
+            "$set": repeat,
+            "$max": {"last_seen": doc["last_seen"]},
+            "$inc": {"occurrence_count": count},
+        }
+        if related:
+            update["$push"] = {
+                field: {"$each": ids, "$slice": -settings.alert_related_ids_max}
+                for field, ids in related.items()
+            }
+        return UpdateOne(
+            {
+                "organisation_id": doc["organisation_id"],
+                "suppression_key": key,
+                "status": "open",
+                "last_seen": {"$gte": since},
+            },
+            update,
+            upsert=True
+        )
+
+    async def write(self, alert_docs: List[Dict]) -> Dict[str, str]:
+        """
+        Store alert documents, folding repeats.
+
+        Args:
+            alert_docs: Alert documents as built by the detection code; they
+                gain ``suppression_key``, ``occurrence_count`` and ``last_seen``
+
+        Returns:
+            Map of each document's ``alert_id`` to the id of the alert it was
+            stored as (itself when new, the open alert when folded)
+        """
+        if not alert_docs:
+            return {}
+
+        for doc in alert_docs:
+            doc["occurrence_count"] = doc.get("occurrence_count") or 1
+            doc["last_seen"] = doc.get("last_seen") or doc["created_at"]
+
+        if settings.alert_suppression_window_minutes <= 0:
+            await self.db.alerts.insert_many(alert_docs, ordered=False)
+            return {doc["alert_id"]: doc["alert_id"] for doc in alert_docs}
+
+        for doc in alert_docs:
+            doc["suppression_key"] = suppression_key(doc)
+
+        since = datetime.utcnow() - timedelta(minutes=settings.alert_suppression_window_minutes)
+        groups = self._merge(alert_docs)
+        keys = list(groups)
+        result = await self.db.alerts.bulk_write(
+            [self._upsert(key, *groups[key], since) for key in keys],
+            ordered=False
+        )
+
+        # Keys that matched an existing alert need its id; one lookup covers them all
+        inserted = {keys[index] for index in result.upserted_ids}
+        stored_as = {key: groups[key][0]["alert_id"] for key in inserted}
+        folded = [key for key in keys if key not in inserted]
+        if folded:
+            cursor = self.db.alerts.find(
+                {
+                    "organisation_id": {"$in": list({groups[key][0]["organisation_id"] for key in folded})},
+                    "suppression_key": {"$in": folded},
+                    "status": "open",
+                    "last_seen": {"$gte": since},
+                },
+                {"alert_id": 1, "suppression_key": 1, "last_seen": 1}
+            ).sort("last_seen", 1)
+            async for existing in cursor:
+                stored_as[existing["suppression_key"]] = existing["alert_id"]
+
+        return {
+            doc["alert_id"]: stored_as.get(doc["suppression_key"], doc["alert_id"])
+            for doc in alert_docs
+        }
+
+    async def write_or_spool(self, alert_docs: List[Dict]) -> Dict[str, str]:
+        """
+        ``write`` with the same fallback as ``database.write_or_spool``.
+
+        Documents get their ``_id`` before the first attempt, so an alert
+        whose write timed out but reached the server is not stored twice
+        when the spool is replayed.
+
+        Returns:
+            The map returned by ``write``; a spooled alert maps to itself.
+            Spooled alerts are replayed as plain inserts, without suppression
+        """
+        assign_ids(alert_docs)
+        try:
+            return await asyncio.wait_for(self.write(alert_docs), timeout=settings.mongo_write_timeout_seconds)
+        except (asyncio.TimeoutError, ConnectionFailure):
+            await spool.append("alerts", spool_copies(alert_docs))
+            return {doc["alert_id"]: doc["alert_id"] for doc in alert_docs}
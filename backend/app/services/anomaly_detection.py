@@ -1,14 +1,25 @@
 """Anomaly detection service using ML"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
+import asyncio
+import logging
+import multiprocessing
 import pickle
 import hashlib
+import time
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
 
 from ..config import get_settings
+from ..database import meta_query
 from ..models.schemas import LogEvent
+from .distinct_counts import distinct_counts
+from .model_registry import MODEL_TYPE, ModelEntry, model_registry
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
 
 # Try to import sklearn - make it optional
 SKLEARN_AVAILABLE = False
@@ -25,19 +36,25 @@ except ImportError:
     IsolationForest = None
     StandardScaler = None
 
+# Fields fetched for training; the rest of the stored log is not needed to rebuild a LogEvent
+_TRAINING_FIELDS = {name: 1 for name in LogEvent.model_fields}
+_TRAINING_FIELDS["_id"] = 0
+
 
 class AnomalyDetector:
     """
     Anomaly detection service using Isolation Forest.
     Maintains per-organisation models for detecting anomalous behavior.
+
+    Models are held in the process-wide ``model_registry``, so detectors
+    created per request share them instead of unpickling on every event.
     """
 
     def __init__(self, db: AsyncIOMotorDatabase):
         self.db = db
-        self.models: Dict[str, IsolationForest] = {}
-        self.scalers: Dict[str, StandardScaler] = {}
 
-    def extract_features(self, log_event: LogEvent, historical_context: Optional[Dict] = None):
+    @staticmethod
+    def extract_features(log_event: LogEvent, historical_context: Optional[Dict] = None):
         """
         Extract numeric features from a log event for anomaly detection.
 
@@ -98,60 +115,148 @@ class AnomalyDetector:
         twenty_four_hours_ago = datetime.utcnow() - timedelta(hours=24)
 
         # Failed login count for this user in last hour
-        failed_login_count = await self.db.logs.count_documents({
+        failed_login_count = await self.db.logs.count_documents(meta_query("logs", {
             "organisation_id": log_event.organisation_id,
             "user": log_event.user,
             "event_type": "login",
             "details.success": False,
             "timestamp": {"$gte": one_hour_ago}
-        })
+        }))
 
         # User event count in last hour
-        user_event_count = await self.db.logs.count_documents({
+        user_event_count = await self.db.logs.count_documents(meta_query("logs", {
             "organisation_id": log_event.organisation_id,
             "user": log_event.user,
             "timestamp": {"$gte": one_hour_ago}
-        })
+        }))
 
         # Host event count in last hour
-        host_event_count = await self.db.logs.count_documents({
+        host_event_count = await self.db.logs.count_documents(meta_query("logs", {
             "organisation_id": log_event.organisation_id,
             "host": log_event.host,
             "timestamp": {"$gte": one_hour_ago}
-        })
+        }))
+
+        # Unique hosts for this user and users for this host in last 24h
+        if settings.distinct_counts_enabled and distinct_counts.ready:
+            unique_hosts_for_user = distinct_counts.hosts_for_user(log_event.organisation_id, log_event.user)
+            unique_users_for_host = distinct_counts.users_for_host(log_event.organisation_id, log_event.host)
+        else:
+            unique_hosts_for_user, unique_users_for_host = await self._distinct_counts_from_logs(
+                log_event, twenty_four_hours_ago
+            )
+
+        return {
+            "failed_login_count": failed_login_count,
+            "user_event_count_1h": user_event_count,
+            "host_event_count_1h": host_event_count,
+            "unique_hosts_for_user": unique_hosts_for_user,
+            "unique_users_for_host": unique_users_for_host
+        }
+
+    async def get_historical_contexts(
+        self, organisation_id: str, log_events: List[LogEvent]
+    ) -> Dict[Tuple[str, str], Dict]:
+        """
+        Historical context for many events of one organisation with a single aggregation.
+
+        Events are grouped per (user, host) over the last 24 hours for the
+        users and hosts involved; the hourly counts and distinct counts of
+        ``get_historical_context`` are then derived from those groups.
 
-        # Unique hosts for this user in last 24h
+        Returns:
+            Context per (user, host), as ``get_historical_context`` returns it
+        """
+        now = datetime.utcnow()
+        one_hour_ago = now - timedelta(hours=1)
+        twenty_four_hours_ago = now - timedelta(hours=24)
+        users = sorted({e.user for e in log_events})
+        hosts = sorted({e.host for e in log_events})
+
+        recent = {"$gte": ["$timestamp", one_hour_ago]}
+        pipeline = [
+            {"$match": meta_query("logs", {
+                "organisation_id": organisation_id,
+                "timestamp": {"$gte": twenty_four_hours_ago},
+                "$or": [{"user": {"$in": users}}, {"host": {"$in": hosts}}]
+            })},
+            {"$group": {
+                "_id": {"user": "$user", "host": "$host"},
+                "events_1h": {"$sum": {"$cond": [recent, 1, 0]}},
+                "failed_logins_1h": {"$sum": {"$cond": [
+                    {"$and": [
+                        recent,
+                        {"$eq": ["$event_type", "login"]},
+                        {"$eq": ["$details.success", False]}
+                    ]}, 1, 0
+                ]}},
+            }}
+        ]
+
+        failed_logins: Dict[str, int] = {}
+        user_events: Dict[str, int] = {}
+        host_events: Dict[str, int] = {}
+        hosts_for_user: Dict[str, int] = {}
+        users_for_host: Dict[str, int] = {}
+        async for row in self.db.logs.aggregate(pipeline):
+            user, host = row["_id"].get("user"), row["_id"].get("host")
+            failed_logins[user] = failed_logins.get(user, 0) + row["failed_logins_1h"]
+            user_events[user] = user_events.get(user, 0) + row["events_1h"]
+            host_events[host] = host_events.get(host, 0) + row["events_1h"]
+            hosts_for_user[user] = hosts_for_user.get(user, 0) + 1
+            users_for_host[host] = users_for_host.get(host, 0) + 1
+
+        use_sketches = settings.distinct_counts_enabled and distinct_counts.ready
+        contexts: Dict[Tuple[str, str], Dict] = {}
+        for log_event in log_events:
+            key = (log_event.user, log_event.host)
+            if key in contexts:
+                continue
+            if use_sketches:
+                unique_hosts_for_user = distinct_counts.hosts_for_user(organisation_id, log_event.user)
+                unique_users_for_host = distinct_counts.users_for_host(organisation_id, log_event.host)
+            else:
+                unique_hosts_for_user = hosts_for_user.get(log_event.user, 0)
+                unique_users_for_host = users_for_host.get(log_event.host, 0)
+            contexts[key] = {
+                "failed_login_count": failed_logins.get(log_event.user, 0),
+                "user_event_count_1h": user_events.get(log_event.user, 0),
+                "host_event_count_1h": host_events.get(log_event.host, 0),
+                "unique_hosts_for_user": unique_hosts_for_user,
+                "unique_users_for_host": unique_users_for_host
+            }
+        return contexts
+
+    async def _distinct_counts_from_logs(self, log_event: LogEvent, since: datetime) -> Tuple[int, int]:
+        """Distinct hosts for the user and users for the host since ``since``, with distinct()."""
         unique_hosts = await self.db.logs.distinct(
             "host",
-            {
+            meta_query("logs", {
                 "organisation_id": log_event.organisation_id,
                 "user": log_event.user,
-                "timestamp": {"$gte": twenty_four_hours_ago}
-            }
+                "timestamp": {"$gte": since}
+            })
         )
 
-        # Unique users for this host in last 24h
         unique_users = await self.db.logs.distinct(
             "user",
-            {
+            meta_query("logs", {
                 "organisation_id": log_event.organisation_id,
                 "host": log_event.host,
-                "timestamp": {"$gte": twenty_four_hours_ago}
-            }
+                "timestamp": {"$gte": since}
+            })
         )
 
-        return {
-            "failed_login_count": failed_login_count,
-            "user_event_count_1h": user_event_count,
-            "host_event_count_1h": host_event_count,
-            "unique_hosts_for_user": len(unique_hosts),
-            "unique_users_for_host": len(unique_users)
-        }
+        return len(unique_hosts), len(unique_users)
 
     async def train_model(self, organisation_id: str) -> bool:
         """
         Train or retrain the anomaly detection model for an organisation.
 
+        The logs are fetched here; feature extraction and fitting run in the
+        ``model_trainer`` process pool. Concurrent calls for an organisation
+        share one training run.
+
         Returns:
             True if model was trained successfully, False otherwise
         """
@@ -159,84 +264,66 @@ class AnomalyDetector:
         if not SKLEARN_AVAILABLE:
             return False
 
+        return await model_registry.single_flight(
+            ("train", organisation_id), lambda: self._train_model(organisation_id)
+        )
+
+    async def _train_model(self, organisation_id: str) -> bool:
         # Get historical logs for training
         seven_days_ago = datetime.utcnow() - timedelta(days=7)
 
-        cursor = self.db.logs.find({
+        cursor = self.db.logs.find(meta_query("logs", {
             "organisation_id": organisation_id,
             "timestamp": {"$gte": seven_days_ago}
-        }).limit(10000)
+        }), _TRAINING_FIELDS).limit(10000)
 
         logs = await cursor.to_list(length=10000)
 
         if len(logs) < settings.min_samples_for_training:
             return False
 
-        # Extract features from historical logs
-        feature_list = []
-        for log_dict in logs:
-            # Convert dict to LogEvent
-            log_event = LogEvent(**log_dict)
-            # For training, use simpler features (no historical context to avoid complexity)
-            features = self.extract_features(log_event, None)
-            feature_list.append(features.flatten())
-
-        X = np.array(feature_list)
-
-        # Train scaler
-        scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(X)
-
-        # Train Isolation Forest
-        model = IsolationForest(
-            contamination=0.1,  # Assume 10% of data might be anomalous
-            random_state=42,
-            n_estimators=100
-        )
-        model.fit(X_scaled)
-
-        # Store model and scaler
-        self.models[organisation_id] = model
-        self.scalers[organisation_id] = scaler
+        model_bytes, scaler_bytes = await model_trainer.fit(logs)
+        model, scaler = await asyncio.to_thread(lambda: (pickle.loads(model_bytes), pickle.loads(scaler_bytes)))
 
-        # Persist to database
-        await self.save_model(organisation_id, model, scaler)
+        # Persist to database, then share with the other requests in this process
+        await self._store_model(organisation_id, model, scaler, model_bytes, scaler_bytes)
 
         return True
 
     async def save_model(self, organisation_id: str, model: IsolationForest, scaler: StandardScaler):
-        """Save model and scaler to database"""
-        model_bytes = pickle.dumps(model)
-        scaler_bytes = pickle.dumps(scaler)
+        """
+        Save model and scaler to database and cache them in the model registry.
+
+        Every save increments the document's ``version``, which tells other
+        workers that their cached copy is stale.
+        """
+        await self._store_model(organisation_id, model, scaler, pickle.dumps(model), pickle.dumps(scaler))
 
-        await self.db.ml_models.update_one(
-            {"organisation_id": organisation_id, "model_type": "anomaly_detection"},
+    async def _store_model(self, organisation_id: str, model, scaler, model_bytes: bytes, scaler_bytes: bytes):
+        doc = await self.db.ml_models.find_one_and_update(
+            {"organisation_id": organisation_id, "model_type": MODEL_TYPE},
             {
                 "$set": {
                     "model": model_bytes,
                     "scaler": scaler_bytes,
                     "updated_at": datetime.utcnow()
-                }
+                },
+                "$inc": {"version": 1}
             },
-            upsert=True
+            projection={"version": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
 
-    async def load_model(self, organisation_id: str) -> bool:
-        """Load model and scaler from database"""
-        doc = await self.db.ml_models.find_one({
-            "organisation_id": organisation_id,
-            "model_type": "anomaly_detection"
-        })
-
-        if not doc:
-            return False
+        model_registry.put(
+            organisation_id, model, scaler,
+            version=doc["version"],
+            nbytes=len(model_bytes) + len(scaler_bytes)
+        )
 
-        try:
-            self.models[organisation_id] = pickle.loads(doc["model"])
-            self.scalers[organisation_id] = pickle.loads(doc["scaler"])
-            return True
-        except Exception:
-            return False
+    async def load_model(self, organisation_id: str) -> bool:
+        """Load model and scaler from database (or the model registry)"""
+        return await model_registry.get(self.db, organisation_id) is not None
 
     async def predict_anomaly(self, log_event: LogEvent) -> Tuple[bool, float]:
         """
@@ -252,13 +339,10 @@ class AnomalyDetector:
         org_id = log_event.organisation_id
 
         # Load or train model if not in memory
-        if org_id not in self.models:
-            loaded = await self.load_model(org_id)
-            if not loaded:
-                trained = await self.train_model(org_id)
-                if not trained:
-                    # Not enough data to train
-                    return False, 0.0
+        entry = await self._ensure_model(org_id)
+        if entry is None:
+            # Not enough data to train
+            return False, 0.0
 
         # Get historical context
         historical_context = await self.get_historical_context(log_event)
@@ -266,22 +350,76 @@ class AnomalyDetector:
         # Extract features
         features = self.extract_features(log_event, historical_context)
 
+        return self._score(entry, features)[0]
+
+    async def predict_batch(self, log_events: List[LogEvent]) -> List[Tuple[bool, float]]:
+        """
+        Predict anomalies for a batch of log events.
+
+        Each organisation's model is loaded once, historical context for all
+        of an organisation's events is fetched with one aggregation and every
+        event of an organisation is scored in a single vectorised call.
+
+        Returns:
+            One (is_anomaly, anomaly_score) tuple per input event, in input order
+        """
+        results: List[Tuple[bool, float]] = [(False, 0.0)] * len(log_events)
+
+        if not SKLEARN_AVAILABLE:
+            return results
+
+        by_org: Dict[str, List[int]] = {}
+        for index, log_event in enumerate(log_events):
+            by_org.setdefault(log_event.organisation_id, []).append(index)
+
+        for org_id, indexes in by_org.items():
+            entry = await self._ensure_model(org_id)
+            if entry is None:
+                continue
+
+            contexts = await self.get_historical_contexts(org_id, [log_events[index] for index in indexes])
+            rows = [
+                self.extract_features(log_events[index], contexts[(log_events[index].user, log_events[index].host)])
+                for index in indexes
+            ]
+
+            for index, result in zip(indexes, self._score(entry, np.vstack(rows))):
+                results[index] = result
+
+        return results
+
+    async def _ensure_model(self, org_id: str) -> Optional[ModelEntry]:
+        """
+        The organisation's model from the registry, loading it if needed.
+
+        Without a stored model, training is started in the background and
+        None ("no model yet") is returned straight away; events are scored
+        once the trained model has been published to the registry.
+        """
+        entry = await model_registry.get(self.db, org_id)
+        if entry is None:
+            model_trainer.schedule(self.db, org_id)
+        return entry
+
+    def _score(self, entry: ModelEntry, features) -> List[Tuple[bool, float]]:
+        """Score a feature matrix with the organisation's model."""
         # Scale features
-        scaler = self.scalers[org_id]
+        scaler = entry.scaler
         features_scaled = scaler.transform(features)
 
         # Predict
-        model = self.models[org_id]
-        prediction = model.predict(features_scaled)[0]  # -1 for anomaly, 1 for normal
-        anomaly_score_raw = model.score_samples(features_scaled)[0]
+        model = entry.model
+        predictions = model.predict(features_scaled)  # -1 for anomaly, 1 for normal
+        anomaly_scores_raw = model.score_samples(features_scaled)
 
         # Convert to 0-1 score (higher = more anomalous)
         # Isolation Forest scores are negative, more negative = more anomalous
-        anomaly_score = 1 / (1 + np.exp(anomaly_score_raw))  # Sigmoid transformation
-
-        is_anomaly = prediction == -1 or anomaly_score > settings.anomaly_threshold
+        anomaly_scores = 1 / (1 + np.exp(anomaly_scores_raw))  # Sigmoid transformation
 
-        return is_anomaly, float(anomaly_score)
+        return [
+            (bool(prediction == -1 or score > settings.anomaly_threshold), float(score))
+            for prediction, score in zip(predictions, anomaly_scores)
+        ]
 
     async def retrain_all_models(self):
         """Retrain models for all organisations (background task)"""
@@ -296,3 +434,144 @@ class AnomalyDetector:
                 await self.train_model(org_id)
             except Exception as e:
                 print(f"Failed to train model for {org_id}: {e}")
+
+
+def _fit(log_docs: List[Dict]) -> Tuple[bytes, bytes]:
+    """Fit the scaler and Isolation Forest on stored logs; runs in a training process."""
+    # For training, use simpler features (no historical context to avoid complexity)
+    X = np.array([
+        AnomalyDetector.extract_features(LogEvent(**log_dict), None).flatten()
+        for log_dict in log_docs
+    ])
+
+    # Train scaler
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(X)
+
+    # Train Isolation Forest
+    model = IsolationForest(
+        contamination=0.1,  # Assume 10% of data might be anomalous
+        random_state=42,
+        n_estimators=100
+    )
+    model.fit(X_scaled)
+
+    return pickle.dumps(model), pickle.dumps(scaler)
+
+
+class ModelTrainer:
+    """
+    Runs anomaly model training off the event loop.
+
+    Feature extraction and ``IsolationForest.fit`` run in a pool of
+    ``anomaly_training_workers`` processes, created on first use. Training
+    requested from the ingest path is scheduled as a background task per
+    organisation; an organisation whose last attempt did not produce a model
+    (too few logs, or an error) is not retried for
+    ``anomaly_training_retry_seconds``.
+    """
+
+    def __init__(self):
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._attempted_at: Dict[str, float] = {}
+        self.trained = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forked children would inherit the parent's Motor client and event loop
+            self._pool = ProcessPoolExecutor(
+                max_workers=settings.anomaly_training_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def fit(self, log_docs: List[Dict]) -> Tuple[bytes, bytes]:
+        """
+        Fit a model on stored logs in the training pool.
+
+        Returns:
+            Pickled (model, scaler)
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor(), _fit, log_docs)
+        except BrokenProcessPool:
+            # A training process died (e.g. out of memory); start a fresh pool next time
+            self._pool = None
+            raise
+
+    def training(self, organisation_id: str) -> bool:
+        """Whether a background training run is in progress for the organisation."""
+        return organisation_id in self._tasks
+
+    def schedule(self, db: AsyncIOMotorDatabase, organisation_id: str) -> bool:
+        """
+        Start training the organisation's model in the background.
+
+        Returns:
+            True if training is running, False if it was attempted too recently
+        """
+        if organisation_id in self._tasks:
+            return True
+        attempted_at = self._attempted_at.get(organisation_id)
+        if attempted_at is not None and time.monotonic() - attempted_at < settings.anomaly_training_retry_seconds:
+            return False
+
+        self._remember_attempt(organisation_id)
+        task = asyncio.create_task(self._train(db, organisation_id))
+        self._tasks[organisation_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(organisation_id, None))
+        return True
+
+    def _remember_attempt(self, organisation_id: str):
+        """
+        Record a training attempt, dropping attempts older than the retry interval.
+
+        Attempts are kept in insertion order, oldest first, so expired ones
+        are popped from the front and the dict only holds organisations
+        attempted within the last ``anomaly_training_retry_seconds``.
+        """
+        now = time.monotonic()
+        self._attempted_at.pop(organisation_id, None)
+        while self._attempted_at:
+            oldest = next(iter(self._attempted_at))
+            if now - self._attempted_at[oldest] < settings.anomaly_training_retry_seconds:
+                break
+            del self._attempted_at[oldest]
+        self._attempted_at[organisation_id] = now
+
+    async def _train(self, db: AsyncIOMotorDatabase, organisation_id: str):
+        try:
+            if await AnomalyDetector(db).train_model(organisation_id):
+                self.trained += 1
+                self._attempted_at.pop(organisation_id, None)
+            else:
+                self.skipped += 1
+        except Exception as e:
+            self.failed += 1
+            logger.warning("Training the anomaly model of %s failed: %s", organisation_id, e)
+
+    async def stop(self):
+        """Cancel background training and shut the training pool down."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> Dict:
+        return {
+            "workers": settings.anomaly_training_workers,
+            "training": sorted(self._tasks),
+            "trained": self.trained,
+            "skipped": self.skipped,
+            "failed": self.failed,
+        }
+
+
+model_trainer = ModelTrainer()
@@ -3,7 +3,12 @@ from datetime import datetime, timedelta
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from typing import List, Dict
 
+from ..config import get_settings
 from ..models.schemas import ComplianceControl, ControlStatus, AlertSeverity
+from .distinct_counts import distinct_counts
+from .log_rollups import LogRollupService
+
+settings = get_settings()
 
 
 class ComplianceService:
@@ -97,10 +102,12 @@ class ComplianceService:
         # Audit Controls - check if logging is comprehensive
         elif category == "audit":
             total_endpoints = await self.db.endpoints.count_documents({"organisation_id": organisation_id})
-            endpoints_with_logs = len(await self.db.logs.distinct(
-                "host",
-                {"organisation_id": organisation_id, "timestamp": {"$gte": thirty_days_ago}}
-            ))
+            if settings.distinct_counts_enabled and distinct_counts.ready:
+                endpoints_with_logs = distinct_counts.hosts_for_organisation(organisation_id)
+            else:
+                endpoints_with_logs = len(
+                    await LogRollupService(self.db).distinct_hosts(organisation_id, since=thirty_days_ago)
+                )
 
             if total_endpoints > 0 and endpoints_with_logs < total_endpoints * 0.9:
                 status = ControlStatus.PARTIAL
@@ -0,0 +1,424 @@
+"""Stateful multi-event correlation: event sequences tracked per organisation and key"""
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+import logging
+import os
+import re
+import time
+import uuid
+
+from pydantic import ValidationError
+
+from ..config import get_settings
+from ..models.schemas import Alert, AlertStatus, CorrelationRuleDefinition, LogEvent
+from ..utils.timer_wheel import TimerWheel
+from .dedup import content_fingerprint
+from .detection_rules import (
+    COMPUTED_FIELDS, WILDCARD, RuleSet, check_template, compile_match, event_values,
+    field_getter, read_rule_file, render_template
+)
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Shipped sequences; the rules file can override them by name or disable them
+BUILT_IN_SEQUENCES: List[Dict] = [
+    {
+        "name": "failed_logins_then_success",
+        "title": "Successful Login After Repeated Failures - {user}",
+        "description": (
+            "User {user} logged on to {host} after {first_count} failed login attempts "
+            "within {duration_minutes} minutes (possible credential compromise, {technique})"
+        ),
+        "severity": "high",
+        "technique": "T1078",
+        "key": ["user"],
+        "steps": [
+            {"event_types": ["login"], "match": {"details.success": False}, "count": 5},
+            {"event_types": ["login"], "match": {"details.success": True}},
+        ],
+        "within_minutes": 10,
+    },
+]
+
+
+# Literal types an equality predicate can be looked up by in a dispatch index
+_INDEXABLE = (str, int, float, bool)
+
+Dispatch = Tuple[List["CompiledSequence"], Dict[str, Tuple[Callable, Dict[Any, List["CompiledSequence"]]]]]
+
+
+def _discriminator(match: Dict[str, Any]) -> Optional[Tuple[str, Any]]:
+    """A (field, literal) equality the match block requires, if it has one."""
+    for field, spec in match.items():
+        if field in ("any", "not") or field in COMPUTED_FIELDS:
+            continue
+        if isinstance(spec, dict):
+            if len(spec) != 1 or "eq" not in spec:
+                continue
+            spec = spec["eq"]
+        if isinstance(spec, _INDEXABLE):
+            return field, spec
+    return None
+
+
+def _epoch_seconds(moment: datetime) -> float:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+class PartialMatch:
+    """Progress of one key through a sequence."""
+
+    __slots__ = ("step", "times", "started", "deadline")
+
+    def __init__(self, first_count: int):
+        self.step = 0
+        self.times: Deque[float] = deque(maxlen=first_count)  # matches of the current step
+        self.started = 0.0
+        self.deadline = 0.0
+
+
+class CompiledSequence:
+    """
+    A correlation rule compiled into per-step predicates, with its partial matches.
+
+    Partial matches are kept per (organisation_id, *key) in an LRU bounded
+    by ``correlation_max_keys``. The first step is a sliding window: its
+    last ``count`` matches within ``within_minutes`` start the sequence.
+    Later steps must then complete before the first match is
+    ``within_minutes`` old, or the partial match expires.
+    """
+
+    def __init__(self, definition: CorrelationRuleDefinition):
+        self.definition = definition
+        self.name = definition.name
+        self.organisation_id = definition.organisation_id
+        self.version = content_fingerprint(definition.model_dump(mode="json"))
+        self.within = definition.within_minutes * 60
+        self.steps = [
+            (compile_match(step.match), set(step.event_types or [WILDCARD]), step.count)
+            for step in definition.steps
+        ]
+        self.discriminators = [_discriminator(step.match) for step in definition.steps]
+        step_types = set().union(*(types for _, types, _ in self.steps))
+        self.event_types = [WILDCARD] if WILDCARD in step_types else sorted(step_types)
+        self.partials: "OrderedDict[Tuple, PartialMatch]" = OrderedDict()
+
+        for field in definition.key:
+            if field in COMPUTED_FIELDS:
+                raise ValueError(f"Cannot key a sequence by computed field {field}")
+        self._key_getters = [field_getter(field) for field in definition.key]
+        check_template(definition.title)
+        check_template(definition.description)
+
+    def _key(self, event: LogEvent) -> Tuple:
+        return (event.organisation_id, *(str(get(event)) for get in self._key_getters))
+
+    def applicable_steps(self, event_type: str) -> List[int]:
+        """Indexes of the steps an event of this type can match."""
+        return [
+            index for index, (_, event_types, _) in enumerate(self.steps)
+            if WILDCARD in event_types or event_type in event_types
+        ]
+
+    def _matches(self, index: int, event: LogEvent) -> bool:
+        predicate, event_types, _ = self.steps[index]
+        return (WILDCARD in event_types or event.event_type in event_types) and predicate(event)
+
+    def advance(self, event: LogEvent, seconds: float, wheel: TimerWheel) -> Tuple[Optional[Alert], int]:
+        """
+        Feed one event at ``seconds`` (event time) to its key's partial match.
+
+        Returns:
+            Tuple of (alert if the sequence completed, partial matches evicted)
+        """
+        key = self._key(event)
+        state = self.partials.get(key)
+        if state is not None:
+            if state.step > 0 and seconds > state.deadline:
+                del self.partials[key]
+                state = None
+            else:
+                self.partials.move_to_end(key)
+
+        if state is not None and state.step > 0:
+            if not self._matches(state.step, event):
+                return None, 0
+            state.times.append(seconds)
+            if len(state.times) < self.steps[state.step][2]:
+                return None, 0
+            return self._complete_step(key, state, event, seconds, wheel), 0
+
+        if not self._matches(0, event):
+            return None, 0
+
+        evicted = 0
+        if state is None:
+            state = self.partials[key] = PartialMatch(self.steps[0][2])
+            while len(self.partials) > settings.correlation_max_keys:
+                self.partials.popitem(last=False)
+                evicted += 1
+
+        state.times.append(seconds)
+        if not self.slide(state, seconds):
+            return None, evicted
+        if len(state.times) < self.steps[0][2]:
+            wheel.schedule((self, key), state.deadline)
+            return None, evicted
+        return self._complete_step(key, state, event, seconds, wheel), evicted
+
+    def slide(self, state: PartialMatch, seconds: float) -> bool:
+        """
+        Drop first-step matches older than ``within_minutes`` before ``seconds``.
+
+        Returns:
+            False if none are left
+        """
+        times = state.times
+        while times and times[0] < seconds - self.within:
+            times.popleft()
+        if not times:
+            return False
+        state.started = times[0]
+        state.deadline = times[0] + self.within
+        return True
+
+    def _complete_step(
+        self, key: Tuple, state: PartialMatch, event: LogEvent, seconds: float, wheel: TimerWheel
+    ) -> Optional[Alert]:
+        state.step += 1
+        if state.step == len(self.steps):
+            del self.partials[key]
+            return self.alert(event, state, seconds)
+
+        state.times = deque(maxlen=self.steps[state.step][2])
+        wheel.schedule((self, key), state.deadline)
+        return None
+
+    def alert(self, event: LogEvent, state: PartialMatch, seconds: float) -> Alert:
+        values = {
+            **event_values(event),
+            "rule": self.name,
+            "technique": self.definition.technique or "",
+            "first_count": self.steps[0][2],
+            "first_seen": datetime.utcfromtimestamp(state.started).isoformat(),
+            "duration_minutes": round((seconds - state.started) / 60, 1),
+        }
+        now = datetime.utcnow()
+        return Alert(
+            alert_id=f"alert_{uuid.uuid4().hex[:16]}",
+            organisation_id=event.organisation_id,
+            title=render_template(self.definition.title, values),
+            description=render_template(self.definition.description or self.definition.title, values),
+            severity=self.definition.severity,
+            status=AlertStatus.OPEN,
+            host=event.host,
+            user=event.user,
+            event_type=event.event_type,
+            triggered_by="rule",
+            rule_name=self.name,
+            created_at=now,
+            updated_at=now
+        )
+
+    def adopt_state(self, previous: "CompiledSequence"):
+        """Keep the partial matches of the same sequence from before a reload."""
+        self.partials = previous.partials
+
+
+class CorrelationEngine:
+    """
+    Complex-event-processing stage that runs after the stateless rules.
+
+    Each sequence keeps a small state machine per (organisation_id, *key).
+    Events are dispatched through an index of the equality literals in the
+    sequences' steps (``details.port: 4444``), per organisation and event
+    type, so only the sequences an event can advance are evaluated, with
+    no database access. Event time drives the sequences; expired partial
+    matches are reclaimed by a timer wheel as the newest event time moves
+    on, instead of scanning every key.
+
+    State is per process and starts empty. Sequences are the built-in ones
+    plus ``correlation_rules_file`` (JSON/YAML), checked for changes at most
+    every ``detection_rules_reload_seconds``; unchanged sequences keep their
+    partial matches across reloads.
+    """
+
+    def __init__(self):
+        self.rule_set = RuleSet([])
+        self.wheel: TimerWheel = TimerWheel()
+        self.watermark = 0.0
+        self.errors: List[str] = []
+        self.loaded_at: Optional[datetime] = None
+        self.evaluated = 0
+        self.completed = 0
+        self.expired = 0
+        self.evicted = 0
+        self._file_mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._dispatch: Dict[Tuple[Optional[str], str], Dispatch] = {}
+        self._organisations: set = set()
+
+    @staticmethod
+    def _file_mtime_now() -> Optional[float]:
+        if not settings.correlation_rules_file:
+            return None
+        try:
+            return os.stat(settings.correlation_rules_file).st_mtime
+        except OSError:
+            return None
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Recompile the sequences if the rules file changed.
+
+        Returns:
+            True if a new rule set was installed
+        """
+        self._checked_at = time.monotonic()
+        mtime = self._file_mtime_now()
+        if not force and self.loaded_at is not None and mtime == self._file_mtime:
+            return False
+        definitions = read_rule_file(settings.correlation_rules_file) if mtime is not None else []
+
+        previous = {(rule.organisation_id, rule.name): rule for rule in self.rule_set.rules}
+        compiled: Dict[Tuple, CompiledSequence] = {}
+        errors: List[str] = []
+        for definition in BUILT_IN_SEQUENCES + definitions:
+            name = definition.get("name", "<unnamed>") if isinstance(definition, dict) else "<invalid>"
+            try:
+                rule = CompiledSequence(CorrelationRuleDefinition.model_validate(definition))
+            except (ValidationError, ValueError, TypeError, re.error) as e:
+                errors.append(f"{name}: {e}")
+                continue
+            compiled[(rule.organisation_id, rule.name)] = rule
+
+        for key, rule in compiled.items():
+            old = previous.get(key)
+            if old is not None and old.version == rule.version:
+                rule.adopt_state(old)
+
+        self.rule_set = RuleSet(list(compiled.values()))
+        self._organisations = set(self.rule_set.organisations)
+        self._dispatch = {}
+        self._file_mtime = mtime
+        self.errors = errors
+        self.loaded_at = datetime.utcnow()
+        for error in errors:
+            logger.warning("Invalid correlation rule %s", error)
+        logger.info("Loaded %d correlation rules (%d invalid)", len(compiled), len(errors))
+        return True
+
+    def _maybe_reload(self):
+        if self.loaded_at is not None and time.monotonic() - self._checked_at < settings.detection_rules_reload_seconds:
+            return
+        try:
+            self.reload()
+        except Exception:
+            logger.exception("Correlation rule reload failed")
+
+    def _dispatch_for(self, organisation_id: str, event_type: str) -> Dispatch:
+        """Sequences that can match an event: (always evaluated, {field: (getter, {literal: sequences})})."""
+        key = (organisation_id if organisation_id in self._organisations else None, event_type)
+        dispatch = self._dispatch.get(key)
+        if dispatch is not None:
+            return dispatch
+
+        generic: List[CompiledSequence] = []
+        index: Dict[str, Tuple[Callable, Dict[Any, List[CompiledSequence]]]] = {}
+        for rule in self.rule_set.rules_for(organisation_id, event_type):
+            discriminators = [rule.discriminators[step] for step in rule.applicable_steps(event_type)]
+            if any(discriminator is None for discriminator in discriminators):
+                generic.append(rule)
+                continue
+            for field, value in set(discriminators):
+                by_value = index.setdefault(field, (field_getter(field), {}))[1]
+                by_value.setdefault(value, []).append(rule)
+
+        if len(self._dispatch) >= 10000:
+            self._dispatch.clear()  # bound the cache against unbounded event types
+        dispatch = self._dispatch[key] = (generic, index)
+        return dispatch
+
+    def _candidates(self, event: LogEvent) -> List[CompiledSequence]:
+        generic, index = self._dispatch_for(event.organisation_id, event.event_type)
+        if not index:
+            return generic
+
+        candidates = list(generic)
+        for getter, by_value in index.values():
+            value = getter(event)
+            if isinstance(value, _INDEXABLE):
+                candidates.extend(by_value.get(value, ()))
+        # A sequence indexed under two fields may be found twice
+        return list(dict.fromkeys(candidates)) if len(index) > 1 else candidates
+
+    def _expire(self):
+        def is_due(entry: Tuple[CompiledSequence, Tuple], deadline: float) -> bool:
+            rule, key = entry
+            state = rule.partials.get(key)
+            return state is not None and state.deadline == deadline
+
+        for rule, key in self.wheel.advance(self.watermark, is_due):
+            state = rule.partials[key]
+            if state.step == 0 and rule.slide(state, self.watermark):
+                # Only the oldest first-step matches expired
+                self.wheel.schedule((rule, key), state.deadline)
+                continue
+            del rule.partials[key]
+            self.expired += 1
+
+    def evaluate_batch(self, log_events: List[LogEvent]) -> List[List[Alert]]:
+        """
+        Advance every relevant sequence with each event, in timestamp order.
+
+        Future-dated events count at the current time, like the windowed rules.
+
+        Returns:
+            One list of alerts (completed sequences) per input event, in input order
+        """
+        results: List[List[Alert]] = [[] for _ in log_events]
+        if not settings.correlation_enabled:
+            return results
+
+        self._maybe_reload()
+        if not self.rule_set.rules:
+            return results
+
+        now = time.time()
+        timed = sorted(
+            (min(_epoch_seconds(event.timestamp), now), index) for index, event in enumerate(log_events)
+        )
+        for seconds, index in timed:
+            event = log_events[index]
+            for rule in self._candidates(event):
+                alert, evicted = rule.advance(event, seconds, self.wheel)
+                self.evicted += evicted
+                if alert is not None:
+                    results[index].append(alert)
+                    self.completed += 1
+            self.watermark = max(self.watermark, seconds)
+
+        self.evaluated += len(log_events)
+        self._expire()
+        return results
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": settings.correlation_enabled,
+            "rules": len(self.rule_set.rules),
+            "partial_matches": sum(len(rule.partials) for rule in self.rule_set.rules),
+            "timer_entries": len(self.wheel),
+            "loaded_at": self.loaded_at,
+            "evaluated": self.evaluated,
+            "completed": self.completed,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "errors": self.errors,
+        }
+
+
+correlation_engine = CorrelationEngine()
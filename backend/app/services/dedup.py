@@ -0,0 +1,144 @@
+"""Duplicate event detection for idempotent ingest"""
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+import hashlib
+import json
+import math
+import time
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ..config import get_settings
+from ..database import meta_query
+
+settings = get_settings()
+
+
+def content_fingerprint(*parts) -> str:
+    """Stable fingerprint of an event's identifying content."""
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over one BLAKE2 digest."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class TimeWindowedBloomFilter:
+    """
+    Bloom filter that forgets items after roughly ``window_seconds``.
+
+    The window is split into ``generations`` filters. New items go into the
+    newest one and lookups check all of them; when the newest generation is
+    older than window/generations the oldest filter is dropped.
+    """
+
+    def __init__(self, capacity: int, error_rate: float, window_seconds: float, generations: int = 4):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.generation_seconds = window_seconds / generations
+        self.generations = generations
+        self._filters: List[BloomFilter] = [BloomFilter(capacity, error_rate)]
+        self._rotated_at = time.monotonic()
+
+    def _rotate(self):
+        now = time.monotonic()
+        if now - self._rotated_at < self.generation_seconds:
+            return
+        self._filters.append(BloomFilter(self.capacity, self.error_rate))
+        del self._filters[:-self.generations]
+        self._rotated_at = now
+
+    def add(self, item: str):
+        self._rotate()
+        self._filters[-1].add(item)
+
+    def __contains__(self, item: str) -> bool:
+        self._rotate()
+        return any(item in bloom for bloom in self._filters)
+
+
+class DuplicateFilter:
+    """
+    Rejects events whose fingerprint was already stored in a collection.
+
+    A time-windowed Bloom filter answers "definitely new" without touching the
+    database. Only fingerprints it may have seen are confirmed with an exact
+    lookup against the collection's unique (organisation_id, fingerprint)
+    index, which also rejects any duplicate that races past this check.
+    """
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        self.bloom = TimeWindowedBloomFilter(
+            settings.ingest_dedup_capacity,
+            settings.ingest_dedup_error_rate,
+            settings.ingest_dedup_window_seconds
+        )
+        self.duplicates = 0
+        self.confirmations = 0
+
+    async def is_duplicate(self, db: AsyncIOMotorDatabase, org_id: str, fingerprint: str) -> bool:
+        """Whether an event with this fingerprint has already been stored."""
+        return bool(await self.find_duplicates(db, [(org_id, fingerprint)]))
+
+    async def find_duplicates(
+        self,
+        db: AsyncIOMotorDatabase,
+        keys: Sequence[Tuple[str, str]]
+    ) -> Set[int]:
+        """
+        Check many (organisation_id, fingerprint) pairs at once.
+
+        Returns:
+            Indexes of keys that are duplicates of stored events or of an
+            earlier key in the same call
+        """
+        duplicates: Set[int] = set()
+        candidates: Dict[str, List[Tuple[int, str]]] = {}
+        seen: Set[Tuple[str, str]] = set()
+
+        for index, (org_id, fingerprint) in enumerate(keys):
+            if (org_id, fingerprint) in seen:
+                duplicates.add(index)
+                continue
+            seen.add((org_id, fingerprint))
+
+            bloom_key = f"{org_id}:{fingerprint}"
+            if bloom_key in self.bloom:
+                candidates.setdefault(org_id, []).append((index, fingerprint))
+            else:
+                self.bloom.add(bloom_key)
+
+        for org_id, entries in candidates.items():
+            self.confirmations += 1
+            cursor = db[self.collection_name].find(
+                meta_query(self.collection_name, {"organisation_id": org_id, "fingerprint": {"$in": [fp for _, fp in entries]}}),
+                {"fingerprint": 1, "_id": 0}
+            )
+            stored = {doc["fingerprint"] async for doc in cursor}
+            duplicates.update(index for index, fingerprint in entries if fingerprint in stored)
+
+        self.duplicates += len(duplicates)
+        return duplicates
+
+
+log_duplicates = DuplicateFilter("logs")
+telemetry_duplicates = DuplicateFilter("telemetry")
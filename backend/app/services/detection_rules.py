@@ -0,0 +1,596 @@
+"""Declarative detection rules compiled into predicates, with hot reload"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+from string import Formatter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import uuid
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import ValidationError
+
+from ..config import get_settings
+from ..models.schemas import Alert, AlertStatus, DetectionRuleDefinition, LogEvent
+from ..utils.pattern_matcher import AhoCorasick, normalise
+from .dedup import content_fingerprint
+from .window_state import MinuteWindow, epoch_minute
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Optional YAML rule files
+YAML_AVAILABLE = False
+try:
+    import yaml
+    YAML_AVAILABLE = True
+except ImportError:
+    yaml = None
+
+WILDCARD = "*"
+_MISSING = object()
+
+Predicate = Callable[[LogEvent], bool]
+Getter = Callable[[LogEvent], Any]
+
+# Derived fields a predicate can test but that have no stored counterpart
+COMPUTED_FIELDS: Dict[str, Getter] = {
+    "timestamp.hour": lambda event: event.timestamp.hour,
+    "timestamp.minute": lambda event: event.timestamp.minute,
+    "timestamp.weekday": lambda event: event.timestamp.weekday(),
+}
+_EVENT_FIELDS = ("organisation_id", "host", "user", "timestamp", "event_type", "source")
+
+
+# ============================================================================
+# Compilation
+# ============================================================================
+
+def field_getter(path: str) -> Getter:
+    """Compile a field path (``user``, ``details.process_name``, ``timestamp.hour``) into a getter."""
+    if path in COMPUTED_FIELDS:
+        return COMPUTED_FIELDS[path]
+
+    head, *keys = path.split(".")
+    if head in _EVENT_FIELDS and not keys:
+        return lambda event: getattr(event, head)
+
+    if head == "details" and keys:
+        def get(event: LogEvent) -> Any:
+            value: Any = event.details
+            for key in keys:
+                if not isinstance(value, dict):
+                    return _MISSING
+                value = value.get(key, _MISSING)
+                if value is _MISSING:
+                    return _MISSING
+            return value
+        return get
+
+    raise ValueError(f"Unknown field: {path}")
+
+
+def _ordered(compare: Callable[[Any, Any], bool], arg: Any) -> Callable[[Any], bool]:
+    def test(value: Any) -> bool:
+        if value is _MISSING or value is None:
+            return False
+        try:
+            return compare(value, arg)
+        except TypeError:
+            return False
+    return test
+
+
+def _value_test(op: str, arg: Any) -> Callable[[Any], bool]:
+    """Compile one operator into a test on a field value."""
+    if op == "eq":
+        return lambda value: value is not _MISSING and value == arg
+    if op == "ne":
+        return lambda value: value is _MISSING or value != arg
+    if op in ("in", "not_in"):
+        if not isinstance(arg, list):
+            raise ValueError(f"'{op}' takes a list")
+        present = op == "in"
+        return lambda value: (value is not _MISSING and value in arg) == present
+    if op == "gt":
+        return _ordered(lambda value, bound: value > bound, arg)
+    if op == "gte":
+        return _ordered(lambda value, bound: value >= bound, arg)
+    if op == "lt":
+        return _ordered(lambda value, bound: value < bound, arg)
+    if op == "lte":
+        return _ordered(lambda value, bound: value <= bound, arg)
+    if op == "exists":
+        return lambda value: (value is not _MISSING) == bool(arg)
+    if op == "regex":
+        pattern = re.compile(arg)
+        return lambda value: isinstance(value, str) and pattern.search(value) is not None
+    if op == "contains":
+        needle = normalise(arg)
+        return lambda value: isinstance(value, str) and needle in normalise(value)
+    if op == "contains_any":
+        if not isinstance(arg, list):
+            raise ValueError("'contains_any' takes a list")
+        matcher = AhoCorasick(arg)
+        return lambda value: isinstance(value, str) and bool(matcher.find_all(normalise(value)))
+    raise ValueError(f"Unknown operator: {op}")
+
+
+OPERATORS = {"eq", "ne", "in", "not_in", "gt", "gte", "lt", "lte", "exists", "regex", "contains", "contains_any"}
+
+
+def _is_operator_spec(spec: Any) -> bool:
+    return isinstance(spec, dict) and bool(spec) and all(key in OPERATORS for key in spec)
+
+
+def compile_match(match: Dict[str, Any]) -> Predicate:
+    """
+    Compile a ``match`` block into one predicate over a LogEvent.
+
+    Each key is a field path whose value is either a literal (equality) or a
+    dict of operators; all keys must hold. ``any`` takes a list of match
+    blocks of which one must hold, ``not`` a match block that must not.
+    """
+    tests: List[Predicate] = []
+
+    for field, spec in match.items():
+        if field == "any":
+            alternatives = [compile_match(block) for block in spec]
+            tests.append(lambda event, alternatives=alternatives: any(test(event) for test in alternatives))
+            continue
+        if field == "not":
+            negated = compile_match(spec)
+            tests.append(lambda event, negated=negated: not negated(event))
+            continue
+
+        get = field_getter(field)
+        if _is_operator_spec(spec):
+            value_tests = [_value_test(op, arg) for op, arg in spec.items()]
+        else:
+            value_tests = [_value_test("eq", spec)]
+
+        if len(value_tests) == 1:
+            test = value_tests[0]
+            tests.append(lambda event, get=get, test=test: test(get(event)))
+        else:
+            tests.append(lambda event, get=get, value_tests=value_tests: all(t(get(event)) for t in value_tests))
+
+    if not tests:
+        return lambda event: True
+    if len(tests) == 1:
+        return tests[0]
+    return lambda event: all(test(event) for test in tests)
+
+
+def _mongo_value(op: str, arg: Any) -> Dict:
+    if op == "eq":
+        return {"$eq": arg}
+    if op == "not_in":
+        return {"$nin": arg}
+    if op == "contains":
+        return {"$regex": re.escape(arg), "$options": "i"}
+    if op == "contains_any":
+        return {"$regex": "|".join(re.escape(pattern) for pattern in arg), "$options": "i"}
+    if op == "regex":
+        return {"$regex": arg}
+    return {f"${op}": arg}
+
+
+def mongo_filter(match: Dict[str, Any]) -> Optional[Dict]:
+    """The ``logs`` query equivalent to a match block, or None if it tests computed fields."""
+    clauses: List[Dict] = []
+
+    for field, spec in match.items():
+        if field == "any":
+            alternatives = [mongo_filter(block) for block in spec]
+            if any(alternative is None for alternative in alternatives):
+                return None
+            clauses.append({"$or": alternatives})
+            continue
+        if field == "not":
+            negated = mongo_filter(spec)
+            if negated is None:
+                return None
+            clauses.append({"$nor": [negated]})
+            continue
+        if field in COMPUTED_FIELDS:
+            return None
+
+        ops = spec.items() if _is_operator_spec(spec) else [("eq", spec)]
+        for op, arg in ops:
+            clauses.append({field: _mongo_value(op, arg)})
+
+    return {"$and": clauses} if clauses else {}
+
+
+def check_template(template: str):
+    """Raise ValueError for a malformed format template."""
+    list(Formatter().parse(template))
+
+
+class _TemplateValues(dict):
+    def __missing__(self, key: str) -> str:
+        return "{" + key + "}"
+
+
+def event_values(event: LogEvent) -> Dict[str, Any]:
+    """Template values of an event: its top-level fields and ``details``."""
+    return {**{field: getattr(event, field) for field in _EVENT_FIELDS}, "details": event.details}
+
+
+def render_template(template: str, values: Dict) -> str:
+    try:
+        return template.format_map(_TemplateValues(values))
+    except (KeyError, IndexError, AttributeError, ValueError):
+        return template
+
+
+class CompiledRule:
+    """
+    A declarative rule compiled into closures, with its window state.
+
+    Window rules keep one MinuteWindow per (organisation_id, *group_by)
+    key; the count is the number of matching events in the window, or the
+    number of distinct values of ``window.distinct``.
+    """
+
+    def __init__(self, definition: DetectionRuleDefinition):
+        self.definition = definition
+        self.name = definition.name
+        self.organisation_id = definition.organisation_id
+        self.event_types = definition.event_types or [WILDCARD]
+        self.version = content_fingerprint(definition.model_dump(mode="json"))
+        self.predicate = compile_match(definition.match)
+        self.window = definition.window
+        self._windows: "OrderedDict[Tuple, MinuteWindow]" = OrderedDict()
+
+        check_template(definition.title)
+        check_template(definition.description)
+
+        if self.window:
+            for field in self.window.group_by + ([self.window.distinct] if self.window.distinct else []):
+                if field in COMPUTED_FIELDS:
+                    raise ValueError(f"Cannot group or count by computed field {field}")
+            self._group_getters = [field_getter(field) for field in self.window.group_by]
+            self._distinct_getter = field_getter(self.window.distinct) if self.window.distinct else None
+
+    def _key(self, event: LogEvent) -> Tuple:
+        return (event.organisation_id, *(str(get(event)) for get in self._group_getters))
+
+    def _window_for(self, key: Tuple, create: bool) -> Optional[MinuteWindow]:
+        window = self._windows.get(key)
+        if window is not None:
+            self._windows.move_to_end(key)
+        elif create:
+            window = self._windows[key] = MinuteWindow(self.window.minutes)
+            while len(self._windows) > settings.rule_window_max_keys:
+                self._windows.popitem(last=False)
+        return window
+
+    def _add(self, key: Tuple, minute: int, value: str, count: int, now: int):
+        if minute <= now - self.window.minutes:
+            return
+        window = self._window_for(key, create=True)
+        window.advance(now)
+        window.add(minute, value, count)
+
+    def observe(self, event: LogEvent, now: int):
+        """Add a matching event to its window."""
+        value = str(self._distinct_getter(event)) if self._distinct_getter else ""
+        self._add(self._key(event), min(epoch_minute(event.timestamp), now), value, 1, now)
+
+    def measure(self, event: LogEvent, now: int) -> int:
+        """The window's count (or distinct count) for the event's key."""
+        window = self._window_for(self._key(event), create=False)
+        if window is None:
+            return 0
+        window.advance(now)
+        return window.distinct if self.window.distinct else window.count_total
+
+    def alert(self, event: LogEvent, count: Optional[int]) -> Alert:
+        values = {
+            **event_values(event),
+            "count": count,
+            "threshold": self.window.threshold if self.window else None,
+            "window_minutes": self.window.minutes if self.window else None,
+            "rule": self.name,
+        }
+        now = datetime.utcnow()
+        return Alert(
+            alert_id=f"alert_{uuid.uuid4().hex[:16]}",
+            organisation_id=event.organisation_id,
+            title=render_template(self.definition.title, values),
+            description=render_template(self.definition.description or self.definition.title, values),
+            severity=self.definition.severity,
+            status=AlertStatus.OPEN,
+            host=event.host,
+            user=event.user,
+            event_type=event.event_type,
+            triggered_by="rule",
+            rule_name=self.name,
+            created_at=now,
+            updated_at=now
+        )
+
+    def adopt_state(self, previous: "CompiledRule"):
+        """Keep the window state of the same rule from before a reload."""
+        self._windows = previous._windows
+
+    async def rebuild(self, db: AsyncIOMotorDatabase):
+        """Load the rule's window from the last ``window.minutes`` of logs (if its match can be queried)."""
+        query = mongo_filter(self.definition.match)
+        if query is None:
+            logger.info("Rule %s tests computed fields; its window starts empty", self.name)
+            return
+
+        since = datetime.utcnow() - timedelta(minutes=self.window.minutes)
+        clauses = [query, {"timestamp": {"$gte": since}}]
+        if self.organisation_id:
+            clauses.append({"organisation_id": self.organisation_id})
+        if WILDCARD not in self.event_types:
+            clauses.append({"event_type": {"$in": self.event_types}})
+
+        group_id = {"organisation_id": "$organisation_id"}
+        for index, field in enumerate(self.window.group_by):
+            group_id[f"g{index}"] = f"${field}"
+        if self.window.distinct:
+            group_id["value"] = f"${self.window.distinct}"
+        group_id["minute"] = {"$floor": {"$divide": [{"$toLong": "$timestamp"}, 60000]}}
+
+        now = int(time.time() // 60)
+        pipeline = [
+            {"$match": {"$and": clauses}},
+            {"$group": {"_id": group_id, "count": {"$sum": 1}}},
+        ]
+        async for row in db.logs.aggregate(pipeline, allowDiskUse=True):
+            key = row["_id"]
+            group = tuple(str(key.get(f"g{index}")) for index in range(len(self.window.group_by)))
+            value = str(key.get("value")) if self.window.distinct else ""
+            self._add((key["organisation_id"], *group), min(int(key["minute"]), now), value, row["count"], now)
+
+
+class RuleSet:
+    """
+    Compiled rules indexed by organisation and event_type.
+
+    Every organisation sees the global rules plus its own; an organisation
+    rule replaces the global rule with the same name, and a disabled one
+    removes it for that organisation.
+    """
+
+    def __init__(self, rules: List[CompiledRule]):
+        self.rules = rules
+        global_rules = {rule.name: rule for rule in rules if rule.organisation_id is None}
+        org_rules: Dict[str, Dict[str, CompiledRule]] = {}
+        for rule in rules:
+            if rule.organisation_id is not None:
+                org_rules.setdefault(rule.organisation_id, {})[rule.name] = rule
+
+        self._global = self._index(global_rules.values())
+        self._by_org = {
+            org_id: self._index({**global_rules, **overrides}.values())
+            for org_id, overrides in org_rules.items()
+        }
+
+    @staticmethod
+    def _index(rules) -> Dict[str, List[CompiledRule]]:
+        rules = [rule for rule in rules if rule.definition.enabled]
+        wildcard = [rule for rule in rules if WILDCARD in rule.event_types]
+        index: Dict[str, List[CompiledRule]] = {WILDCARD: wildcard}
+        for rule in rules:
+            for event_type in rule.event_types:
+                if event_type != WILDCARD:
+                    index.setdefault(event_type, list(wildcard)).append(rule)
+        return index
+
+    @property
+    def organisations(self) -> List[str]:
+        """Organisations with rules of their own."""
+        return list(self._by_org)
+
+    def rules_for(self, organisation_id: str, event_type: str) -> List[CompiledRule]:
+        """Rules that can match an event of this organisation and type."""
+        index = self._by_org.get(organisation_id, self._global)
+        rules = index.get(event_type)
+        return rules if rules is not None else index[WILDCARD]
+
+
+# ============================================================================
+# Loading and evaluation
+# ============================================================================
+
+def read_rule_file(path: str) -> List[Dict]:
+    """
+    Rule definitions from a JSON file, or a YAML one (``.yml``/``.yaml``, needs PyYAML).
+
+    Raises:
+        ValueError: If the file is not a list of rules or needs PyYAML
+    """
+    text = Path(path).read_text(encoding="utf-8")
+    if path.endswith((".yml", ".yaml")):
+        if not YAML_AVAILABLE:
+            raise ValueError(f"{path} is YAML but PyYAML is not installed")
+        definitions = yaml.safe_load(text) or []
+    else:
+        definitions = json.loads(text)
+    if not isinstance(definitions, list):
+        raise ValueError(f"{path} must contain a list of rules")
+    return definitions
+
+
+def compile_rules(definitions: List[Dict]) -> Tuple[Dict[Tuple, CompiledRule], List[str]]:
+    """
+    Compile rule definitions; a later definition replaces an earlier one with the same scope and name.
+
+    Returns:
+        Tuple of ({(organisation_id, name): rule}, ["<name>: <error>" for invalid definitions])
+    """
+    compiled: Dict[Tuple, CompiledRule] = {}
+    errors: List[str] = []
+
+    for definition in definitions:
+        name = definition.get("name", "<unnamed>") if isinstance(definition, dict) else "<invalid>"
+        try:
+            rule = CompiledRule(DetectionRuleDefinition.model_validate(definition))
+        except (ValidationError, ValueError, TypeError, re.error) as e:
+            errors.append(f"{name}: {e}")
+            continue
+        compiled[(rule.organisation_id, rule.name)] = rule
+
+    return compiled, errors
+
+
+class DetectionRules:
+    """
+    Declarative detection rules from ``detection_rules_file`` and the ``detection_rules`` collection.
+
+    Both sources are polled every ``detection_rules_reload_seconds``; when
+    either changed, every rule is recompiled and the rule set is swapped
+    atomically. A rule whose definition did not change keeps its window
+    state; new window rules are loaded from recent logs. Invalid rules are
+    skipped and reported in ``errors``.
+
+    The file holds a list of rule definitions (JSON, or YAML when PyYAML is
+    installed); collection documents are one rule each. Collection rules
+    override file rules with the same name and scope.
+    """
+
+    def __init__(self):
+        self.rule_set = RuleSet([])
+        self.errors: List[str] = []
+        self.loaded_at: Optional[datetime] = None
+        self.evaluated = 0
+        self._db: Optional[AsyncIOMotorDatabase] = None
+        self._task: Optional[asyncio.Task] = None
+        self._file_source: Tuple[Optional[float], List[Dict]] = (None, [])
+        self._collection_source: Tuple[Optional[str], List[Dict]] = (None, [])
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        """Load the rules and start polling for changes."""
+        self._db = db
+        try:
+            await self.reload()
+        except Exception:
+            logger.exception("Could not load detection rules")
+        self._task = asyncio.create_task(self._run(), name="detection-rules")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.detection_rules_reload_seconds)
+            try:
+                await self.reload()
+            except Exception:
+                logger.exception("Detection rule reload failed")
+
+    def _read_file(self) -> Tuple[Optional[float], List[Dict]]:
+        path = settings.detection_rules_file
+        if not path:
+            return None, []
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None, []
+        if mtime == self._file_source[0]:
+            return self._file_source
+        return mtime, read_rule_file(path)
+
+    async def _read_collection(self) -> Tuple[Optional[str], List[Dict]]:
+        if self._db is None:
+            return None, []
+        documents = await self._db.detection_rules.find({}, {"_id": 0}).to_list(length=None)
+        return content_fingerprint(documents), documents
+
+    async def reload(self, force: bool = False) -> bool:
+        """
+        Recompile the rules if the file or the collection changed.
+
+        Returns:
+            True if a new rule set was installed
+        """
+        file_source = self._read_file()
+        collection_source = await self._read_collection()
+        if not force and file_source[0] == self._file_source[0] and collection_source[0] == self._collection_source[0]:
+            return False
+
+        previous = {(rule.organisation_id, rule.name): rule for rule in self.rule_set.rules}
+        compiled, errors = compile_rules(file_source[1] + collection_source[1])
+
+        for key, rule in compiled.items():
+            if not rule.window:
+                continue
+            old = previous.get(key)
+            if old is not None and old.version == rule.version:
+                rule.adopt_state(old)
+            elif self._db is not None:
+                try:
+                    await rule.rebuild(self._db)
+                except Exception:
+                    logger.exception("Could not load the window of rule %s", rule.name)
+
+        self.rule_set = RuleSet(list(compiled.values()))
+        self._file_source = file_source
+        self._collection_source = collection_source
+        self.errors = errors
+        self.loaded_at = datetime.utcnow()
+        for error in errors:
+            logger.warning("Invalid detection rule %s", error)
+        logger.info("Loaded %d detection rules (%d invalid)", len(compiled), len(errors))
+        return True
+
+    def evaluate_batch(self, log_events: List[LogEvent]) -> List[List[Alert]]:
+        """
+        Evaluate the declarative rules against already persisted events.
+
+        Events are added to their rules' windows and measured one at a
+        time in input order, so a batch raises the same alerts as the same
+        events ingested one by one.
+
+        Returns:
+            One list of alerts per input event, in input order
+        """
+        rule_set = self.rule_set
+        if not rule_set.rules:
+            return [[] for _ in log_events]
+
+        now = int(time.time() // 60)
+        results = []
+        for event in log_events:
+            alerts = []
+            for rule in rule_set.rules_for(event.organisation_id, event.event_type):
+                if not rule.predicate(event):
+                    continue
+                if rule.window:
+                    rule.observe(event, now)
+                    count = rule.measure(event, now)
+                    if count < rule.window.threshold:
+                        continue
+                    alerts.append(rule.alert(event, count))
+                else:
+                    alerts.append(rule.alert(event, None))
+            results.append(alerts)
+        self.evaluated += len(log_events)
+        return results
+
+    def stats(self) -> Dict:
+        return {
+            "rules": len(self.rule_set.rules),
+            "window_rules": sum(1 for rule in self.rule_set.rules if rule.window),
+            "organisations_with_rules": len(self.rule_set.organisations),
+            "loaded_at": self.loaded_at,
+            "evaluated": self.evaluated,
+            "errors": self.errors,
+        }
+
+
+detection_rules = DetectionRules()
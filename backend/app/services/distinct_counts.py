@@ -0,0 +1,216 @@
+"""Time-bucketed HyperLogLog distinct counts per organisation, user and host"""
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, Optional, Tuple
+import logging
+import time
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ..config import get_settings
+from ..database import meta_query
+from ..utils.hyperloglog import HyperLogLog
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+HOUR = 3600
+DAY = 86400
+
+
+def _epoch_seconds(moment: datetime) -> float:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+class SketchWindow:
+    """
+    Sliding window of per-bucket HyperLogLog sketches plus their running union.
+
+    Values are added to their bucket's sketch and to the union, so the
+    window's distinct count is read without merging. When a bucket expires
+    the union is rebuilt from the remaining buckets (once per bucket period).
+    """
+
+    __slots__ = ("buckets", "union", "precision", "size")
+
+    def __init__(self, size: int, precision: int):
+        self.size = size
+        self.precision = precision
+        self.buckets: Deque[Tuple[int, HyperLogLog]] = deque()
+        self.union = HyperLogLog(precision)
+
+    def expire(self, current: int):
+        """Drop buckets older than the window ending at bucket ``current``."""
+        if not self.buckets or self.buckets[0][0] > current - self.size:
+            return
+        while self.buckets and self.buckets[0][0] <= current - self.size:
+            self.buckets.popleft()
+        self.union = HyperLogLog(self.precision)
+        for _, sketch in self.buckets:
+            self.union.merge(sketch)
+
+    def add(self, bucket: int, value: str):
+        for existing, sketch in reversed(self.buckets):
+            if existing == bucket:
+                break
+        else:
+            sketch = HyperLogLog(self.precision)
+            self.buckets.append((bucket, sketch))
+            if len(self.buckets) > 1 and self.buckets[-2][0] > bucket:
+                # Late value for a bucket that didn't exist yet; keep buckets ordered
+                self.buckets = deque(sorted(self.buckets, key=lambda item: item[0]))
+
+        sketch.add(value)
+        self.union.add(value)
+
+    @property
+    def empty(self) -> bool:
+        return not self.buckets
+
+
+class DistinctCounts:
+    """
+    Approximate distinct counts that replace ``distinct()`` + ``len()`` queries.
+
+    Three families of sliding windows, each keyed per organisation:
+
+    - hosts per (organisation, user) over 24 hourly buckets
+    - users per (organisation, host) over 24 hourly buckets
+    - hosts per organisation over 30 daily buckets
+
+    Fed by the rule engine as events are evaluated, and rebuilt on startup
+    from the last day of raw logs plus 30 days of ``log_rollups``. Until the
+    rebuild succeeds ``ready`` is False and callers fall back to MongoDB.
+    Per-key windows live in an LRU bounded by ``distinct_count_max_keys``;
+    organisation windows are not evicted.
+    """
+
+    def __init__(self, precision: int, max_keys: int):
+        self.precision = precision
+        self.max_keys = max_keys
+        self._user_hosts: "OrderedDict[Tuple[str, str], SketchWindow]" = OrderedDict()
+        self._host_users: "OrderedDict[Tuple[str, str], SketchWindow]" = OrderedDict()
+        self._org_hosts: Dict[str, SketchWindow] = {}
+        self.ready = False
+
+    def _keyed(self, windows: "OrderedDict", key: Tuple[str, str], create: bool) -> Optional[SketchWindow]:
+        window = windows.get(key)
+        if window is not None:
+            windows.move_to_end(key)
+        elif create:
+            window = windows[key] = SketchWindow(24, self.precision)
+            while len(windows) > self.max_keys:
+                windows.popitem(last=False)
+        return window
+
+    def record(self, organisation_id: str, user: str, host: str, timestamp: datetime):
+        """Add one event's user and host to every window it belongs to."""
+        now = time.time()
+        self._add(organisation_id, user, host, min(_epoch_seconds(timestamp), now), now)
+
+    def _add(self, organisation_id: str, user: str, host: str, seconds: float, now: float):
+        hour, current_hour = int(seconds // HOUR), int(now // HOUR)
+        if hour > current_hour - 24:
+            window = self._keyed(self._user_hosts, (organisation_id, user), create=True)
+            window.expire(current_hour)
+            window.add(hour, host)
+
+            window = self._keyed(self._host_users, (organisation_id, host), create=True)
+            window.expire(current_hour)
+            window.add(hour, user)
+
+        day, current_day = int(seconds // DAY), int(now // DAY)
+        if day > current_day - 30:
+            window = self._org_hosts.get(organisation_id)
+            if window is None:
+                window = self._org_hosts[organisation_id] = SketchWindow(30, self.precision)
+            window.expire(current_day)
+            window.add(day, host)
+
+    def _count(self, window: Optional[SketchWindow], current: int) -> int:
+        if window is None:
+            return 0
+        window.expire(current)
+        return window.union.count()
+
+    def hosts_for_user(self, organisation_id: str, user: str) -> int:
+        """Distinct hosts the user was seen on in the last 24 hours."""
+        window = self._keyed(self._user_hosts, (organisation_id, user), create=False)
+        return self._count(window, int(time.time() // HOUR))
+
+    def users_for_host(self, organisation_id: str, host: str) -> int:
+        """Distinct users seen on the host in the last 24 hours."""
+        window = self._keyed(self._host_users, (organisation_id, host), create=False)
+        return self._count(window, int(time.time() // HOUR))
+
+    def hosts_for_organisation(self, organisation_id: str) -> int:
+        """Distinct hosts that logged for the organisation in the last 30 days."""
+        return self._count(self._org_hosts.get(organisation_id), int(time.time() // DAY))
+
+    async def rebuild(self, db: AsyncIOMotorDatabase):
+        """
+        Load the last 24 hours of logs and 30 days of hourly rollups.
+
+        Errors are logged and leave the counts not ready, so callers keep
+        using ``distinct()``.
+        """
+        now = time.time()
+        self._user_hosts.clear()
+        self._host_users.clear()
+        self._org_hosts.clear()
+        self.ready = False
+
+        day_ago = datetime.utcnow() - timedelta(hours=24)
+        month_ago = datetime.utcnow() - timedelta(days=30)
+        try:
+            # Hosts per organisation from rollups (raw logs may have expired)
+            async for row in db.log_rollups.aggregate([
+                {"$match": {"hour": {"$gte": month_ago}}},
+                {"$group": {"_id": {"organisation_id": "$organisation_id", "host": "$host"}, "last": {"$max": "$hour"}}},
+            ], allowDiskUse=True):
+                key = row["_id"]
+                seconds = min(_epoch_seconds(row["last"]), now)
+                window = self._org_hosts.setdefault(key["organisation_id"], SketchWindow(30, self.precision))
+                window.add(int(seconds // DAY), key["host"])
+
+            # Recent raw logs, by (organisation, user, host, hour)
+            async for row in db.logs.aggregate([
+                {"$match": meta_query("logs", {"timestamp": {"$gte": day_ago}})},
+                {"$group": {"_id": {
+                    "organisation_id": "$organisation_id",
+                    "user": "$user",
+                    "host": "$host",
+                    "hour": {"$floor": {"$divide": [{"$toLong": "$timestamp"}, HOUR * 1000]}},
+                }}},
+            ], allowDiskUse=True):
+                key = row["_id"]
+                self._add(key["organisation_id"], key["user"], key["host"], min(key["hour"] * HOUR, now), now)
+        except Exception:
+            logger.exception("Could not rebuild distinct counts; falling back to distinct() queries")
+            self._user_hosts.clear()
+            self._host_users.clear()
+            self._org_hosts.clear()
+            return
+
+        self.ready = True
+        print(f"✅ Distinct count sketches rebuilt for {len(self._org_hosts)} organisations")
+
+    def stats(self) -> Dict:
+        windows = list(self._user_hosts.values()) + list(self._host_users.values()) + list(self._org_hosts.values())
+        return {
+            "enabled": settings.distinct_counts_enabled,
+            "ready": self.ready,
+            "precision": self.precision,
+            "user_windows": len(self._user_hosts),
+            "host_windows": len(self._host_users),
+            "organisation_windows": len(self._org_hosts),
+            "sketch_bytes": sum(
+                window.union.size_bytes + sum(sketch.size_bytes for _, sketch in window.buckets)
+                for window in windows
+            ),
+        }
+
+
+distinct_counts = DistinctCounts(settings.distinct_count_precision, settings.distinct_count_max_keys)
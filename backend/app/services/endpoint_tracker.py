@@ -0,0 +1,146 @@
+"""Debounced endpoint last_seen/metadata upserts"""
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import logging
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from ..config import get_settings
+from ..utils.timestamps import utc_naive
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+def _normalise_last_seen(fields: Dict) -> Dict:
+    """Copy of ``fields`` with ``last_seen`` as naive UTC."""
+    fields = dict(fields)
+    if isinstance(fields.get("last_seen"), datetime):
+        fields["last_seen"] = utc_naive(fields["last_seen"])
+    return fields
+
+
+class _PendingUpdate:
+    """Merged $set/$setOnInsert fields for one endpoint document."""
+
+    __slots__ = ("filter", "set_fields", "set_on_insert")
+
+    def __init__(self, filter: Dict, set_fields: Dict, set_on_insert: Dict):
+        self.filter = filter
+        self.set_fields = set_fields
+        self.set_on_insert = set_on_insert
+
+    def merge(self, set_fields: Dict, set_on_insert: Dict):
+        """Merge a later update; fields from the most recent last_seen win."""
+        current_seen = self.set_fields.get("last_seen")
+        incoming_seen = set_fields.get("last_seen")
+
+        if current_seen is None or incoming_seen is None or incoming_seen >= current_seen:
+            self.set_fields.update(set_fields)
+        else:
+            for key, value in set_fields.items():
+                self.set_fields.setdefault(key, value)
+
+        for key, value in set_on_insert.items():
+            self.set_on_insert.setdefault(key, value)
+
+    def to_operation(self) -> UpdateOne:
+        update: Dict[str, Any] = {"$set": self.set_fields}
+        if self.set_on_insert:
+            update["$setOnInsert"] = self.set_on_insert
+        return UpdateOne(self.filter, update, upsert=True)
+
+
+class EndpointTracker:
+    """
+    In-memory tracker that merges endpoint upserts per endpoint key.
+
+    Ingest paths call ``track`` instead of writing to ``endpoints`` directly.
+    Updates for the same endpoint are merged in memory and written every
+    ``endpoint_flush_interval_seconds`` with a single unordered bulk_write,
+    so a chatty host costs one write per interval instead of one per event.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple, _PendingUpdate] = {}
+        self._db: Optional[AsyncIOMotorDatabase] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.flushed = 0
+
+    def track(self, filter: Dict, set_fields: Dict, set_on_insert: Optional[Dict] = None):
+        """
+        Record an endpoint upsert to be written on the next flush.
+
+        Args:
+            filter: Query identifying the endpoint document (e.g. organisation_id + host)
+            set_fields: Fields for $set; ``last_seen`` decides which update is newest
+            set_on_insert: Fields for $setOnInsert; the first value seen is kept
+        """
+        key = tuple(sorted(filter.items()))
+        pending = self._pending.get(key)
+
+        # Events carry aware or naive timestamps; merge() compares them
+        set_fields = _normalise_last_seen(set_fields)
+        set_on_insert = _normalise_last_seen(set_on_insert or {})
+
+        if pending is None:
+            self._pending[key] = _PendingUpdate(dict(filter), set_fields, set_on_insert)
+        else:
+            pending.merge(set_fields, set_on_insert)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        """Start the periodic flush task."""
+        self._db = db
+        self._task = asyncio.create_task(self._run(), name="endpoint-tracker")
+
+    async def stop(self):
+        """Stop the periodic flush task and write everything still pending."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.endpoint_flush_interval_seconds)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Endpoint flush failed")
+
+    async def flush(self):
+        """Write all merged endpoint updates with one bulk_write."""
+        async with self._lock:
+            if not self._pending or self._db is None:
+                return
+
+            pending, self._pending = self._pending, {}
+
+            try:
+                await self._db.endpoints.bulk_write(
+                    [update.to_operation() for update in pending.values()],
+                    ordered=False
+                )
+                self.flushed += len(pending)
+            except BulkWriteError as e:
+                self.flushed += len(pending) - len(e.details.get("writeErrors", []))
+                logger.warning("Endpoint flush rejected %d updates", len(e.details.get("writeErrors", [])))
+            except Exception:
+                # Keep the updates for the next flush; newer tracked values win
+                for key, update in pending.items():
+                    if key in self._pending:
+                        update.merge(self._pending[key].set_fields, self._pending[key].set_on_insert)
+                    self._pending[key] = update
+                raise
+
+
+endpoint_tracker = EndpointTracker()
@@ -0,0 +1,133 @@
+"""Per-event-type ingest policies for high-volume agent snapshot events"""
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from ..config import get_settings
+from ..utils.timestamps import utc_naive
+from .dedup import content_fingerprint
+from .endpoint_tracker import endpoint_tracker
+
+settings = get_settings()
+
+STORE = "store"  # persist and run detection (default)
+ON_CHANGE = "on_change"  # persist only when details differ from the last stored event
+DOWNSAMPLE = "downsample"  # persist at most one event per interval
+ENDPOINT = "endpoint"  # never persist; keep the latest details on the endpoint document
+
+DEFAULT_DOWNSAMPLE_MINUTES = 15
+
+
+def _parse_policy(event_type: str, spec: str) -> Tuple[str, Optional[timedelta]]:
+    """Parse ``"store"``, ``"on_change"``, ``"endpoint"``, ``"downsample"`` or ``"downsample:<minutes>"``."""
+    mode, _, minutes = spec.strip().lower().partition(":")
+    if mode == DOWNSAMPLE:
+        return mode, timedelta(minutes=float(minutes or DEFAULT_DOWNSAMPLE_MINUTES))
+    if mode in (STORE, ON_CHANGE, ENDPOINT) and not minutes:
+        return mode, None
+    raise ValueError(f"Invalid ingest policy for {event_type}: {spec!r}")
+
+
+class IngestPolicies:
+    """
+    Decides, before persistence and detection, which log events are stored.
+
+    Agents send ``system_info``, ``process_snapshot`` and
+    ``network_snapshot`` every collection cycle; they carry little detection
+    signal, so their event types can be stored only when their details
+    change, downsampled to one per interval, or folded into the endpoint
+    document. Events that are not stored skip rule and anomaly detection but
+    still refresh the endpoint's last_seen.
+
+    The last stored details hash and timestamp per (organisation, host,
+    event_type) are kept in a bounded LRU; after a restart or eviction the
+    next event is stored again.
+    """
+
+    def __init__(self, policies: Dict[str, str], max_entries: int):
+        self.policies = {
+            event_type: _parse_policy(event_type, spec)
+            for event_type, spec in policies.items()
+        }
+        self.max_entries = max_entries
+        self._last: "OrderedDict[Tuple[str, str, str], Tuple[str, datetime]]" = OrderedDict()
+        self.stored: Counter = Counter()
+        self.skipped: Counter = Counter()
+        self.folded: Counter = Counter()
+
+    def should_store(self, log_dict: Dict) -> bool:
+        """
+        Apply the event type's policy to a validated log document.
+
+        Args:
+            log_dict: Log document with organisation_id, host, event_type, timestamp and details
+
+        Returns:
+            True if the event should be persisted and run through detection
+        """
+        event_type = log_dict["event_type"]
+        mode, interval = self.policies.get(event_type, (STORE, None))
+        if mode == STORE:
+            return True
+
+        timestamp = utc_naive(log_dict["timestamp"])
+        set_fields = {"last_seen": log_dict["timestamp"]}
+        for field in ("ip_address", "os_type"):
+            if log_dict["details"].get(field):
+                set_fields[field] = log_dict["details"][field]
+
+        if mode == ENDPOINT:
+            set_fields[f"snapshots.{event_type}"] = {**log_dict["details"], "timestamp": log_dict["timestamp"]}
+            self._track(log_dict, set_fields)
+            self.folded[event_type] += 1
+            return False
+
+        key = (log_dict["organisation_id"], log_dict["host"], event_type)
+        digest = content_fingerprint(log_dict["details"]) if mode == ON_CHANGE else ""
+        last = self._last.get(key)
+
+        if last is not None:
+            self._last.move_to_end(key)
+            last_digest, last_stored = last
+            if mode == ON_CHANGE:
+                unchanged = digest == last_digest
+            else:
+                unchanged = abs(timestamp - last_stored) < interval
+            if unchanged:
+                self._track(log_dict, set_fields)
+                self.skipped[event_type] += 1
+                return False
+
+        self._last[key] = (digest, timestamp)
+        self._last.move_to_end(key)
+        while len(self._last) > self.max_entries:
+            self._last.popitem(last=False)
+        self.stored[event_type] += 1
+        return True
+
+    def forget(self, log_dict: Dict):
+        """Drop the remembered state for an event that ``should_store`` admitted but was not stored."""
+        self._last.pop((log_dict["organisation_id"], log_dict["host"], log_dict["event_type"]), None)
+
+    @staticmethod
+    def _track(log_dict: Dict, set_fields: Dict):
+        endpoint_tracker.track(
+            {"organisation_id": log_dict["organisation_id"], "host": log_dict["host"]},
+            set_fields
+        )
+
+    def stats(self) -> Dict:
+        """Configured policies and events stored, skipped and folded per event type since startup."""
+        return {
+            "policies": {
+                event_type: f"{mode}:{interval.total_seconds() / 60:g}" if interval else mode
+                for event_type, (mode, interval) in self.policies.items()
+            },
+            "tracked_keys": len(self._last),
+            "stored": dict(self.stored),
+            "skipped": dict(self.skipped),
+            "folded": dict(self.folded),
+        }
+
+
+ingest_policies = IngestPolicies(settings.ingest_event_policies, settings.ingest_policy_cache_size)
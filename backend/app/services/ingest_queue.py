@@ -0,0 +1,183 @@
+"""Bounded in-process queue that runs detection off the ingest request path"""
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import time
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import ValidationError
+
+from ..config import get_settings
+from ..models.schemas import LogEvent
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class IngestQueueFull(Exception):
+    """Raised when the ingest queue has no free slot."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Ingest queue is full")
+        self.retry_after = retry_after
+
+
+@dataclass
+class _QueuedEvent:
+    """A queue slot: the event plus a future resolved once it is persisted."""
+    log_event: LogEvent
+    log_id: str
+    persisted: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class IngestQueue:
+    """
+    Hands detection for persisted log events to a pool of worker tasks.
+
+    A slot is reserved before the raw event is written, so a full queue is
+    reported to the client before anything is stored. Workers wait for the
+    write to be acknowledged before running detection on the event.
+    """
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._db: Optional[AsyncIOMotorDatabase] = None
+        self._busy = 0
+        self._busy_seconds = 0.0
+        self._started_at = 0.0
+        self._waits: deque = deque(maxlen=1000)
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def running(self) -> bool:
+        return self._queue is not None
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        """Create the queue and spawn the worker tasks."""
+        self._db = db
+        self._queue = asyncio.Queue(maxsize=settings.ingest_queue_maxsize)
+        self._started_at = time.monotonic()
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"ingest-worker-{i}")
+            for i in range(settings.ingest_queue_workers)
+        ]
+
+    async def stop(self, timeout: float = 10.0):
+        """Drain queued events for up to ``timeout`` seconds, then stop the workers."""
+        if not self._queue:
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Ingest queue stopped with %d events pending", self._queue.qsize())
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    def reserve(self, log_event: LogEvent, log_id: str) -> asyncio.Future:
+        """
+        Reserve a slot for an event that is about to be persisted.
+
+        Returns:
+            Future the caller resolves with True once the event is stored,
+            or False if it was not written (failed, or spooled to disk)
+
+        Raises:
+            IngestQueueFull: If the queue is not running or has no free slot
+        """
+        if not self._queue:
+            raise IngestQueueFull(settings.ingest_queue_retry_after_seconds)
+
+        persisted = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait(_QueuedEvent(log_event, log_id, persisted))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise IngestQueueFull(settings.ingest_queue_retry_after_seconds)
+
+        return persisted
+
+    async def submit_replayed(self, documents: List[Dict]):
+        """
+        Queue detection for log documents replayed from the ingest spool.
+
+        Detection was deferred while they were spooled. Waiting for free
+        slots slows the replay down to the pace of the workers instead of
+        dropping detection; a document that is no longer a valid LogEvent
+        is logged and counted as failed.
+        """
+        for document in documents:
+            if not self._queue:
+                return
+            try:
+                log_event = LogEvent.model_validate(document)
+            except ValidationError as e:
+                self.failed += 1
+                logger.warning("Skipping detection for replayed %s: %s", document.get("log_id"), e)
+                continue
+
+            persisted = asyncio.get_running_loop().create_future()
+            persisted.set_result(True)
+            await self._queue.put(_QueuedEvent(log_event, document["log_id"], persisted))
+
+    async def _worker(self):
+        """Run detection for queued events until cancelled."""
+        from .ingestion import IngestionService
+
+        service = IngestionService(self._db)
+        while True:
+            item = await self._queue.get()
+            try:
+                if not await item.persisted:
+                    continue
+
+                self._waits.append(time.monotonic() - item.enqueued_at)
+                self._busy += 1
+                started = time.monotonic()
+                try:
+                    await service.detect_event(item.log_event, item.log_id)
+                    self.processed += 1
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Detection failed for %s", item.log_id)
+                finally:
+                    self._busy -= 1
+                    self._busy_seconds += time.monotonic() - started
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> Dict:
+        """Queue depth, wait time and worker utilisation for sizing the pool."""
+        waits = sorted(self._waits)
+        uptime = time.monotonic() - self._started_at if self.running else 0.0
+        workers = len(self._workers)
+
+        return {
+            "running": self.running,
+            "depth": self._queue.qsize() if self._queue else 0,
+            "capacity": settings.ingest_queue_maxsize,
+            "workers": workers,
+            "busy_workers": self._busy,
+            "utilisation": round(self._busy_seconds / (uptime * workers), 4) if uptime and workers else 0.0,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_seconds": {
+                "avg": round(sum(waits) / len(waits), 6) if waits else 0.0,
+                "p95": round(waits[int(len(waits) * 0.95) - 1], 6) if waits else 0.0,
+                "max": round(waits[-1], 6) if waits else 0.0,
+            },
+        }
+
+
+ingest_queue = IngestQueue()
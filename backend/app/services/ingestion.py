@@ -0,0 +1,468 @@
+"""Log ingestion pipeline shared by the ingest API endpoints"""
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+import asyncio
+import uuid
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from ..config import get_settings
+from ..database import get_log_buffer, prepare_document, write_or_spool
+from ..models.documents import log_event_adapter
+from ..models.schemas import (
+    LogEvent, LogEventResponse, LogBatchResponse, LogStreamSummary,
+    Alert, AlertSeverity, AlertStatus
+)
+from .alert_suppression import AlertWriter
+from .anomaly_detection import AnomalyDetector
+from .dedup import content_fingerprint, log_duplicates
+from .endpoint_tracker import endpoint_tracker
+from .ingest_policy import ingest_policies
+from .log_rollups import log_rollup_job
+from .rate_limiter import log_rate_limiter
+from .rule_engine import RuleEngine
+
+settings = get_settings()
+
+
+class IngestionService:
+    """
+    Persists log events and runs rule-based and ML-based detection on them.
+
+    Single events follow the original request-per-event flow; batches are
+    written with one insert_many and their alerts and endpoint updates with
+    one bulk_write. Repeats of an open alert are folded into it (see
+    ``alert_suppression``). Endpoint last_seen updates are merged by the
+    shared endpoint tracker and written periodically. Per-event-type ingest
+    policies (see ``ingest_policy``) drop or fold high-volume agent
+    snapshots before any of this.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self.rule_engine = RuleEngine(db)
+        self.anomaly_detector = AnomalyDetector(db)
+        self.alert_writer = AlertWriter(db)
+
+    @staticmethod
+    def fingerprint(log_dict: Dict) -> Optional[str]:
+        """Client-supplied fingerprint, or one derived from the event content if content fingerprints are enabled."""
+        if log_dict.get("fingerprint"):
+            return log_dict["fingerprint"]
+        if not settings.ingest_dedup_content_fingerprint:
+            return None
+        return content_fingerprint(
+            log_dict["organisation_id"], log_dict["host"], log_dict["user"],
+            log_dict["timestamp"].isoformat(), log_dict["event_type"], log_dict["source"],
+            log_dict["details"]
+        )
+
+    @classmethod
+    def build_log_document(cls, log_event: LogEvent) -> Dict:
+        """Build the MongoDB document for a log event."""
+        return cls.complete_log_document(log_event.model_dump())
+
+    @classmethod
+    def complete_log_document(cls, log_dict: Dict) -> Dict:
+        """Add the server-assigned fields to a validated log event dict, in place."""
+        log_dict["log_id"] = f"log_{uuid.uuid4().hex[:16]}"
+        log_dict["ingested_at"] = datetime.utcnow()
+
+        fingerprint = cls.fingerprint(log_dict)
+        if fingerprint:
+            log_dict["fingerprint"] = fingerprint
+        else:
+            log_dict.pop("fingerprint", None)
+
+        return prepare_document("logs", log_dict)
+
+    @staticmethod
+    def event_from_document(log_dict: Dict) -> LogEvent:
+        """LogEvent view of an already validated log document, without validating it again."""
+        return LogEvent.model_construct(**{
+            name: log_dict[name] for name in LogEvent.model_fields if name in log_dict
+        })
+
+    @staticmethod
+    def build_anomaly_alert(log_event: LogEvent, anomaly_score: float, log_id: str) -> Alert:
+        """Build an alert for an event the ML model flagged as anomalous."""
+        # Determine severity based on anomaly score
+        if anomaly_score > 0.9:
+            severity = AlertSeverity.CRITICAL
+        elif anomaly_score > 0.8:
+            severity = AlertSeverity.HIGH
+        elif anomaly_score > 0.7:
+            severity = AlertSeverity.MEDIUM
+        else:
+            severity = AlertSeverity.LOW
+
+        return Alert(
+            alert_id=f"alert_{uuid.uuid4().hex[:16]}",
+            organisation_id=log_event.organisation_id,
+            title=f"Anomalous Behavior Detected - {log_event.host}",
+            description=f"ML model detected anomalous {log_event.event_type} event on {log_event.host} by {log_event.user} (score: {anomaly_score:.2f})",
+            severity=severity,
+            status=AlertStatus.OPEN,
+            host=log_event.host,
+            user=log_event.user,
+            event_type=log_event.event_type,
+            anomaly_score=anomaly_score,
+            triggered_by="anomaly",
+            created_at=datetime.utcnow(),
+            updated_at=datetime.utcnow(),
+            related_log_ids=[log_id]
+        )
+
+    @staticmethod
+    def track_endpoint(log_event: LogEvent):
+        """Queue the endpoint last_seen refresh for an event."""
+        endpoint_tracker.track(
+            {"organisation_id": log_event.organisation_id, "host": log_event.host},
+            {
+                "last_seen": log_event.timestamp,
+                "ip_address": log_event.details.get("ip_address"),
+                "os_type": log_event.details.get("os_type")
+            }
+        )
+
+    def collect_alerts(
+        self,
+        log_event: LogEvent,
+        log_id: str,
+        rule_alerts: List[Alert],
+        is_anomaly: bool,
+        anomaly_score: float
+    ) -> List[Alert]:
+        """Combine rule alerts and the anomaly alert for one event."""
+        alerts = []
+
+        for alert in rule_alerts:
+            alert.related_log_ids = [log_id]
+            alerts.append(alert)
+
+        # Only raise an anomaly alert if no rule-based alert was created
+        if is_anomaly and not rule_alerts:
+            alerts.append(self.build_anomaly_alert(log_event, anomaly_score, log_id))
+
+        return alerts
+
+    @staticmethod
+    def build_response(
+        log_id: str,
+        alerts: List[Alert],
+        is_anomaly: bool,
+        anomaly_score: float
+    ) -> LogEventResponse:
+        """Build the API response for one ingested event."""
+        return LogEventResponse(
+            success=True,
+            message="Log event ingested successfully",
+            log_id=log_id,
+            alert_created=bool(alerts),
+            alert_id=alerts[-1].alert_id if alerts else None,
+            anomaly_score=anomaly_score if is_anomaly or anomaly_score > 0.5 else None
+        )
+
+    @staticmethod
+    def build_duplicate_response() -> LogEventResponse:
+        """Response for an event whose fingerprint was already ingested."""
+        return LogEventResponse(
+            success=True,
+            message="Duplicate log event ignored",
+            duplicate=True
+        )
+
+    @staticmethod
+    def build_aggregated_response() -> LogEventResponse:
+        """Response for an event its type's ingest policy did not store."""
+        return LogEventResponse(
+            success=True,
+            message="Log event aggregated by ingest policy",
+            aggregated=True
+        )
+
+    @staticmethod
+    def build_spooled_response(log_id: str) -> LogEventResponse:
+        """Response for an event spooled to disk; detection runs when it is replayed."""
+        return LogEventResponse(
+            success=True,
+            message="Log event spooled; detection deferred until the database recovers",
+            log_id=log_id
+        )
+
+    async def write_alerts(self, alerts: List[Alert]):
+        """
+        Store alerts, folding repeats into open alerts; ``alert_id`` is updated to the stored alert.
+
+        Alerts that can't be written while MongoDB is unavailable are spooled.
+        """
+        stored_as = await self.alert_writer.write_or_spool([alert.model_dump() for alert in alerts])
+        for alert in alerts:
+            alert.alert_id = stored_as[alert.alert_id]
+
+    async def is_duplicate(self, log_dict: Dict) -> bool:
+        """Whether a log document's fingerprint has already been ingested."""
+        fingerprint = log_dict.get("fingerprint")
+        if not fingerprint:
+            return False
+        return await log_duplicates.is_duplicate(self.db, log_dict["organisation_id"], fingerprint)
+
+    async def ingest_event(self, log_event: LogEvent) -> LogEventResponse:
+        """
+        Ingest a single log event.
+
+        The event is analyzed through:
+        1. Rule-based detection (failed logins, suspicious processes, etc.)
+        2. ML-based anomaly detection
+        3. Automatic alert creation if threats are detected
+        """
+        log_dict = self.build_log_document(log_event)
+        log_id = log_dict["log_id"]
+
+        if not ingest_policies.should_store(log_dict):
+            return self.build_aggregated_response()
+
+        # Drop agent retries before any detection work
+        if await self.is_duplicate(log_dict):
+            return self.build_duplicate_response()
+
+        # Insert log into database (coalesced with concurrent requests)
+        try:
+            if not await get_log_buffer().insert(log_dict):
+                return self.build_spooled_response(log_id)
+        except DuplicateKeyError:
+            # Raced past the Bloom filter; the unique fingerprint index caught it
+            return self.build_duplicate_response()
+        except Exception:
+            # Not stored, so the next identical snapshot must not be skipped as unchanged
+            ingest_policies.forget(log_dict)
+            raise
+
+        return await self.detect_event(log_event, log_id)
+
+    async def detect_event(self, log_event: LogEvent, log_id: str) -> LogEventResponse:
+        """Run detection for an already persisted event and write its alerts."""
+        # 1. Rule-based detection
+        rule_alerts = await self.rule_engine.evaluate_all_rules(log_event)
+
+        # 2. Anomaly detection
+        is_anomaly, anomaly_score = await self.anomaly_detector.predict_anomaly(log_event)
+
+        alerts = self.collect_alerts(log_event, log_id, rule_alerts, is_anomaly, anomaly_score)
+        await self.write_alerts(alerts)
+
+        # Update endpoint last_seen (merged and flushed periodically)
+        self.track_endpoint(log_event)
+        log_rollup_job.track_late(log_event)
+
+        # Trigger background risk recalculation (simplified - in production use Celery/background tasks)
+        # For now, we'll calculate it on-demand in the endpoints API
+
+        return self.build_response(log_id, alerts, is_anomaly, anomaly_score)
+
+    async def ingest_batch(self, log_docs: List[Dict]) -> LogBatchResponse:
+        """
+        Ingest a batch of log events.
+
+        ``log_docs`` are log events already validated into plain dicts (see
+        ``models.documents.log_event_list_adapter``); they are completed in
+        place and become the stored documents without another dump. Logs are
+        written with one unordered insert_many. Detection runs over
+        every event that was stored, then alerts and endpoint updates are each
+        written with a single unordered bulk_write. Endpoint updates go
+        through the shared endpoint tracker.
+        """
+        if not log_docs:
+            return LogBatchResponse(success=True, message="No log events to ingest")
+
+        for log_dict in log_docs:
+            self.complete_log_document(log_dict)
+        failed: Dict[int, str] = {}
+
+        aggregated = {i for i, doc in enumerate(log_docs) if not ingest_policies.should_store(doc)}
+
+        # Drop retried events before any write or detection work
+        fingerprinted = [i for i, doc in enumerate(log_docs) if doc.get("fingerprint") and i not in aggregated]
+        duplicates = {
+            fingerprinted[i] for i in await log_duplicates.find_duplicates(
+                self.db,
+                [(log_docs[i]["organisation_id"], log_docs[i]["fingerprint"]) for i in fingerprinted]
+            )
+        }
+        to_insert = [i for i in range(len(log_docs)) if i not in duplicates and i not in aggregated]
+
+        try:
+            if to_insert and not await write_or_spool(self.db.logs, [log_docs[i] for i in to_insert]):
+                results = [
+                    self.build_duplicate_response() if i in duplicates
+                    else self.build_aggregated_response() if i in aggregated
+                    else self.build_spooled_response(log_docs[i]["log_id"])
+                    for i in range(len(log_docs))
+                ]
+                return LogBatchResponse(
+                    success=True,
+                    message=f"Spooled {len(to_insert)} log events; detection deferred until the database recovers",
+                    accepted=len(to_insert),
+                    duplicates=len(duplicates),
+                    aggregated=len(aggregated),
+                    results=results
+                )
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                index = to_insert[error["index"]]
+                if error.get("code") == 11000:
+                    # Raced past the Bloom filter; the unique fingerprint index caught it
+                    duplicates.add(index)
+                else:
+                    failed[index] = error.get("errmsg", "Write failed")
+        except Exception:
+            for index in to_insert:
+                ingest_policies.forget(log_docs[index])
+            raise
+
+        # Events that were not stored must not count as the last stored snapshot
+        for index in failed:
+            ingest_policies.forget(log_docs[index])
+
+        stored = [i for i in to_insert if i not in failed and i not in duplicates]
+        stored_events = [self.event_from_document(log_docs[i]) for i in stored]
+
+        rule_results = await self.rule_engine.evaluate_batch(stored_events)
+        anomaly_results = await self.anomaly_detector.predict_batch(stored_events)
+
+        results: List[Optional[LogEventResponse]] = [None] * len(log_docs)
+        event_alerts = []
+
+        for index, log_event, rule_alerts, (is_anomaly, anomaly_score) in zip(
+            stored, stored_events, rule_results, anomaly_results
+        ):
+            log_id = log_docs[index]["log_id"]
+
+            alerts = self.collect_alerts(log_event, log_id, rule_alerts, is_anomaly, anomaly_score)
+            event_alerts.append((index, alerts, is_anomaly, anomaly_score))
+            self.track_endpoint(log_event)
+            log_rollup_job.track_late(log_event)
+
+        all_alerts = [alert for _, alerts, _, _ in event_alerts for alert in alerts]
+        await self.write_alerts(all_alerts)
+
+        for index, alerts, is_anomaly, anomaly_score in event_alerts:
+            results[index] = self.build_response(log_docs[index]["log_id"], alerts, is_anomaly, anomaly_score)
+
+        for index, errmsg in failed.items():
+            results[index] = LogEventResponse(
+                success=False,
+                message=f"Failed to ingest log: {errmsg}"
+            )
+
+        for index in duplicates:
+            results[index] = self.build_duplicate_response()
+
+        for index in aggregated:
+            results[index] = self.build_aggregated_response()
+
+        alerts_created = len(all_alerts)
+        return LogBatchResponse(
+            success=not failed,
+            message=f"Ingested {len(stored)} of {len(log_docs)} log events",
+            accepted=len(stored),
+            rejected=len(failed),
+            duplicates=len(duplicates),
+            aggregated=len(aggregated),
+            alerts_created=alerts_created,
+            results=results
+        )
+
+    async def ingest_stream(self, chunks: AsyncIterator[bytes]) -> LogStreamSummary:
+        """
+        Ingest newline-delimited JSON log events from a byte stream.
+
+        Lines are validated as they arrive and buffered into chunks of
+        ``ingest_stream_chunk_size`` events. Each full chunk is flushed through
+        ``ingest_batch`` in the background while the next one is read, with at
+        most one flush in flight, so memory stays bounded by two chunks plus
+        one line regardless of the upload size.
+        """
+        summary = LogStreamSummary(success=True, message="")
+        buffer: List[Dict] = []
+        pending: Optional[asyncio.Task] = None
+        partial = b""
+        skipping = False
+        line_number = 0
+
+        def reject(reason: str):
+            summary.rejected += 1
+            if len(summary.errors) < settings.ingest_stream_max_errors:
+                summary.errors.append(f"line {line_number}: {reason}")
+
+        async def flush(events: List[Dict]):
+            try:
+                await log_rate_limiter.wait((event["organisation_id"], event["host"]) for event in events)
+                result = await self.ingest_batch(events)
+            except Exception as e:
+                summary.rejected += len(events)
+                if len(summary.errors) < settings.ingest_stream_max_errors:
+                    summary.errors.append(f"chunk ending at line {line_number}: {str(e)}")
+                return
+
+            summary.accepted += result.accepted
+            summary.rejected += result.rejected
+            summary.duplicates += result.duplicates
+            summary.aggregated += result.aggregated
+            summary.alerts_created += result.alerts_created
+
+        def handle_line(line: bytes):
+            line = line.strip()
+            if not line:
+                return
+            try:
+                buffer.append(log_event_adapter.validate_json(line))
+            except ValidationError as e:
+                reject(e.errors()[0].get("msg", "invalid event"))
+
+        async for chunk in chunks:
+            if skipping:
+                # Discard the tail of an over-long line that was already rejected
+                newline = chunk.find(b"\n")
+                if newline == -1:
+                    continue
+                chunk = chunk[newline + 1:]
+                skipping = False
+
+            lines = (partial + chunk).split(b"\n")
+            partial = lines.pop()
+
+            for line in lines:
+                line_number += 1
+                handle_line(line)
+
+            if len(partial) > settings.ingest_stream_max_line_bytes:
+                line_number += 1
+                reject(f"line exceeds {settings.ingest_stream_max_line_bytes} bytes")
+                partial = b""
+                skipping = True
+
+            while len(buffer) >= settings.ingest_stream_chunk_size:
+                if pending:
+                    await pending
+                events = buffer[:settings.ingest_stream_chunk_size]
+                del buffer[:settings.ingest_stream_chunk_size]
+                pending = asyncio.create_task(flush(events))
+
+        if partial and not skipping:
+            line_number += 1
+            handle_line(partial)
+
+        if pending:
+            await pending
+        if buffer:
+            await flush(buffer)
+
+        summary.success = summary.rejected == 0
+        summary.message = (
+            f"Ingested {summary.accepted} of "
+            f"{summary.accepted + summary.rejected + summary.duplicates + summary.aggregated} log events"
+        )
+        return summary
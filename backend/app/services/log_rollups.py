@@ -0,0 +1,256 @@
+"""Hourly log rollups that outlive raw-log retention"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import logging
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReplaceOne, UpdateOne
+
+from ..config import get_settings
+from ..database import meta_query
+from ..models.schemas import LogEvent
+from ..utils.timestamps import utc_naive
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+ROLLUP_KEY_FIELDS = ("organisation_id", "host", "user", "event_type", "success")
+
+# Late-event rollup keys held in memory before a flush is started early
+LATE_ROLLUP_MAX_KEYS = 10000
+
+
+def floor_hour(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+class LogRollupService:
+    """
+    Compact hourly aggregates of ``logs`` in ``log_rollups``.
+
+    One document per (organisation_id, host, user, event_type, success, hour)
+    with the event count and the first/last event timestamps in that hour.
+    Rollups are rebuilt from raw logs, so recomputing an hour is idempotent
+    and can safely be repeated while late events are still arriving.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+
+    async def rollup_hour(self, hour: datetime) -> int:
+        """
+        Recompute the rollups for one hour of raw logs.
+
+        Args:
+            hour: Start of the hour (UTC)
+
+        Returns:
+            Number of rollup documents written
+        """
+        pipeline = [
+            {"$match": {"timestamp": {"$gte": hour, "$lt": hour + timedelta(hours=1)}}},
+            {"$group": {
+                "_id": {
+                    "organisation_id": "$organisation_id",
+                    "host": "$host",
+                    "user": "$user",
+                    "event_type": "$event_type",
+                    "success": "$details.success",
+                },
+                "count": {"$sum": 1},
+                "first_seen": {"$min": "$timestamp"},
+                "last_seen": {"$max": "$timestamp"},
+            }},
+        ]
+
+        now = datetime.utcnow()
+        operations = []
+        async for row in self.db.logs.aggregate(pipeline):
+            key = {field: row["_id"].get(field) for field in ROLLUP_KEY_FIELDS}
+            rollup_id = {**key, "hour": hour}
+            operations.append(ReplaceOne(
+                {"_id": rollup_id},
+                {
+                    **key,
+                    "hour": hour,
+                    "count": row["count"],
+                    "first_seen": row["first_seen"],
+                    "last_seen": row["last_seen"],
+                    "updated_at": now,
+                },
+                upsert=True
+            ))
+
+        if operations:
+            await self.db.log_rollups.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    async def rollup_range(self, start: datetime, end: datetime) -> int:
+        """Recompute every hour from ``start`` up to and including the hour containing ``end``."""
+        written = 0
+        hour = floor_hour(start)
+        while hour <= end:
+            written += await self.rollup_hour(hour)
+            hour += timedelta(hours=1)
+        return written
+
+    async def distinct_hosts(self, organisation_id: str, since: Optional[datetime] = None) -> List[str]:
+        """
+        Hosts that logged for an organisation, from rollups plus not-yet-rolled-up raw logs.
+
+        Args:
+            organisation_id: Organisation to query
+            since: Only hosts seen at or after this time (None for all retained history)
+        """
+        rollup_query: Dict[str, Any] = {"organisation_id": organisation_id}
+        if since:
+            rollup_query["hour"] = {"$gte": floor_hour(since)}
+        hosts = set(await self.db.log_rollups.distinct("host", rollup_query))
+
+        # The current hour is only rolled up on the next run
+        recent = datetime.utcnow() - timedelta(seconds=2 * settings.log_rollup_interval_seconds)
+        if since and since > recent:
+            recent = since
+        hosts.update(await self.db.logs.distinct(
+            "host",
+            meta_query("logs", {"organisation_id": organisation_id, "timestamp": {"$gte": recent}})
+        ))
+        return sorted(host for host in hosts if host is not None)
+
+    async def last_seen(self, organisation_id: str, host: str) -> Optional[datetime]:
+        """Latest event timestamp for a host, from raw logs or, once they expired, rollups."""
+        last_log = await self.db.logs.find_one(
+            meta_query("logs", {"organisation_id": organisation_id, "host": host}),
+            sort=[("timestamp", -1)]
+        )
+        if last_log:
+            return last_log["timestamp"]
+
+        rollup = await self.db.log_rollups.find_one(
+            {"organisation_id": organisation_id, "host": host},
+            sort=[("hour", -1)]
+        )
+        return rollup["last_seen"] if rollup else None
+
+
+class LogRollupJob:
+    """
+    Background task that rolls up recent hours every ``log_rollup_interval_seconds``.
+
+    Each run recomputes the last ``log_rollup_lookback_hours`` hours, so
+    events that arrive late still land in their hour. Events older than the
+    lookback when they are stored (backfills, replayed spools) are counted
+    into their hour's rollup incrementally instead: recomputing that hour
+    from raw logs would drop whatever the retention TTL already removed,
+    and a backfilled event older than ``log_retention_days`` may be expired
+    before any run sees it.
+    """
+
+    def __init__(self):
+        self._db: Optional[AsyncIOMotorDatabase] = None
+        self._task: Optional[asyncio.Task] = None
+        self._late: Dict[Tuple, List] = {}
+        self._flushing: Optional[asyncio.Task] = None
+        self.last_run: Optional[datetime] = None
+        self.late_events = 0
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        """Start the periodic rollup task."""
+        self._db = db
+        self._task = asyncio.create_task(self._run(), name="log-rollups")
+
+    async def stop(self):
+        """Stop the periodic rollup task and write the pending late-event counts."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush_late()
+        except Exception:
+            logger.exception("Late-event rollup flush failed")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Log rollup failed")
+            await asyncio.sleep(settings.log_rollup_interval_seconds)
+
+    def track_late(self, log_event: LogEvent):
+        """Count a stored event into its hour's rollup if that hour is no longer recomputed."""
+        timestamp = utc_naive(log_event.timestamp)
+        hour = floor_hour(timestamp)
+        if hour >= floor_hour(datetime.utcnow() - timedelta(hours=settings.log_rollup_lookback_hours)):
+            return
+
+        key = (
+            log_event.organisation_id, log_event.host, log_event.user,
+            log_event.event_type, log_event.details.get("success"), hour
+        )
+        counts = self._late.get(key)
+        if counts is None:
+            self._late[key] = [1, timestamp, timestamp]
+        else:
+            counts[0] += 1
+            counts[1] = min(counts[1], timestamp)
+            counts[2] = max(counts[2], timestamp)
+        self.late_events += 1
+
+        if len(self._late) >= LATE_ROLLUP_MAX_KEYS and self._db is not None and (
+            self._flushing is None or self._flushing.done()
+        ):
+            self._flushing = asyncio.create_task(self.flush_late(), name="log-rollups-late")
+
+    async def flush_late(self) -> int:
+        """
+        Add the counted late events to their rollups.
+
+        Returns:
+            Number of rollup documents updated
+        """
+        if not self._late or self._db is None:
+            return 0
+
+        late, self._late = self._late, {}
+        now = datetime.utcnow()
+        operations = []
+        for (*values, hour), (count, first_seen, last_seen) in late.items():
+            key = dict(zip(ROLLUP_KEY_FIELDS, values))
+            operations.append(UpdateOne(
+                {"_id": {**key, "hour": hour}},
+                {
+                    "$setOnInsert": {**key, "hour": hour},
+                    "$inc": {"count": count},
+                    "$min": {"first_seen": first_seen},
+                    "$max": {"last_seen": last_seen},
+                    "$set": {"updated_at": now},
+                },
+                upsert=True
+            ))
+        try:
+            await self._db.log_rollups.bulk_write(operations, ordered=False)
+        except Exception:
+            # Keep the counts for the next flush
+            for key, (count, first_seen, last_seen) in late.items():
+                counts = self._late.setdefault(key, [0, first_seen, last_seen])
+                counts[0] += count
+                counts[1] = min(counts[1], first_seen)
+                counts[2] = max(counts[2], last_seen)
+            raise
+        return len(operations)
+
+    async def run_once(self) -> int:
+        """Add the pending late-event counts and recompute the rollups for the lookback window."""
+        now = datetime.utcnow()
+        written = await self.flush_late()
+        written += await LogRollupService(self._db).rollup_range(
+            now - timedelta(hours=settings.log_rollup_lookback_hours), now
+        )
+        self.last_run = now
+        return written
+
+
+log_rollup_job = LogRollupJob()
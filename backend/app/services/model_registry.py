@@ -0,0 +1,198 @@
+"""Process-wide cache of the per-organisation anomaly models"""
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import logging
+import pickle
+import time
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ..config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+MODEL_TYPE = "anomaly_detection"
+
+# Version of the placeholder entry cached for an organisation with no stored model
+MISSING_VERSION = -1
+
+# Nominal size charged to the memory budget for each placeholder, so they are evicted too
+MISSING_ENTRY_BYTES = 1024
+
+
+class ModelEntry:
+    """An organisation's unpickled model and scaler, stamped with the stored version."""
+
+    __slots__ = ("organisation_id", "model", "scaler", "version", "nbytes", "checked_at")
+
+    def __init__(self, organisation_id: str, model: Any, scaler: Any, version: int, nbytes: int):
+        self.organisation_id = organisation_id
+        self.model = model
+        self.scaler = scaler
+        self.version = version
+        self.nbytes = nbytes
+        self.checked_at = time.monotonic()
+
+    @property
+    def missing(self) -> bool:
+        return self.version == MISSING_VERSION
+
+
+def _unpickle(doc: Dict) -> Tuple[Any, Any]:
+    return pickle.loads(doc["model"]), pickle.loads(doc["scaler"])
+
+
+class ModelRegistry:
+    """
+    Anomaly models shared by every request in the process.
+
+    Entries are kept in LRU order and evicted once their pickled size adds
+    up to more than ``anomaly_model_cache_mb`` (the most recently used one
+    is always kept). Each stored model carries a ``version`` that is
+    incremented on every save; an entry older than
+    ``anomaly_model_version_check_seconds`` is revalidated with a
+    projection-only query and reloaded when another worker has retrained
+    the model since.
+
+    Loads are single-flight: concurrent requests for an organisation whose
+    model is missing or due a version check share one query and one
+    unpickle. Unpickling runs in a thread so the event loop keeps serving.
+    An organisation without a stored model gets a placeholder entry
+    (``MISSING_VERSION``) that is revalidated like any other, so its events
+    don't each query ``ml_models`` before the first model is trained.
+    Placeholders are charged ``MISSING_ENTRY_BYTES`` each and evicted like
+    models.
+    """
+
+    def __init__(self):
+        self.entries: "OrderedDict[str, ModelEntry]" = OrderedDict()
+        self.bytes = 0
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self.hits = 0
+        self.loads = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.shared_waits = 0
+
+    async def single_flight(self, key: Tuple[str, str], factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run ``factory()`` once for all concurrent callers with the same key.
+
+        The shared task is shielded, so a caller being cancelled does not
+        cancel it for the others.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._inflight.pop(key, None) if self._inflight.get(key) is done else None)
+        else:
+            self.shared_waits += 1
+        return await asyncio.shield(task)
+
+    async def get(self, db: AsyncIOMotorDatabase, organisation_id: str) -> Optional[ModelEntry]:
+        """
+        The organisation's model, loading or revalidating it when needed.
+
+        Returns:
+            The cached entry, or None if no model is stored for the organisation
+        """
+        entry = self.entries.get(organisation_id)
+        if entry is not None and time.monotonic() - entry.checked_at < settings.anomaly_model_version_check_seconds:
+            self.entries.move_to_end(organisation_id)
+            self.hits += 1
+        else:
+            entry = await self.single_flight(("load", organisation_id), lambda: self._load(db, organisation_id))
+        return None if entry is None or entry.missing else entry
+
+    async def _load(self, db: AsyncIOMotorDatabase, organisation_id: str) -> Optional[ModelEntry]:
+        query = {"organisation_id": organisation_id, "model_type": MODEL_TYPE}
+        entry = self.entries.get(organisation_id)
+
+        if entry is not None:
+            stamp = await db.ml_models.find_one(query, {"version": 1})
+            if stamp is None:
+                return self._put_missing(organisation_id)
+            if stamp.get("version", 0) == entry.version:
+                entry.checked_at = time.monotonic()
+                self.entries.move_to_end(organisation_id)
+                return entry
+            self.reloads += 1
+
+        doc = await db.ml_models.find_one(query)
+        if doc is None:
+            return self._put_missing(organisation_id)
+        try:
+            model, scaler = await asyncio.to_thread(_unpickle, doc)
+        except Exception as e:
+            logger.warning("Could not load the anomaly model of %s: %s", organisation_id, e)
+            return self._put_missing(organisation_id)
+
+        self.loads += 1
+        return self.put(
+            organisation_id, model, scaler,
+            version=doc.get("version", 0),
+            nbytes=len(doc["model"]) + len(doc["scaler"])
+        )
+
+    def put(self, organisation_id: str, model: Any, scaler: Any, version: int, nbytes: int) -> ModelEntry:
+        """
+        Cache a model, unless a newer version is already cached.
+
+        Args:
+            organisation_id: Organisation the model belongs to
+            model: Fitted IsolationForest
+            scaler: Fitted StandardScaler
+            version: Version stamp of the stored document
+            nbytes: Pickled size of model and scaler, charged to the memory budget
+
+        Returns:
+            The entry now cached for the organisation
+        """
+        current = self.entries.get(organisation_id)
+        if current is not None and current.version > version:
+            return current
+
+        return self._insert(ModelEntry(organisation_id, model, scaler, version, nbytes))
+
+    def _put_missing(self, organisation_id: str) -> ModelEntry:
+        """Cache that the organisation has no usable stored model."""
+        return self._insert(ModelEntry(organisation_id, None, None, MISSING_VERSION, MISSING_ENTRY_BYTES))
+
+    def _insert(self, entry: ModelEntry) -> ModelEntry:
+        """Cache an entry as the most recently used, evicting the least recently used over budget."""
+        self.discard(entry.organisation_id)
+        self.entries[entry.organisation_id] = entry
+        self.bytes += entry.nbytes
+
+        budget = settings.anomaly_model_cache_mb * 1024 * 1024
+        while self.bytes > budget and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= evicted.nbytes
+            self.evictions += 1
+        return entry
+
+    def discard(self, organisation_id: str):
+        """Drop the organisation's cached model, if any."""
+        entry = self.entries.pop(organisation_id, None)
+        if entry is not None:
+            self.bytes -= entry.nbytes
+
+    def stats(self) -> Dict:
+        return {
+            "models": sum(1 for entry in self.entries.values() if not entry.missing),
+            "missing": sum(1 for entry in self.entries.values() if entry.missing),
+            "bytes": self.bytes,
+            "budget_bytes": settings.anomaly_model_cache_mb * 1024 * 1024,
+            "hits": self.hits,
+            "loads": self.loads,
+            "reloads": self.reloads,
+            "evictions": self.evictions,
+            "shared_waits": self.shared_waits,
+            "in_flight": len(self._inflight),
+        }
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,192 @@
+"""Per-organisation and per-host token-bucket rate limiting for ingest"""
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+import asyncio
+import math
+import time
+
+from ..config import get_settings
+
+settings = get_settings()
+
+
+class RateLimitExceeded(Exception):
+    """Raised when an organisation or host has no tokens left; answered with 429."""
+
+    def __init__(self, retry_after: float, organisation_id: str, host: Optional[str] = None):
+        scope = f"host {host} in organisation {organisation_id}" if host else f"organisation {organisation_id}"
+        super().__init__(f"Ingest rate limit exceeded for {scope}")
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.organisation_id = organisation_id
+        self.host = host
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at ``rate`` tokens/sec up to ``burst``.
+
+    A request costing more than ``burst`` is admitted once the bucket is
+    full and leaves it in debt, so batches larger than the burst are not
+    rejected forever but still pay for every event they carry.
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        """Seconds until ``cost`` tokens can be taken (0 if they can be now)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        needed = min(cost, self.burst)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def take(self, cost: float):
+        self.tokens -= cost
+
+
+class RateLimiter:
+    """
+    Token buckets per organisation and per (organisation, host).
+
+    A request is admitted only if every bucket it touches has enough tokens,
+    and then pays into all of them, so one noisy host is throttled before it
+    uses up its organisation's budget and one noisy organisation cannot use
+    up the shared ingest path. Buckets are kept in an LRU bounded by
+    ``rate_limit_max_buckets``; an evicted bucket comes back full.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        org_rate: float,
+        org_burst: float,
+        host_rate: float,
+        host_burst: float
+    ):
+        self.name = name
+        self.org_rate = org_rate
+        self.org_burst = org_burst
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self._buckets: "OrderedDict[Tuple, TokenBucket]" = OrderedDict()
+        self.allowed = 0
+        self.throttled = 0
+        self.throttled_by_org: Counter = Counter()
+        self.delayed = 0
+
+    def _bucket(self, key: Tuple, rate: float, burst: float, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst, now)
+            if len(self._buckets) > settings.rate_limit_max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def acquire(self, events: Iterable[Tuple[str, str]]):
+        """
+        Take one token per event from its organisation and host buckets.
+
+        Args:
+            events: (organisation_id, host) for each event in the request
+
+        Raises:
+            RateLimitExceeded: If any bucket is short; no tokens are taken then
+        """
+        self._acquire(events, count_throttled=True)
+
+    def _acquire(self, events: Iterable[Tuple[str, str]], count_throttled: bool):
+        if not settings.rate_limit_enabled:
+            return
+
+        org_costs: Counter = Counter()
+        host_costs: Counter = Counter()
+        for org_id, host in events:
+            org_costs[org_id] += 1
+            host_costs[(org_id, host)] += 1
+
+        now = time.monotonic()
+        charges = []
+
+        for org_id, cost in org_costs.items():
+            bucket = self._bucket((org_id,), self.org_rate, self.org_burst, now)
+            wait = bucket.wait_time(cost, now)
+            if wait:
+                if count_throttled:
+                    self._throttle(org_id, cost)
+                raise RateLimitExceeded(wait, org_id)
+            charges.append((bucket, cost))
+
+        for (org_id, host), cost in host_costs.items():
+            bucket = self._bucket((org_id, host), self.host_rate, self.host_burst, now)
+            wait = bucket.wait_time(cost, now)
+            if wait:
+                if count_throttled:
+                    self._throttle(org_id, sum(org_costs.values()))
+                raise RateLimitExceeded(wait, org_id, host)
+            charges.append((bucket, cost))
+
+        for bucket, cost in charges:
+            bucket.take(cost)
+        self.allowed += sum(org_costs.values())
+
+    async def wait(self, events: Iterable[Tuple[str, str]]):
+        """
+        Like ``acquire``, but sleep until the tokens are available (for streamed uploads).
+
+        Events that had to wait are counted as ``delayed``, not ``throttled``:
+        they are admitted, only later.
+        """
+        events = list(events)
+        delayed = False
+        while True:
+            try:
+                return self._acquire(events, count_throttled=False)
+            except RateLimitExceeded as e:
+                if not delayed:
+                    delayed = True
+                    self.delayed += len(events)
+                await asyncio.sleep(e.retry_after)
+
+    def _throttle(self, org_id: str, events: int):
+        self.throttled += events
+        self.throttled_by_org[org_id] += events
+
+    def stats(self, top: int = 10) -> Dict:
+        """Admitted, throttled (rejected) and delayed event counts, with the most throttled organisations."""
+        return {
+            "enabled": settings.rate_limit_enabled,
+            "org_rate": self.org_rate,
+            "org_burst": self.org_burst,
+            "host_rate": self.host_rate,
+            "host_burst": self.host_burst,
+            "buckets": len(self._buckets),
+            "allowed": self.allowed,
+            "throttled": self.throttled,
+            "throttled_by_org": dict(self.throttled_by_org.most_common(top)),
+            "delayed": self.delayed,
+        }
+
+
+log_rate_limiter = RateLimiter(
+    "logs",
+    settings.rate_limit_logs_org_per_second,
+    settings.rate_limit_logs_org_burst,
+    settings.rate_limit_logs_host_per_second,
+    settings.rate_limit_logs_host_burst
+)
+telemetry_rate_limiter = RateLimiter(
+    "telemetry",
+    settings.rate_limit_telemetry_org_per_second,
+    settings.rate_limit_telemetry_org_burst,
+    settings.rate_limit_telemetry_host_per_second,
+    settings.rate_limit_telemetry_host_burst
+)
@@ -4,6 +4,7 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 from typing import Dict
 
 from ..models.schemas import RiskLevel, AlertSeverity
+from .log_rollups import LogRollupService
 
 
 class RiskScoringService:
@@ -85,7 +86,7 @@ class RiskScoringService:
         This can be run periodically as a background task.
         """
         # Get all unique hosts for this organisation
-        hosts = await self.db.logs.distinct("host", {"organisation_id": organisation_id})
+        hosts = await LogRollupService(self.db).distinct_hosts(organisation_id)
 
         for host in hosts:
             risk_data = await self.calculate_endpoint_risk(organisation_id, host)
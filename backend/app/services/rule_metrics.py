@@ -0,0 +1,215 @@
+"""Per-rule evaluation counts, hit rates and latency for the rule engine"""
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Awaitable, Dict, Optional, Tuple, TypeVar
+import logging
+import time
+
+from ..config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Upper bounds of the latency histogram buckets in milliseconds; a last bucket takes the rest
+LATENCY_BUCKETS_MS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+# At most one slow-rule warning per rule in this many seconds; the others are counted
+SLOW_LOG_INTERVAL_SECONDS = 10.0
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram; quantiles are reported as bucket upper bounds."""
+
+    __slots__ = ("counts", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float, samples: int = 1):
+        self.counts[bisect_left(LATENCY_BUCKETS_MS, ms)] += samples
+        self.total_ms += ms * samples
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def quantile(self, q: float) -> float:
+        samples = sum(self.counts)
+        if not samples:
+            return 0.0
+        rank = q * samples
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def stats(self) -> Dict:
+        samples = sum(self.counts)
+        return {
+            "total_ms": round(self.total_ms, 3),
+            "avg_ms": round(self.total_ms / samples, 4) if samples else 0.0,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": {
+                f"le_{bound}": count
+                for bound, count in zip(LATENCY_BUCKETS_MS + ("inf",), self.counts)
+                if count
+            },
+        }
+
+
+class RuleStats:
+    """Counters and latency histograms of one rule."""
+
+    __slots__ = ("evaluations", "hits", "db", "cpu", "slow", "_slow_unlogged", "_logged_at")
+
+    def __init__(self):
+        self.evaluations = 0
+        self.hits = 0
+        self.db = LatencyHistogram()
+        self.cpu = LatencyHistogram()
+        self.slow = 0
+        self._slow_unlogged = 0
+        self._logged_at = float("-inf")
+
+    def stats(self) -> Dict:
+        return {
+            "evaluations": self.evaluations,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.evaluations, 6) if self.evaluations else 0.0,
+            "slow": self.slow,
+            "db": self.db.stats(),
+            "cpu": self.cpu.stats(),
+        }
+
+
+class RuleTimer:
+    """
+    Times one rule evaluation.
+
+    Time spent awaiting MongoDB (calls wrapped in ``timed_db``) is counted
+    as DB time; the rest of the elapsed time, which is the rule's own work
+    on the event loop, is counted as CPU time.
+    """
+
+    __slots__ = ("started", "db_seconds")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_seconds = 0.0
+
+    @property
+    def cpu_seconds(self) -> float:
+        return max(time.perf_counter() - self.started - self.db_seconds, 0.0)
+
+
+# Timer of the rule evaluation running in the current task, if any
+current_rule_timer: ContextVar[Optional[RuleTimer]] = ContextVar("current_rule_timer", default=None)
+
+
+async def timed_db(awaitable: Awaitable[T]) -> T:
+    """Await a MongoDB call, counting the wait towards the current rule's DB time."""
+    timer = current_rule_timer.get()
+    if timer is None:
+        return await awaitable
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timer.db_seconds += time.perf_counter() - started
+
+
+async def measure_db(awaitable: Awaitable[T]) -> Tuple[T, float]:
+    """Await a MongoDB call made on behalf of a whole batch; returns (result, seconds)."""
+    started = time.perf_counter()
+    result = await awaitable
+    return result, time.perf_counter() - started
+
+
+class RuleMetrics:
+    """
+    Per-rule evaluation counts, hit counts and DB/CPU latency histograms.
+
+    Rules are recorded by name: the built-in checks, plus ``detection_rules``
+    and ``correlation`` for the declarative and sequence rule stages as a
+    whole. A batch is recorded as ``evaluations`` samples of its mean
+    latency per event, so the histograms stay per evaluation.
+
+    An evaluation slower than ``rule_latency_budget_ms`` (DB plus CPU time,
+    per event) is counted and logged; so is a single query made for a whole
+    batch that exceeds the budget. Warnings are limited to one per rule
+    every ``SLOW_LOG_INTERVAL_SECONDS``.
+    """
+
+    def __init__(self):
+        self.rules: Dict[str, RuleStats] = {}
+
+    def record(
+        self,
+        rule: str,
+        cpu_seconds: float,
+        db_seconds: float = 0.0,
+        evaluations: int = 1,
+        hits: int = 0,
+        context: str = ""
+    ):
+        """
+        Record one evaluation of a rule, or a batch of them.
+
+        Args:
+            rule: Rule name
+            cpu_seconds: Time spent in the rule's own code, in total
+            db_seconds: Time spent awaiting MongoDB, in total
+            evaluations: Events evaluated
+            hits: Events the rule raised an alert for
+            context: Description of the event or batch for the slow-rule log
+        """
+        if evaluations <= 0:
+            return
+        stats = self.rules.get(rule)
+        if stats is None:
+            stats = self.rules[rule] = RuleStats()
+
+        stats.evaluations += evaluations
+        stats.hits += hits
+        cpu_ms = cpu_seconds * 1000 / evaluations
+        db_ms = db_seconds * 1000 / evaluations
+        stats.cpu.observe(cpu_ms, evaluations)
+        if db_seconds:
+            stats.db.observe(db_ms, evaluations)
+
+        budget = settings.rule_latency_budget_ms
+        if budget <= 0:
+            return
+        if cpu_ms + db_ms > budget or (evaluations > 1 and db_seconds * 1000 > budget):
+            stats.slow += 1
+            self._log_slow(rule, stats, cpu_ms, db_ms, evaluations, context)
+
+    @staticmethod
+    def _log_slow(rule: str, stats: RuleStats, cpu_ms: float, db_ms: float, evaluations: int, context: str):
+        now = time.monotonic()
+        if now - stats._logged_at < SLOW_LOG_INTERVAL_SECONDS:
+            stats._slow_unlogged += 1
+            return
+        unlogged, stats._slow_unlogged, stats._logged_at = stats._slow_unlogged, 0, now
+        logger.warning(
+            "Slow rule %s: %.2f ms per event (db %.2f ms, cpu %.2f ms), %.2f ms for %d event(s)%s%s",
+            rule, cpu_ms + db_ms, db_ms, cpu_ms, (cpu_ms + db_ms) * evaluations, evaluations,
+            f" [{context}]" if context else "",
+            f"; {unlogged} more slow evaluation(s) since the last warning" if unlogged else ""
+        )
+
+    def stats(self) -> Dict:
+        return {
+            "latency_budget_ms": settings.rule_latency_budget_ms,
+            "rules": {name: stats.stats() for name, stats in sorted(self.rules.items())},
+        }
+
+
+rule_metrics = RuleMetrics()
@@ -0,0 +1,422 @@
+"""Telemetry ingestion pipeline shared by the telemetry API endpoints"""
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import secrets
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure
+
+from ..config import get_settings
+from ..database import prepare_document, write_or_spool
+from ..models.schemas import TelemetryResponse
+from .alert_suppression import AlertWriter
+from .dedup import content_fingerprint, telemetry_duplicates
+from .endpoint_tracker import endpoint_tracker
+
+settings = get_settings()
+
+# Fields that change on every collection and are not part of the system_info identity
+VOLATILE_SYSTEM_INFO_FIELDS = {"uptime_hours", "collected_at", "organisation_id"}
+
+
+def system_info_hash(system_info: Dict) -> str:
+    """Content hash of a system_info document, ignoring volatile fields."""
+    stable = {k: v for k, v in system_info.items() if k not in VOLATILE_SYSTEM_INFO_FIELDS}
+    canonical = json.dumps(stable, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+class SystemInfoHashCache:
+    """Bounded LRU of the last stored system_info hash per (organisation_id, hostname)."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._hashes: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+
+    def get(self, key: Tuple[str, str]) -> Optional[str]:
+        value = self._hashes.get(key)
+        if value is not None:
+            self._hashes.move_to_end(key)
+        return value
+
+    def put(self, key: Tuple[str, str], value: str):
+        self._hashes[key] = value
+        self._hashes.move_to_end(key)
+        while len(self._hashes) > self.max_entries:
+            self._hashes.popitem(last=False)
+
+
+system_info_cache = SystemInfoHashCache(settings.system_info_cache_size)
+
+
+@dataclass
+class PreparedTelemetry:
+    """Documents produced from one telemetry payload."""
+    telemetry_id: str
+    telemetry_doc: Dict
+    endpoint_filter: Dict
+    endpoint_doc: Dict
+    created_at: datetime
+    cache_key: Tuple[str, str]
+    system_info_hash: str
+    fingerprint: Optional[str] = None
+    system_info_required: bool = False
+    snapshot_doc: Optional[Dict] = None
+    alert_docs: List[Dict] = field(default_factory=list)
+
+
+class TelemetryIngestionService:
+    """
+    Stores agent telemetry, refreshes endpoint records and raises telemetry alerts.
+
+    Batches are written with one insert_many for telemetry and one bulk_write
+    for alerts, which folds repeats into open alerts; endpoint updates go through the shared endpoint tracker,
+    which merges them per host and writes them with one bulk_write.
+
+    system_info is delta-encoded: it is stored once per distinct content hash
+    in ``system_info_snapshots`` and telemetry documents keep only the hash.
+    Endpoint hardware fields are refreshed only when the hash changes.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self.alert_writer = AlertWriter(db)
+
+    @staticmethod
+    def fingerprint(payload: Dict, org_id: str) -> Optional[str]:
+        """Client-supplied fingerprint, or one derived from the agent and collection time if content fingerprints are enabled."""
+        if payload.get("fingerprint"):
+            return payload["fingerprint"]
+        if not settings.ingest_dedup_content_fingerprint:
+            return None
+        return content_fingerprint(org_id, payload["agent_id"], payload["hostname"], payload["collected_at"])
+
+    async def resolve_system_info(
+        self,
+        payload: Dict,
+        org_id: str
+    ) -> Tuple[Optional[Dict], str, bool]:
+        """
+        Work out whether the payload's system_info changed since the last one stored.
+
+        Returns:
+            Tuple of (system_info if it changed else None, hash, hash_unknown)
+        """
+        key = (org_id, payload["hostname"])
+
+        if payload["system_info"] is not None:
+            system_info = payload["system_info"]
+            info_hash = system_info_hash(system_info)
+            if system_info_cache.get(key) == info_hash:
+                return None, info_hash, False
+            return system_info, info_hash, False
+
+        info_hash = payload["system_info_hash"]
+        if system_info_cache.get(key) == info_hash:
+            return None, info_hash, False
+
+        # Not the last hash this worker stored for the host; it may be known from
+        # another worker or before a restart
+        snapshot = await self.db.system_info_snapshots.find_one(
+            {"organisation_id": org_id, "hash": info_hash},
+            {"system_info": 1}
+        )
+        if snapshot:
+            return snapshot["system_info"], info_hash, False
+
+        return None, info_hash, True
+
+    async def prepare(
+        self,
+        payload: Dict,
+        org_id: str,
+        agent_version: Optional[str] = None
+    ) -> PreparedTelemetry:
+        """
+        Build the telemetry, endpoint, snapshot and alert documents for one payload.
+
+        Args:
+            payload: Telemetry payload validated into a plain dict (see
+                ``models.documents.telemetry_payload_adapter``); its nested
+                lists are stored as they are, without another dump
+            org_id: Organisation the payload is stored under
+            agent_version: Agent version from the X-Agent-Version header
+        """
+        # Ensure payload uses the correct org ID
+        payload["organisation_id"] = org_id
+        if payload["system_info"] is not None:
+            payload["system_info"]["organisation_id"] = org_id
+
+        system_info, info_hash, hash_unknown = await self.resolve_system_info(payload, org_id)
+        agent_version = agent_version or (system_info or {}).get("agent_version")
+
+        # Generate telemetry ID
+        telemetry_id = f"tel_{secrets.token_hex(12)}"
+        timestamp = datetime.utcnow()
+        fingerprint = self.fingerprint(payload, org_id)
+
+        # Prepare telemetry document; system_info itself lives in system_info_snapshots
+        telemetry_doc = {
+            "telemetry_id": telemetry_id,
+            "agent_id": payload["agent_id"],
+            "hostname": payload["hostname"],
+            "organisation_id": org_id,
+            "collected_at": payload["collected_at"],
+            "ingested_at": timestamp,
+            "agent_version": agent_version,
+            "system_info_hash": info_hash,
+            "system_info_changed": system_info is not None,
+            "uptime_hours": payload["system_info"]["uptime_hours"] if payload["system_info"] else None,
+            "security_events": payload["security_events"],
+            "process_info": payload["process_info"],
+            "metrics": payload["metrics"]
+        }
+        if fingerprint:
+            telemetry_doc["fingerprint"] = fingerprint
+        prepare_document("telemetry", telemetry_doc)
+
+        # Update or create endpoint record
+        endpoint_doc = {
+            "hostname": payload["hostname"],
+            "organisation_id": org_id,
+            "last_seen": timestamp,
+            "status": "online",
+            "health_score": 100,  # Calculate based on metrics
+            "risk_score": 0,  # Calculate based on security events
+            "updated_at": timestamp
+        }
+        if agent_version:
+            endpoint_doc["agent_version"] = agent_version
+
+        snapshot_doc = None
+        if system_info is not None:
+            endpoint_doc.update({
+                "os_name": system_info["os_name"],
+                "os_version": system_info["os_version"],
+                "os_architecture": system_info["os_architecture"],
+                "cpu_cores": system_info["cpu_cores"],
+                "total_memory_gb": system_info["total_memory_gb"],
+                "domain": system_info["domain"],
+                "manufacturer": system_info["manufacturer"],
+                "model": system_info["model"],
+                "system_info_hash": info_hash
+            })
+            if payload["system_info"] is not None:
+                snapshot_doc = {
+                    "organisation_id": org_id,
+                    "hash": info_hash,
+                    "hostname": payload["hostname"],
+                    "system_info": system_info,
+                    "first_seen": timestamp
+                }
+
+        prepared = PreparedTelemetry(
+            telemetry_id=telemetry_id,
+            telemetry_doc=telemetry_doc,
+            endpoint_filter={"hostname": payload["hostname"], "organisation_id": org_id},
+            endpoint_doc=endpoint_doc,
+            created_at=timestamp,
+            cache_key=(org_id, payload["hostname"]),
+            system_info_hash=info_hash,
+            system_info_required=hash_unknown,
+            fingerprint=fingerprint,
+            snapshot_doc=snapshot_doc
+        )
+
+        # Check for suspicious security events
+        failed_logon_events = [
+            event for event in payload["security_events"]
+            if event["event_id"] == 4625  # Failed logon
+        ]
+
+        if len(failed_logon_events) >= 5:
+            # Create alert for multiple failed logons
+            prepared.alert_docs.append({
+                "alert_id": f"alert_{secrets.token_hex(8)}",
+                "organisation_id": org_id,
+                "title": "Multiple Failed Logon Attempts Detected",
+                "description": f"Endpoint {payload['hostname']} had {len(failed_logon_events)} failed logon attempts",
+                "severity": "high",
+                "status": "open",
+                "host": payload["hostname"],
+                "event_type": "authentication",
+                "triggered_by": "rule",
+                "rule_name": "Multiple Failed Logons",
+                "created_at": timestamp,
+                "updated_at": timestamp,
+                "related_telemetry_ids": [telemetry_id],
+                "comments": []
+            })
+
+        # Check for suspicious processes
+        high_cpu_processes = [
+            proc for proc in payload["process_info"]
+            if proc["cpu"] > 80  # High CPU usage
+        ]
+
+        if len(high_cpu_processes) >= 3:
+            # Create alert for high CPU usage
+            prepared.alert_docs.append({
+                "alert_id": f"alert_{secrets.token_hex(8)}",
+                "organisation_id": org_id,
+                "title": "High CPU Usage Detected",
+                "description": f"Endpoint {payload['hostname']} has {len(high_cpu_processes)} processes with high CPU usage",
+                "severity": "medium",
+                "status": "open",
+                "host": payload["hostname"],
+                "event_type": "performance",
+                "triggered_by": "rule",
+                "rule_name": "High CPU Usage",
+                "created_at": timestamp,
+                "updated_at": timestamp,
+                "related_telemetry_ids": [telemetry_id],
+                "comments": []
+            })
+
+        return prepared
+
+    @staticmethod
+    def track_endpoint(prepared: PreparedTelemetry):
+        """Queue the endpoint refresh; merged with other updates for the host."""
+        endpoint_tracker.track(
+            prepared.endpoint_filter,
+            prepared.endpoint_doc,
+            {"created_at": prepared.created_at}
+        )
+
+    @staticmethod
+    def snapshot_update(prepared: PreparedTelemetry) -> Tuple[Dict, Dict]:
+        """(filter, update) storing a system_info snapshot unless its hash is already stored."""
+        return (
+            {"organisation_id": prepared.snapshot_doc["organisation_id"], "hash": prepared.system_info_hash},
+            {"$setOnInsert": prepared.snapshot_doc}
+        )
+
+    @staticmethod
+    def remember_system_info(prepared: PreparedTelemetry):
+        """Record the host's current hash once its snapshot is known to be stored."""
+        if not prepared.system_info_required:
+            system_info_cache.put(prepared.cache_key, prepared.system_info_hash)
+
+    @staticmethod
+    def build_duplicate_response() -> TelemetryResponse:
+        return TelemetryResponse(
+            success=True,
+            message="Duplicate telemetry payload ignored",
+            duplicate=True
+        )
+
+    @staticmethod
+    def build_response(prepared: PreparedTelemetry) -> TelemetryResponse:
+        return TelemetryResponse(
+            success=True,
+            message=(
+                "Telemetry data ingested; unknown system_info_hash, resend system_info"
+                if prepared.system_info_required
+                else "Telemetry data ingested successfully"
+            ),
+            telemetry_id=prepared.telemetry_id,
+            endpoint_updated=True,
+            alerts_created=len(prepared.alert_docs),
+            system_info_hash=None if prepared.system_info_required else prepared.system_info_hash,
+            system_info_required=prepared.system_info_required
+        )
+
+    async def store_snapshots(self, batch: List[PreparedTelemetry]):
+        """
+        Store new system_info snapshots with one bulk_write.
+
+        If MongoDB is unavailable the snapshots are skipped and their hashes
+        are not remembered, so the next payload with full system_info stores
+        them instead.
+        """
+        snapshot_ops = [
+            UpdateOne(*self.snapshot_update(prepared), upsert=True)
+            for prepared in batch if prepared.snapshot_doc
+        ]
+        if not snapshot_ops:
+            return
+
+        try:
+            await asyncio.wait_for(
+                self.db.system_info_snapshots.bulk_write(snapshot_ops, ordered=False),
+                timeout=settings.mongo_write_timeout_seconds
+            )
+        except (asyncio.TimeoutError, ConnectionFailure):
+            for prepared in batch:
+                if prepared.snapshot_doc:
+                    prepared.system_info_required = True
+
+    async def ingest(self, prepared: PreparedTelemetry) -> TelemetryResponse:
+        """Store one prepared telemetry payload."""
+        return (await self.ingest_batch([prepared]))[0]
+
+    async def ingest_batch(self, batch: List[PreparedTelemetry]) -> List[TelemetryResponse]:
+        """
+        Store many prepared telemetry payloads.
+
+        Telemetry and alert documents fall back to the on-disk spool when
+        MongoDB is slow or unavailable, and are replayed once it recovers.
+
+        Returns:
+            One TelemetryResponse per payload, in input order
+        """
+        if not batch:
+            return []
+
+        # Drop agent retries before writing anything
+        fingerprinted = [i for i, prepared in enumerate(batch) if prepared.fingerprint]
+        duplicates = {
+            fingerprinted[i] for i in await telemetry_duplicates.find_duplicates(
+                self.db,
+                [(batch[i].telemetry_doc["organisation_id"], batch[i].fingerprint) for i in fingerprinted]
+            )
+        }
+        to_insert = [i for i in range(len(batch)) if i not in duplicates]
+
+        await self.store_snapshots([batch[i] for i in to_insert])
+
+        failed: Dict[int, str] = {}
+
+        try:
+            if to_insert:
+                await write_or_spool(self.db.telemetry, [batch[i].telemetry_doc for i in to_insert])
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                index = to_insert[error["index"]]
+                if error.get("code") == 11000:
+                    duplicates.add(index)
+                else:
+                    failed[index] = error.get("errmsg", "Write failed")
+
+        alert_docs = []
+        for index, prepared in enumerate(batch):
+            if index in failed or index in duplicates:
+                continue
+            self.track_endpoint(prepared)
+            self.remember_system_info(prepared)
+            alert_docs.extend(prepared.alert_docs)
+
+        if alert_docs:
+            await self.alert_writer.write_or_spool(alert_docs)
+
+        results = []
+        for index, prepared in enumerate(batch):
+            if index in duplicates:
+                results.append(self.build_duplicate_response())
+            elif index in failed:
+                results.append(TelemetryResponse(
+                    success=False,
+                    message=f"Failed to ingest telemetry: {failed[index]}",
+                    telemetry_id=prepared.telemetry_id
+                ))
+            else:
+                results.append(self.build_response(prepared))
+
+        return results
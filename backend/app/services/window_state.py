@@ -0,0 +1,216 @@
+"""Sliding-window per-user counters for the windowed detection rules"""
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+import logging
+import time
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ..config import get_settings
+from ..database import meta_query
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+def epoch_minute(moment: datetime) -> int:
+    """Minutes since the epoch; naive datetimes are UTC, as stored by the ingest paths."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() // 60)
+
+
+class MinuteWindow:
+    """
+    Ring buffer of one-minute buckets: a count and a set of distinct values per minute.
+
+    Running totals (the count, and per value the number of buckets it
+    appears in) are adjusted as buckets are filled and expired, so the
+    window's count and distinct count are both read in O(1). The rule
+    engine uses one per (organisation_id, user) for failed logins and
+    hosts; declarative rules use them for their window aggregations.
+    """
+
+    __slots__ = ("size", "now", "minutes", "counts", "values", "count_total", "value_refs")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.now = -1
+        self.minutes = [-1] * size
+        self.counts = [0] * size
+        self.values: List[Optional[Set[str]]] = [None] * size
+        self.count_total = 0
+        self.value_refs: Dict[str, int] = {}
+
+    def advance(self, minute: int):
+        """Expire every bucket that falls out of the window ending at ``minute``."""
+        if minute <= self.now:
+            return
+        for m in range(max(self.now + 1, minute - self.size + 1), minute + 1):
+            slot = m % self.size
+            if self.minutes[slot] == -1:
+                continue
+            self.count_total -= self.counts[slot]
+            for value in self.values[slot] or ():
+                refs = self.value_refs[value] - 1
+                if refs:
+                    self.value_refs[value] = refs
+                else:
+                    del self.value_refs[value]
+            self.minutes[slot] = -1
+            self.counts[slot] = 0
+            self.values[slot] = None
+        self.now = minute
+
+    def add(self, minute: int, value: str, count: int = 0):
+        """Record ``value`` (and add ``count``) in ``minute``."""
+        self.advance(minute)
+        if minute <= self.now - self.size:
+            return  # older than the window
+
+        slot = minute % self.size
+        self.minutes[slot] = minute
+        if count:
+            self.counts[slot] += count
+            self.count_total += count
+
+        values = self.values[slot]
+        if values is None:
+            values = self.values[slot] = set()
+        if value not in values:
+            values.add(value)
+            self.value_refs[value] = self.value_refs.get(value, 0) + 1
+
+    @property
+    def distinct(self) -> int:
+        return len(self.value_refs)
+
+    @property
+    def empty(self) -> bool:
+        return not self.value_refs
+
+
+class WindowState:
+    """
+    Shared sliding-window state for ``failed_login_threshold`` and ``multiple_host_access``.
+
+    The rule engine records every event it evaluates, then reads the failed
+    login count and distinct host count for the event's (organisation_id,
+    user) over the last ``rule_window_minutes`` without querying MongoDB.
+    Event timestamps place activity in its minute; events older than the
+    window are ignored and future-dated events count in the current minute,
+    like the ``timestamp >= now - window`` queries they replace.
+
+    The state is rebuilt from the last window of logs on startup and is
+    per process. Until the rebuild succeeds ``ready`` is False and the rule
+    engine falls back to its MongoDB queries. Windows are kept in an LRU
+    bounded by ``rule_window_max_keys``.
+    """
+
+    def __init__(self, window_minutes: int, max_keys: int):
+        self.window_minutes = window_minutes
+        self.max_keys = max_keys
+        self._windows: "OrderedDict[Tuple[str, str], MinuteWindow]" = OrderedDict()
+        self.ready = False
+
+    def _window(self, key: Tuple[str, str], create: bool) -> Optional[MinuteWindow]:
+        window = self._windows.get(key)
+        if window is not None:
+            self._windows.move_to_end(key)
+        elif create:
+            window = self._windows[key] = MinuteWindow(self.window_minutes)
+            while len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+        return window
+
+    def record(self, organisation_id: str, user: str, host: str, timestamp: datetime, failed_login: bool):
+        """Add one event to its (organisation_id, user) window."""
+        now = int(time.time() // 60)
+        self._add((organisation_id, user), min(epoch_minute(timestamp), now), host, int(failed_login), now)
+
+    def _add(self, key: Tuple[str, str], minute: int, host: str, failed_logins: int, now: int):
+        if minute <= now - self.window_minutes:
+            return
+        window = self._window(key, create=True)
+        window.advance(now)
+        window.add(minute, host, failed_logins)
+
+    def counts(self, organisation_id: str, user: str) -> Tuple[int, int]:
+        """
+        Failed logins and distinct hosts for a user over the window ending now.
+
+        Returns:
+            Tuple of (failed_login_count, distinct_host_count)
+        """
+        key = (organisation_id, user)
+        window = self._window(key, create=False)
+        if window is None:
+            return 0, 0
+
+        window.advance(int(time.time() // 60))
+        if window.empty:
+            del self._windows[key]
+            return 0, 0
+        return window.count_total, window.distinct
+
+    async def rebuild(self, db: AsyncIOMotorDatabase):
+        """
+        Load the last window of logs, grouped per user, host and minute.
+
+        Errors are logged and leave the state not ready, so detection keeps
+        using MongoDB queries.
+        """
+        since = datetime.utcnow() - timedelta(minutes=self.window_minutes)
+        now = int(time.time() // 60)
+        pipeline = [
+            {"$match": meta_query("logs", {"timestamp": {"$gte": since}})},
+            {"$group": {
+                "_id": {
+                    "organisation_id": "$organisation_id",
+                    "user": "$user",
+                    "host": "$host",
+                    "minute": {"$floor": {"$divide": [{"$toLong": "$timestamp"}, 60000]}},
+                },
+                "failed_logins": {"$sum": {"$cond": [
+                    {"$and": [
+                        {"$eq": ["$event_type", "login"]},
+                        {"$eq": ["$details.success", False]},
+                    ]},
+                    1,
+                    0
+                ]}},
+            }},
+        ]
+
+        self._windows.clear()
+        self.ready = False
+        try:
+            async for row in db.logs.aggregate(pipeline, allowDiskUse=True):
+                key = row["_id"]
+                self._add(
+                    (key["organisation_id"], key["user"]),
+                    min(int(key["minute"]), now),
+                    key["host"],
+                    row["failed_logins"],
+                    now
+                )
+        except Exception:
+            logger.exception("Could not rebuild rule window state; windowed rules will query MongoDB")
+            self._windows.clear()
+            return
+
+        self.ready = True
+        print(f"✅ Rule window state rebuilt for {len(self._windows)} users")
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": settings.rule_window_state_enabled,
+            "ready": self.ready,
+            "window_minutes": self.window_minutes,
+            "users": len(self._windows),
+            "max_keys": self.max_keys,
+        }
+
+
+window_state = WindowState(settings.rule_window_minutes, settings.rule_window_max_keys)
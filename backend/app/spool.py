@@ -0,0 +1,255 @@
+"""Durable on-disk ingest spool used while MongoDB is slow or unavailable"""
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+import os
+import threading
+import uuid
+
+from bson import json_util
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import BulkWriteError
+
+from .config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+OPEN_SUFFIX = ".open"
+SEALED_SUFFIX = ".ndjson"
+CLAIMED_SUFFIX = ".replaying"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class IngestSpool:
+    """
+    Append-only, segment-rotated spool of documents that could not be written.
+
+    Each line is one ``{"c": collection, "d": document}`` record in MongoDB
+    extended JSON, so datetimes and the client-assigned ``_id`` survive the
+    round trip. The active segment is sealed once it reaches
+    ``spool_segment_max_bytes``, or by the replayer when nothing else is
+    waiting to be replayed. Segment names carry the writer's PID and a token
+    unique to this spool, so a restarted process that gets the same PID
+    (as it usually does in a container) never reuses an earlier name.
+
+    The replayer claims sealed segments by renaming them (safe across worker
+    processes sharing the directory), re-inserts them in batches with
+    unordered insert_many, records its progress in an offset file and deletes
+    the segment when done. Duplicate-key errors are ignored: a document whose
+    ``_id`` already exists was written before the spool took over.
+    """
+
+    def __init__(self):
+        self.directory: Optional[Path] = None
+        self._lock = threading.Lock()
+        self._file = None
+        self._path: Optional[Path] = None
+        self._sequence = 0
+        self._token = uuid.uuid4().hex[:12]
+        self._task: Optional[asyncio.Task] = None
+        self._db: Optional[AsyncIOMotorDatabase] = None
+        self._on_replayed: Dict[str, Callable[[List[Dict]], Awaitable[None]]] = {}
+        self.spooled = 0
+        self.replayed = 0
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def _segment_name(self) -> str:
+        self._sequence += 1
+        return f"segment-{os.getpid()}-{self._token}-{self._sequence:08d}"
+
+    def _owned_by_live_writer(self, path: Path) -> bool:
+        """Whether the segment belongs to this spool or to another process that is still running."""
+        try:
+            _, pid, token, _ = path.name.split("-", 3)
+            owner = int(pid)
+        except ValueError:
+            return False  # not a name this spool writes; treat as orphaned
+        if owner == os.getpid():
+            # Same PID but another token: an earlier run of this container
+            return token == self._token
+        return _pid_alive(owner)
+
+    def _append_sync(self, collection: str, documents: List[Dict]):
+        lines = "".join(
+            json_util.dumps({"c": collection, "d": document}) + "\n"
+            for document in documents
+        ).encode()
+
+        with self._lock:
+            if self._file is None:
+                self._path = self.directory / (self._segment_name() + OPEN_SUFFIX)
+                self._file = open(self._path, "ab")
+
+            self._file.write(lines)
+            self._file.flush()
+            if settings.spool_fsync:
+                os.fsync(self._file.fileno())
+            self.spooled += len(documents)
+
+            if self._file.tell() >= settings.spool_segment_max_bytes:
+                self._seal_locked()
+
+    def _seal_locked(self):
+        """Close the active segment and make it visible to the replayer."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._path.rename(self._path.with_suffix(SEALED_SUFFIX))
+        self._file = None
+        self._path = None
+
+    async def append(self, collection: str, documents: List[Dict]):
+        """Durably append documents destined for ``collection``."""
+        if self.directory is None:
+            raise RuntimeError("Ingest spool is not started")
+        await asyncio.to_thread(self._append_sync, collection, documents)
+
+    @property
+    def pending_segments(self) -> int:
+        if self.directory is None:
+            return 0
+        return sum(1 for path in self.directory.glob("segment-*") if path.suffix != ".offset")
+
+    # ------------------------------------------------------------------
+    # Replay
+    # ------------------------------------------------------------------
+
+    def on_replayed(self, collection: str, callback: Callable[[List[Dict]], Awaitable[None]]):
+        """Register a coroutine awaited with each batch of documents replayed into ``collection``."""
+        self._on_replayed[collection] = callback
+
+    async def start(self, db: AsyncIOMotorDatabase, directory: Optional[str] = None):
+        """Prepare the spool directory, recover orphaned segments and start the replayer."""
+        self._db = db
+        self.directory = Path(directory or settings.spool_directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._recover_orphans()
+        self._task = asyncio.create_task(self._run(), name="spool-replayer")
+
+    async def stop(self):
+        """Stop the replayer and seal the active segment for the next start."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        with self._lock:
+            self._seal_locked()
+
+    def _recover_orphans(self):
+        """Seal open segments and release claims left behind by processes that are gone."""
+        for path in self.directory.glob("segment-*"):
+            if path.suffix not in (OPEN_SUFFIX, CLAIMED_SUFFIX) or self._owned_by_live_writer(path):
+                continue
+            path.rename(path.with_suffix(SEALED_SUFFIX))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.spool_replay_interval_seconds)
+            try:
+                await self.replay()
+            except Exception as e:
+                logger.warning("Spool replay paused: %s", e)
+
+    async def replay(self):
+        """Drain every sealed segment, sealing the idle active segment first."""
+        if self.directory is None:
+            return
+
+        sealed = sorted(self.directory.glob(f"segment-*{SEALED_SUFFIX}"))
+        if not sealed:
+            with self._lock:
+                if self._file is None:
+                    return
+                self._seal_locked()
+            sealed = sorted(self.directory.glob(f"segment-*{SEALED_SUFFIX}"))
+
+        # Don't start replaying into a database that is still down
+        await asyncio.wait_for(self._db.command("ping"), timeout=settings.mongo_write_timeout_seconds)
+
+        for path in sealed:
+            claimed = path.with_suffix(CLAIMED_SUFFIX)
+            try:
+                path.rename(claimed)
+            except FileNotFoundError:
+                continue  # claimed by another worker
+
+            try:
+                await self._replay_segment(claimed)
+            except Exception:
+                # Release the claim; progress so far is kept in the offset file
+                claimed.rename(path)
+                raise
+
+    async def _replay_segment(self, path: Path):
+        offset_path = path.with_name(path.name + ".offset")  # survives release/re-claim
+        offset = int(offset_path.read_text()) if offset_path.exists() else 0
+
+        with open(path, "rb") as segment:
+            segment.seek(offset)
+            while True:
+                lines = await asyncio.to_thread(_read_lines, segment, settings.spool_replay_batch_size)
+                if not lines:
+                    break
+
+                by_collection: Dict[str, List[Dict]] = {}
+                for line in lines:
+                    try:
+                        record = json_util.loads(line)
+                    except ValueError:
+                        # Torn write from a crash mid-append
+                        logger.warning("Skipping malformed spool record in %s", path.name)
+                        continue
+                    by_collection.setdefault(record["c"], []).append(record["d"])
+
+                for collection, documents in by_collection.items():
+                    await self._insert(collection, documents)
+                    callback = self._on_replayed.get(collection)
+                    if callback:
+                        await callback(documents)
+
+                self.replayed += len(lines)
+                offset_path.write_text(str(segment.tell()))
+
+        path.unlink()
+        offset_path.unlink(missing_ok=True)
+
+    async def _insert(self, collection: str, documents: List[Dict]):
+        try:
+            await self._db[collection].insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+            if errors:
+                raise
+
+
+def _read_lines(segment, count: int) -> List[bytes]:
+    lines = []
+    for _ in range(count):
+        line = segment.readline()
+        if not line:
+            break
+        if line.strip():
+            lines.append(line)
+    return lines
+
+
+spool = IngestSpool()
+
+
+def get_spool() -> IngestSpool:
+    """Get the shared ingest spool"""
+    return spool
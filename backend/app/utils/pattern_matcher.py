@@ -0,0 +1,168 @@
+"""Single-pass multi-pattern substring matching (Aho-Corasick)"""
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalise(text: str) -> str:
+    """Lower-case and collapse runs of whitespace, so ``PowerShell  -Enc`` matches ``powershell -enc``."""
+    return _WHITESPACE.sub(" ", text).lower()
+
+
+def normalised_values(value: Any) -> str:
+    """
+    Normalised text of every string in a (nested) details dict, one pass worth.
+
+    Values are joined with NUL so a pattern cannot match across two fields.
+    """
+    parts: List[str] = []
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+        elif item is not None and not isinstance(item, bool):
+            parts.append(str(item))
+    return normalise("\x00".join(parts))
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton over a fixed set of (normalised) patterns.
+
+    Built once in O(total pattern length); ``find_all`` then scans the text
+    once, whatever the number of patterns, and reports every pattern that
+    occurs in it.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+
+        seen = set()
+        for pattern in patterns:
+            pattern = normalise(pattern)
+            if not pattern or pattern in seen:
+                continue
+            seen.add(pattern)
+            self._add(pattern, len(self.patterns))
+            self.patterns.append(pattern)
+
+        self._link()
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def _add(self, pattern: str, index: int):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append(index)
+
+    def _link(self):
+        """Breadth-first failure links; each state's output includes its failure chain's."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def find_all(self, text: str) -> List[str]:
+        """
+        Every pattern occurring in ``text`` (already normalised).
+
+        Returns:
+            Matched patterns in the order they were configured, each once
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        matched = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                matched.update(out[state])
+        return [self.patterns[index] for index in sorted(matched)]
+
+
+class PatternSetMatcher:
+    """
+    Compiled matcher for a configured pattern list plus an optional patterns file.
+
+    The automaton is rebuilt when the configured list changes or the file's
+    modification time changes; the file is checked at most every
+    ``reload_interval`` seconds. The file holds one pattern per line; blank
+    lines and lines starting with ``#`` are ignored.
+    """
+
+    def __init__(self, reload_interval: float = 30.0):
+        self.reload_interval = reload_interval
+        self._automaton = AhoCorasick([])
+        self._source: Optional[Tuple] = None
+        self._checked_at = 0.0
+
+    def get(self, patterns: Iterable[str], patterns_file: str = "") -> AhoCorasick:
+        """The automaton for ``patterns`` and ``patterns_file``, rebuilt if either changed."""
+        patterns = tuple(patterns)
+        now = time.monotonic()
+
+        if (
+            self._source is not None
+            and self._source[:2] == (patterns, patterns_file)
+            and now - self._checked_at < self.reload_interval
+        ):
+            return self._automaton
+
+        self._checked_at = now
+        source = (patterns, patterns_file, self._file_mtime(patterns_file))
+        if source != self._source:
+            file_patterns = self._read_file(patterns_file)
+            self._automaton = AhoCorasick(list(patterns) + file_patterns)
+            self._source = source
+            logger.info("Compiled %d suspicious process patterns", len(self._automaton))
+        return self._automaton
+
+    @staticmethod
+    def _file_mtime(path: str) -> Optional[float]:
+        if not path:
+            return None
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    @staticmethod
+    def _read_file(path: str) -> List[str]:
+        if not path:
+            return []
+        try:
+            lines = Path(path).read_text(encoding="utf-8").splitlines()
+        except OSError:
+            logger.warning("Could not read pattern file %s", path)
+            return []
+        return [line.strip() for line in lines if line.strip() and not line.lstrip().startswith("#")]
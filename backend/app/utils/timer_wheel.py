@@ -0,0 +1,77 @@
+"""Hashed timer wheel for expiring many deadlines cheaply"""
+from typing import Callable, Generic, Hashable, List, Set, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+
+
+class TimerWheel(Generic[K]):
+    """
+    Deadlines hashed into ``slots`` buckets of ``resolution`` seconds each.
+
+    ``schedule`` is O(1) and ``advance`` only visits the buckets that came
+    due since the last call, so expiring partial state does not require
+    scanning all of it. Deadlines further away than one turn of the wheel
+    are re-hashed when their bucket comes round. Entries are not removed
+    when a deadline moves; ``advance`` asks ``is_due`` whether each entry
+    still applies, so callers can reschedule freely. The first ``advance``
+    starts from the earliest deadline scheduled before it, so entries
+    scheduled before the wheel first moved are not a turn late.
+    """
+
+    __slots__ = ("slots", "resolution", "buckets", "tick", "earliest", "size")
+
+    def __init__(self, slots: int = 512, resolution: float = 10.0):
+        self.slots = slots
+        self.resolution = resolution
+        self.buckets: List[Set[Tuple[K, float]]] = [set() for _ in range(slots)]
+        self.tick = -1
+        self.earliest = -1
+        self.size = 0
+
+    def schedule(self, key: K, deadline: float):
+        """Fire ``key`` once ``advance`` reaches ``deadline`` (seconds)."""
+        # Deadlines already passed go in the current bucket rather than wait a whole turn
+        tick = max(int(deadline // self.resolution), self.tick)
+        if self.tick < 0 and (self.earliest < 0 or tick < self.earliest):
+            self.earliest = tick
+        bucket = self.buckets[tick % self.slots]
+        if (key, deadline) not in bucket:
+            bucket.add((key, deadline))
+            self.size += 1
+
+    def advance(self, now: float, is_due: Callable[[K, float], bool]) -> List[K]:
+        """
+        Move the wheel to ``now`` and collect the keys whose deadline passed.
+
+        Args:
+            now: Current time in seconds, on the same clock as the deadlines
+            is_due: Called as ``is_due(key, deadline)`` for each passed entry;
+                False drops the entry (its deadline was moved or it is gone)
+
+        Returns:
+            Keys whose current deadline has passed
+        """
+        target = int(now // self.resolution)
+        if self.tick < 0:
+            self.tick = target if self.earliest < 0 else min(target, self.earliest)
+
+        # The current bucket is revisited: entries due later in it were kept last time
+        expired: List[K] = []
+        start = max(self.tick, target - self.slots + 1)
+        for tick in range(start, target + 1):
+            bucket = self.buckets[tick % self.slots]
+            if not bucket:
+                continue
+            keep = set()
+            for key, deadline in bucket:
+                if deadline > now:
+                    keep.add((key, deadline))  # a later turn of the wheel
+                elif is_due(key, deadline):
+                    expired.append(key)
+            self.size -= len(bucket) - len(keep)
+            self.buckets[tick % self.slots] = keep
+        self.tick = max(self.tick, target)
+        return expired
+
+    def __len__(self) -> int:
+        return self.size
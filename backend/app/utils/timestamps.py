@@ -0,0 +1,15 @@
+"""Timestamp normalisation shared by the ingest paths"""
+from datetime import datetime, timezone
+
+
+def utc_naive(moment: datetime) -> datetime:
+    """
+    Naive UTC datetime, as stored in MongoDB.
+
+    Agents send aware timestamps (``...Z``) while server-side values are
+    naive UTC; comparing the two raises ``TypeError``, so anything compared
+    or merged in memory goes through this first.
+    """
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
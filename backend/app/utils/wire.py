@@ -0,0 +1,241 @@
+"""Compressed and MessagePack request bodies for the ingest APIs"""
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List
+import zlib
+
+from fastapi import HTTPException, Request, Response, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+from pydantic import TypeAdapter, ValidationError
+
+from ..config import get_settings
+
+settings = get_settings()
+
+# Optional wire-format dependencies
+MSGPACK_AVAILABLE = False
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    msgpack = None
+
+ZSTD_AVAILABLE = False
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+
+MSGPACK_CONTENT_TYPES = {"application/msgpack", "application/x-msgpack", "application/vnd.msgpack"}
+BODY_FORMAT_SCOPE_KEY = "healthguard.body_format"
+
+
+# Largest piece of decoded output produced at a time
+DECODE_STEP = 1 << 20
+
+
+class _BoundedSink:
+    """Collects zstd output pieces for ``_Decoder``, counting each against its limit as it arrives."""
+
+    def __init__(self, decoder: "_Decoder"):
+        self.decoder = decoder
+        self.pieces: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.pieces.append(self.decoder._count(data))
+        return len(data)
+
+
+class _Decoder:
+    """Incremental decoder for one Content-Encoding, bounded by ``limit`` output bytes."""
+
+    def __init__(self, encoding: str, limit: int):
+        self.limit = limit
+        self.produced = 0
+        self._first = True
+
+        if encoding in ("gzip", "x-gzip"):
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            self._zlib = zlib.decompressobj()
+        elif encoding == "zstd" and ZSTD_AVAILABLE:
+            self._zlib = None
+            self._sink = _BoundedSink(self)
+            # The writer hands output to the sink DECODE_STEP bytes at a time, so the limit is
+            # enforced while a frame is decoded rather than after all of it was allocated
+            self._zstd = zstandard.ZstdDecompressor().stream_writer(self._sink, write_size=DECODE_STEP)
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                detail=f"Unsupported Content-Encoding: {encoding}"
+            )
+
+    def _count(self, data: bytes) -> bytes:
+        self.produced += len(data)
+        if self.produced > self.limit:
+            raise self._too_large()
+        return data
+
+    def _too_large(self) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Decoded request body exceeds {self.limit} bytes"
+        )
+
+    def _check_declared_size(self, chunk: bytes):
+        """Reject a zstd frame whose header already declares more than the limit."""
+        try:
+            content_size = zstandard.get_frame_parameters(chunk).content_size
+        except zstandard.ZstdError:
+            return  # header split across chunks or corrupt; the bounded decode still applies
+        if content_size != zstandard.CONTENTSIZE_UNKNOWN and content_size > self.limit:
+            raise self._too_large()
+
+    def decode(self, chunk: bytes) -> Iterator[bytes]:
+        if self._zlib is None:
+            if self._first:
+                self._first = False
+                self._check_declared_size(chunk)
+            self._zstd.write(chunk)
+            pieces, self._sink.pieces = self._sink.pieces, []
+            yield from pieces
+            return
+
+        # Inflate in bounded steps so a small bomb can't allocate the whole output at once
+        data = chunk
+        while data:
+            yield self._count(self._zlib.decompress(data, DECODE_STEP))
+            data = self._zlib.unconsumed_tail
+
+    def finish(self) -> bytes:
+        if self._zlib is None:
+            return b""
+        return self._count(self._zlib.flush())
+
+
+class WireFormatRequest(Request):
+    """
+    Request that transparently decodes compressed and MessagePack bodies.
+
+    ``stream()`` (and therefore ``body()``) yields the decompressed body for
+    ``Content-Encoding: gzip``, ``deflate`` or ``zstd``. When the route
+    rewrote a MessagePack request, ``json()`` unpacks the body with msgpack
+    instead of parsing JSON.
+    """
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        encoding = self.headers.get("content-encoding", "identity").strip().lower()
+        if encoding in ("", "identity") or hasattr(self, "_body"):
+            async for chunk in super().stream():
+                yield chunk
+            return
+
+        decoder = _Decoder(encoding, settings.ingest_max_decoded_body_bytes)
+        async for chunk in super().stream():
+            if not chunk:
+                continue
+            for data in decoder.decode(chunk):
+                if data:
+                    yield data
+        tail = decoder.finish()
+        if tail:
+            yield tail
+
+    async def json(self) -> Any:
+        if self.scope.get(BODY_FORMAT_SCOPE_KEY) != "msgpack":
+            return await super().json()
+        if not hasattr(self, "_json"):
+            self._json = msgpack.unpackb(await self.body(), raw=False, timestamp=3)
+        return self._json
+
+
+def _inline_refs(schema: Any, definitions: Dict) -> Any:
+    """Replace local ``#/$defs/...`` references with the definitions themselves."""
+    if isinstance(schema, dict):
+        ref = schema.get("$ref", "")
+        if ref.startswith("#/$defs/"):
+            return _inline_refs(definitions[ref[len("#/$defs/"):]], definitions)
+        return {key: _inline_refs(value, definitions) for key, value in schema.items() if key != "$defs"}
+    if isinstance(schema, list):
+        return [_inline_refs(item, definitions) for item in schema]
+    return schema
+
+
+def request_body_openapi(body_type: Any) -> Dict:
+    """
+    ``openapi_extra`` documenting a body that the route validates itself with ``validate_body``.
+
+    Args:
+        body_type: The schema type the body follows, e.g. ``List[LogEvent]``
+    """
+    schema = TypeAdapter(body_type).json_schema()
+    schema = _inline_refs(schema, schema.get("$defs", {}))
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": schema},
+                "application/msgpack": {"schema": schema},
+            },
+        }
+    }
+
+
+async def validate_body(request: Request, adapter: TypeAdapter) -> Any:
+    """
+    Validate the request body with a cached TypeAdapter.
+
+    JSON bodies are parsed and validated in one pass by pydantic-core, with
+    no intermediate Python objects; MessagePack bodies are unpacked first.
+
+    Raises:
+        RequestValidationError: With the same 422 shape FastAPI uses for declared bodies
+    """
+    try:
+        if request.scope.get(BODY_FORMAT_SCOPE_KEY) == "msgpack":
+            return adapter.validate_python(await request.json())
+        return adapter.validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors()]
+        )
+    except HTTPException:
+        raise
+    except Exception:
+        # Corrupt compressed data or MessagePack, as FastAPI reports for declared bodies
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="There was an error parsing the body")
+
+
+def _with_json_content_type(scope: dict) -> dict:
+    """Copy of ``scope`` that presents a MessagePack body as JSON to FastAPI's body parser."""
+    headers = [(k, v) for k, v in scope["headers"] if k != b"content-type"]
+    headers.append((b"content-type", b"application/json"))
+    return {**scope, "headers": headers, BODY_FORMAT_SCOPE_KEY: "msgpack"}
+
+
+class WireFormatRoute(APIRoute):
+    """
+    Route class for ingest routers that accept compressed or MessagePack bodies.
+
+    Usage:
+        router = APIRouter(prefix="/api/ingest", route_class=WireFormatRoute)
+    """
+
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+
+        async def wire_format_route_handler(request: Request) -> Response:
+            scope = request.scope
+            content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+
+            if content_type in MSGPACK_CONTENT_TYPES:
+                if not MSGPACK_AVAILABLE:
+                    raise HTTPException(
+                        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                        detail="MessagePack bodies are not supported by this server"
+                    )
+                scope = _with_json_content_type(scope)
+
+            return await original_route_handler(WireFormatRequest(scope, request.receive))
+
+        return wire_format_route_handler
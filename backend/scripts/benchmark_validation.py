@@ -0,0 +1,173 @@
+"""
+Benchmark ingest payload validation: Pydantic models vs the cached TypeAdapter path
+
+Measures events/sec on one core for turning a JSON batch body into MongoDB-ready
+documents, the way the batch routes did before (json.loads, one model per
+event, then model_dump) and the way they do now (one validate_json pass into
+TypedDicts). No database is needed.
+
+Usage:
+    python scripts/benchmark_validation.py [--events 1000] [--rounds 20]
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from pydantic import TypeAdapter
+
+from app.models.documents import log_event_list_adapter, telemetry_payload_list_adapter
+from app.models.schemas import LogEvent, TelemetryPayload
+from app.services.ingestion import IngestionService
+
+ORG_ID = "org_001"
+
+
+def make_log_events(count: int) -> bytes:
+    start = datetime(2025, 11, 19, 8, 0, 0)
+    events = [
+        {
+            "organisation_id": ORG_ID,
+            "host": f"WKS-{random.randint(1, 200):03d}",
+            "user": f"user{random.randint(1, 500)}",
+            "timestamp": (start + timedelta(seconds=i)).isoformat() + "Z",
+            "event_type": random.choice(["login", "process", "network", "file_access"]),
+            "source": random.choice(["ActiveDirectory", "EDR", "Syslog"]),
+            "details": {
+                "success": random.random() > 0.1,
+                "ip_address": f"10.0.{random.randint(0, 255)}.{random.randint(1, 254)}",
+                "process_name": random.choice(["chrome.exe", "outlook.exe", "powershell.exe"]),
+            }
+        }
+        for i in range(count)
+    ]
+    return json.dumps(events).encode()
+
+
+def make_telemetry(count: int) -> bytes:
+    payloads = []
+    for i in range(count):
+        hostname = f"WKS-{i:04d}"
+        payloads.append({
+            "agent_id": f"{hostname}-20251124",
+            "hostname": hostname,
+            "organisation_id": ORG_ID,
+            "collected_at": "2025-11-24 22:00:00",
+            "system_info": {
+                "hostname": hostname,
+                "organisation_id": ORG_ID,
+                "os_name": "Microsoft Windows 10 Pro",
+                "os_version": "10.0.19045",
+                "os_architecture": "64-bit",
+                "manufacturer": "Dell Inc.",
+                "model": "OptiPlex 7090",
+                "bios_version": "1.2.3",
+                "cpu_name": "Intel Core i7-10700",
+                "cpu_cores": 8,
+                "total_memory_gb": 16.0,
+                "domain": "hospital.local",
+                "uptime_hours": 72.5,
+                "last_boot": "2025-11-21 10:00:00",
+                "agent_version": "2.0",
+                "collected_at": "2025-11-24 22:00:00"
+            },
+            "security_events": [
+                {
+                    "event_id": random.choice([4624, 4625, 4688]),
+                    "time_created": "2025-11-24 21:59:00",
+                    "level": "Information",
+                    "message": "An account was successfully logged on.",
+                    "source": "Microsoft-Windows-Security-Auditing",
+                    "user": f"user{random.randint(1, 500)}"
+                }
+                for _ in range(10)
+            ],
+            "process_info": [
+                {
+                    "name": random.choice(["chrome", "outlook", "svchost"]),
+                    "pid": random.randint(100, 30000),
+                    "cpu": round(random.random() * 50, 2),
+                    "memory_mb": round(random.random() * 500, 2),
+                    "threads": random.randint(1, 80),
+                    "start_time": "2025-11-24 08:00:00",
+                    "path": "C:\\Program Files\\App\\app.exe"
+                }
+                for _ in range(20)
+            ],
+            "metrics": {"total_events": 10, "total_processes": 20, "collection_duration_ms": 850}
+        })
+    return json.dumps(payloads).encode()
+
+
+# Model path: what FastAPI did for a List[Model] body, then the service's dumps
+log_model_adapter = TypeAdapter(List[LogEvent])
+telemetry_model_adapter = TypeAdapter(List[TelemetryPayload])
+
+
+def logs_with_models(body: bytes):
+    events = log_model_adapter.validate_python(json.loads(body))
+    return [IngestionService.build_log_document(event) for event in events]
+
+
+def logs_with_adapter(body: bytes):
+    return [IngestionService.complete_log_document(doc) for doc in log_event_list_adapter.validate_json(body)]
+
+
+def telemetry_with_models(body: bytes):
+    return [
+        {
+            "system_info": payload.system_info.model_dump() if payload.system_info else None,
+            "security_events": [event.model_dump() for event in payload.security_events],
+            "process_info": [proc.model_dump() for proc in payload.process_info],
+            "metrics": payload.metrics.model_dump()
+        }
+        for payload in telemetry_model_adapter.validate_python(json.loads(body))
+    ]
+
+
+def telemetry_with_adapter(body: bytes):
+    return telemetry_payload_list_adapter.validate_json(body)
+
+
+def measure(label: str, func, body: bytes, count: int, rounds: int) -> float:
+    func(body)  # warm up
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func(body)
+        best = min(best, time.perf_counter() - started)
+    rate = count / best
+    print(f"   {label:<28} {rate:>12,.0f} events/sec")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=1000, help="events per batch body")
+    parser.add_argument("--rounds", type=int, default=20, help="timed rounds (best is reported)")
+    args = parser.parse_args()
+
+    random.seed(42)
+
+    print(f"📏 Log events ({args.events} per batch, one core)")
+    body = make_log_events(args.events)
+    before = measure("models + model_dump", logs_with_models, body, args.events, args.rounds)
+    after = measure("TypeAdapter validate_json", logs_with_adapter, body, args.events, args.rounds)
+    print(f"   speed-up: {after / before:.2f}x\n")
+
+    print(f"📏 Telemetry payloads ({args.events} per batch, one core)")
+    body = make_telemetry(args.events)
+    before = measure("models + model_dump", telemetry_with_models, body, args.events, args.rounds)
+    after = measure("TypeAdapter validate_json", telemetry_with_adapter, body, args.events, args.rounds)
+    print(f"   speed-up: {after / before:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Migrate the logs and telemetry collections to MongoDB time-series collections
+
+Run with the API stopped, then start it with TIME_SERIES_STORAGE=true.
+
+For each collection the existing data is renamed to ``<name>_legacy``, a
+time-series collection is created under the original name, and documents are
+copied over in ``_id`` order in chunks, with the ``meta`` field added and the
+time field converted to a date. Progress is recorded in ``schema_migrations``
+after every chunk, so an interrupted run resumes where it stopped (a chunk
+interrupted mid-insert may be copied twice).
+
+Usage:
+    python scripts/migrate_time_series.py [--collections logs telemetry] [--chunk-size 5000] [--drop-legacy]
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo.errors import BulkWriteError
+
+from app.config import get_settings
+from app.database import TIME_SERIES_COLLECTIONS, ensure_time_series_collection, time_series_document
+
+settings = get_settings()
+
+
+async def collection_type(db: AsyncIOMotorDatabase, name: str):
+    """'timeseries', 'collection', or None if it does not exist."""
+    cursor = await db.list_collections(filter={"name": name})
+    existing = await cursor.to_list(length=1)
+    return existing[0].get("type", "collection") if existing else None
+
+
+async def migrate_collection(db: AsyncIOMotorDatabase, name: str, chunk_size: int, drop_legacy: bool):
+    legacy_name = f"{name}_legacy"
+    progress_id = f"time_series:{name}"
+
+    current = await collection_type(db, name)
+    if current == "collection":
+        if await collection_type(db, legacy_name):
+            print(f"❌ {name}: both {name} and {legacy_name} are regular collections; resolve manually")
+            return
+        print(f"📦 {name}: renaming to {legacy_name}")
+        await db[name].rename(legacy_name)
+    elif current == "timeseries" and not await collection_type(db, legacy_name):
+        print(f"✅ {name}: already a time-series collection")
+        return
+
+    if not await ensure_time_series_collection(db, name):
+        print(f"❌ {name}: could not create the time-series collection")
+        return
+
+    if not await collection_type(db, legacy_name):
+        print(f"✅ {name}: created empty time-series collection")
+        return
+
+    progress = await db.schema_migrations.find_one({"_id": progress_id}) or {}
+    last_id = progress.get("last_id")
+    copied = progress.get("copied", 0)
+    total = await db[legacy_name].estimated_document_count()
+    if last_id is not None:
+        print(f"↩️  {name}: resuming after {copied} documents")
+
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        chunk = await db[legacy_name].find(query).sort("_id", 1).limit(chunk_size).to_list(length=chunk_size)
+        if not chunk:
+            break
+
+        try:
+            await db[name].insert_many([time_series_document(name, doc) for doc in chunk], ordered=False)
+        except BulkWriteError as e:
+            print(f"⚠️  {name}: {len(e.details.get('writeErrors', []))} documents rejected in this chunk")
+
+        last_id = chunk[-1]["_id"]
+        copied += len(chunk)
+        await db.schema_migrations.update_one(
+            {"_id": progress_id},
+            {"$set": {"last_id": last_id, "copied": copied}},
+            upsert=True
+        )
+        print(f"   {name}: {copied}/{total} documents copied")
+
+    print(f"✅ {name}: copied {copied} documents")
+
+    if drop_legacy:
+        await db[legacy_name].drop()
+        await db.schema_migrations.delete_one({"_id": progress_id})
+        print(f"🗑️  {name}: dropped {legacy_name}")
+    else:
+        print(f"   Verify the data, then drop {legacy_name} (or re-run with --drop-legacy)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--collections", nargs="+", choices=sorted(TIME_SERIES_COLLECTIONS), default=sorted(TIME_SERIES_COLLECTIONS))
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--drop-legacy", action="store_true", help="drop <name>_legacy once copied")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(settings.mongo_url)
+    db = client[settings.mongodb_db_name]
+    print(f"✅ Connected to MongoDB: {settings.mongodb_db_name}")
+
+    for name in args.collections:
+        await migrate_collection(db, name, args.chunk_size, args.drop_legacy)
+
+    print("\n✅ Migration finished. Start the API with TIME_SERIES_STORAGE=true to create the indexes.")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+"""
+Backtest detection rule changes by replaying an organisation's historical logs
+
+Streams the organisation's ``logs`` in timestamp order through the rule
+engine with the given parameters, split over a pool of worker processes,
+and reports how many alerts each rule would have raised (and how many alert
+documents would be left after suppression). With ``--compare`` the live
+settings are replayed in the same pass, so the two configurations can be
+compared side by side. Nothing is written to the database.
+
+Usage:
+    python scripts/replay_rules.py --org org_001 [--start 2025-11-01] [--end 2025-12-01]
+        [--failed-login-threshold 8] [--multiple-host-threshold 5] [--window-minutes 60]
+        [--suspicious-process rclone --suspicious-process "vssadmin delete"]
+        [--rules-file rules.yaml | --no-detection-rules] [--only failed_login_threshold]
+        [--compare] [--workers 8] [--json report.json]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.config import get_settings
+from app.services.detection_rules import read_rule_file
+from app.services.rule_replay import ReplayConfig, replay_organisation
+
+settings = get_settings()
+
+
+def parse_time(value: str) -> datetime:
+    """ISO 8601 date or datetime, as naive UTC like the stored timestamps."""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def print_reports(reports):
+    names = sorted({name for report in reports for name in report.rules})
+    columns = [report.config for report in reports]
+    print(f"\n{'rule':<32}" + "".join(f"{column + ' alerts':>22}{'stored':>10}" for column in columns))
+    for name in names:
+        row = f"{name:<32}"
+        for report in reports:
+            stats = report.rules.get(name)
+            row += f"{stats.alerts if stats else 0:>22}{stats.stored_alerts if stats else 0:>10}"
+        print(row)
+    row = f"{'total':<32}"
+    for report in reports:
+        row += f"{sum(s.alerts for s in report.rules.values()):>22}{sum(s.stored_alerts for s in report.rules.values()):>10}"
+    print(row)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--org", required=True, help="organisation_id to replay")
+    parser.add_argument("--start", type=parse_time, help="first timestamp (default: oldest log)")
+    parser.add_argument("--end", type=parse_time, help="end timestamp, exclusive (default: newest log)")
+    parser.add_argument("--failed-login-threshold", type=int, default=settings.failed_login_threshold)
+    parser.add_argument("--multiple-host-threshold", type=int, default=settings.multiple_host_threshold)
+    parser.add_argument("--window-minutes", type=int, default=settings.rule_window_minutes)
+    parser.add_argument("--suspicious-process", action="append", default=[], help="extra suspicious pattern (repeatable)")
+    parser.add_argument("--rules-file", default=settings.detection_rules_file, help="declarative rules (JSON/YAML)")
+    parser.add_argument("--no-detection-rules", action="store_true", help="replay the built-in rules only")
+    parser.add_argument("--only", nargs="+", help="rule names to report (default: all)")
+    parser.add_argument("--suppression-window-minutes", type=int, default=settings.alert_suppression_window_minutes)
+    parser.add_argument("--compare", action="store_true", help="also replay the live settings in the same pass")
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    parser.add_argument("--slices", type=int, help="time slices (default: 4 per worker)")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--json", help="write the full report to this file")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(settings.mongo_url)
+    db = client[settings.mongodb_db_name]
+    print(f"✅ Connected to MongoDB: {settings.mongodb_db_name}")
+
+    live_rules = []
+    if settings.detection_rules_file:
+        live_rules += read_rule_file(settings.detection_rules_file)
+    live_rules += await db.detection_rules.find({}, {"_id": 0}).to_list(length=None)
+
+    candidate_rules = []
+    if not args.no_detection_rules:
+        if args.rules_file:
+            candidate_rules += read_rule_file(args.rules_file)
+        candidate_rules += await db.detection_rules.find({}, {"_id": 0}).to_list(length=None)
+
+    configs = [ReplayConfig(
+        name="candidate" if args.compare else "replay",
+        failed_login_threshold=args.failed_login_threshold,
+        multiple_host_threshold=args.multiple_host_threshold,
+        window_minutes=args.window_minutes,
+        suspicious_processes=list(settings.suspicious_processes) + args.suspicious_process,
+        detection_rules=candidate_rules,
+        rules=args.only,
+        suppression_window_minutes=args.suppression_window_minutes
+    )]
+    if args.compare:
+        configs.insert(0, ReplayConfig(name="current", detection_rules=live_rules, rules=args.only))
+
+    def progress(done: int, total: int):
+        print(f"   {done}/{total} slices replayed", end="\r", flush=True)
+
+    began = time.monotonic()
+    try:
+        reports = await replay_organisation(
+            db, args.org, configs,
+            start=args.start, end=args.end,
+            workers=args.workers, slices=args.slices, batch_size=args.batch_size,
+            progress=progress
+        )
+    except ValueError as e:
+        print(f"❌ {e}")
+        client.close()
+        sys.exit(1)
+    elapsed = time.monotonic() - began
+
+    events = reports[0].events
+    print(f"\n✅ Replayed {events} events for {args.org} "
+          f"({reports[0].start.isoformat()} to {reports[0].end.isoformat()}) "
+          f"in {elapsed:.1f}s ({events / max(elapsed, 1e-9):,.0f} events/s)")
+    print_reports(reports)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps([report.to_dict() for report in reports], indent=2, default=str))
+        print(f"\n📄 Report written to {args.json}")
+
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
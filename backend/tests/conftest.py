@@ -0,0 +1,16 @@
+"""Shared fixtures: an in-memory MongoDB stand-in bound to the app's database handle"""
+import pytest
+
+from app import database
+
+
+@pytest.fixture
+def db():
+    """A fresh mongomock database installed as the app's database."""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    client = mongomock_motor.AsyncMongoMockClient()
+    database.db.client = client
+    database.db.db = client["healthguard_test"]
+    yield database.db.db
+    database.db.client = None
+    database.db.db = None
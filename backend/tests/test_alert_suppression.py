@@ -0,0 +1,113 @@
+"""Alert writes: folding repeats into open alerts and spooling during outages"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.config import get_settings
+from app.services import alert_suppression
+from app.services.alert_suppression import AlertWriter
+from app.spool import IngestSpool
+
+NOW = datetime.utcnow().replace(microsecond=0)  # MongoDB keeps milliseconds
+
+
+def alert(alert_id: str, created_at: datetime = NOW, host: str = "WS-01", rule_name: str = "failed_login_threshold"):
+    return {
+        "alert_id": alert_id,
+        "organisation_id": "org_1",
+        "rule_name": rule_name,
+        "host": host,
+        "user": "alice",
+        "title": f"{rule_name} on {host}",
+        "description": f"seen by {alert_id}",
+        "status": "open",
+        "created_at": created_at,
+        "updated_at": created_at,
+        "related_log_ids": [f"log_{alert_id}"],
+    }
+
+
+@pytest.fixture
+def suppression_window(monkeypatch):
+    monkeypatch.setattr(get_settings(), "alert_suppression_window_minutes", 30)
+
+
+def test_alert_stored_before_a_timeout_is_not_duplicated_by_the_replay(db, tmp_path, monkeypatch, suppression_window):
+    write = AlertWriter.write
+
+    async def reached_server_then_timed_out(self, alert_docs):
+        await write(self, alert_docs)
+        raise asyncio.TimeoutError
+
+    async def main():
+        spool = IngestSpool()
+        await spool.start(db, str(tmp_path))
+        monkeypatch.setattr(alert_suppression, "spool", spool)
+        monkeypatch.setattr(AlertWriter, "write", reached_server_then_timed_out)
+        try:
+            stored_as = await AlertWriter(db).write_or_spool([alert("a1")])
+            await spool.replay()
+        finally:
+            await spool.stop()
+        return stored_as, await db.alerts.count_documents({})
+
+    stored_as, count = asyncio.run(main())
+    assert stored_as == {"a1": "a1"}
+    assert count == 1
+
+
+def write(db, *batches):
+    async def main():
+        writer = AlertWriter(db)
+        stored_as = [await writer.write(batch) for batch in batches]
+        return stored_as, await db.alerts.find({}, {"_id": 0}).sort("created_at", 1).to_list(None)
+    return asyncio.run(main())
+
+
+def test_repeat_within_the_window_is_folded_into_the_open_alert(db, suppression_window):
+    stored_as, alerts = write(db, [alert("a1")], [alert("a2", NOW + timedelta(minutes=5))])
+
+    assert stored_as == [{"a1": "a1"}, {"a2": "a1"}]
+    assert len(alerts) == 1
+    folded = alerts[0]
+    assert folded["alert_id"] == "a1"
+    assert folded["occurrence_count"] == 2
+    assert folded["last_seen"] == NOW + timedelta(minutes=5)
+    assert folded["description"] == "seen by a2"
+    assert folded["related_log_ids"] == ["log_a1", "log_a2"]
+
+
+def test_repeats_within_one_call_are_merged_into_one_update(db, suppression_window):
+    stored_as, alerts = write(db, [alert("a1"), alert("a2"), alert("a3", host="WS-02")])
+
+    assert stored_as == [{"a1": "a1", "a2": "a1", "a3": "a3"}]
+    assert [(a["alert_id"], a["occurrence_count"]) for a in alerts] == [("a1", 2), ("a3", 1)]
+
+
+def test_repeat_after_the_window_raises_a_new_alert(db, suppression_window):
+    stale = NOW - timedelta(minutes=45)
+    stored_as, alerts = write(db, [alert("a1", stale)], [alert("a2")])
+
+    assert stored_as[1] == {"a2": "a2"}
+    assert [(a["alert_id"], a["occurrence_count"]) for a in alerts] == [("a1", 1), ("a2", 1)]
+
+
+def test_repeat_of_a_closed_alert_raises_a_new_alert(db, suppression_window):
+    async def close():
+        await db.alerts.update_many({}, {"$set": {"status": "resolved"}})
+
+    write(db, [alert("a1")])
+    asyncio.run(close())
+    stored_as, alerts = write(db, [alert("a2")])
+
+    assert stored_as == [{"a2": "a2"}]
+    assert len(alerts) == 2
+
+
+def test_window_of_zero_inserts_every_alert(db, monkeypatch):
+    monkeypatch.setattr(get_settings(), "alert_suppression_window_minutes", 0)
+    stored_as, alerts = write(db, [alert("a1"), alert("a2")])
+
+    assert stored_as == [{"a1": "a1", "a2": "a2"}]
+    assert len(alerts) == 2
@@ -0,0 +1,95 @@
+"""Multi-event sequence correlation and the expiry of partial matches"""
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.config import get_settings
+from app.models.schemas import LogEvent
+from app.services.correlation import CorrelationEngine
+
+START = datetime.utcnow().replace(microsecond=0) - timedelta(hours=2)
+
+
+def login(seconds: float, success: bool, user: str = "alice", **details) -> LogEvent:
+    return LogEvent(
+        organisation_id="org_1", host="WS-01", user=user, event_type="login", source="AD",
+        timestamp=START + timedelta(seconds=seconds), details={"success": success, **details},
+    )
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(get_settings(), "correlation_enabled", True)
+    monkeypatch.setattr(get_settings(), "correlation_rules_file", "")
+    engine = CorrelationEngine()
+    engine.reload(force=True)
+    return engine
+
+
+def fired(engine: CorrelationEngine, events) -> list:
+    return [[alert.rule_name for alert in alerts] for alerts in engine.evaluate_batch(events)]
+
+
+def test_failures_then_success_completes_the_built_in_sequence(engine):
+    events = [login(i * 30, False) for i in range(5)] + [login(200, True)]
+    assert fired(engine, events) == [[]] * 5 + [["failed_logins_then_success"]]
+    assert engine.completed == 1
+    assert not engine.rule_set.rules[0].partials
+
+
+def test_too_few_failures_do_not_complete_the_sequence(engine):
+    events = [login(i * 30, False) for i in range(4)] + [login(200, True)]
+    assert fired(engine, events) == [[]] * 5
+
+
+def test_failures_older_than_the_window_slide_out(engine):
+    # Two failures, a long pause, then four more: only the last four are within 10 minutes
+    events = [login(0, False), login(10, False)] + [login(900 + i, False) for i in range(4)] + [login(960, True)]
+    assert fired(engine, events) == [[]] * 7
+
+
+def test_success_after_the_deadline_does_not_complete_and_expired_state_is_reclaimed(engine):
+    fired(engine, [login(i, False) for i in range(5)])
+    rule = engine.rule_set.rules[0]
+    assert len(rule.partials) == 1 and len(engine.wheel) >= 1
+
+    # Another user's event moves event time past alice's deadline
+    assert fired(engine, [login(700, False, user="bob")]) == [[]]
+    assert ("org_1", "alice") not in rule.partials
+    assert engine.expired == 1
+
+    assert fired(engine, [login(710, True)]) == [[]]
+
+
+def test_partial_matches_scheduled_before_the_wheel_moved_expire_on_time(engine):
+    # The whole first batch is evaluated before the wheel's first advance
+    fired(engine, [login(i, False) for i in range(3)] + [login(2000, False, user="bob")])
+    assert ("org_1", "alice") not in engine.rule_set.rules[0].partials
+    assert engine.expired == 1
+
+
+def test_sequences_from_the_rules_file_are_dispatched_by_literal(engine, tmp_path, monkeypatch):
+    rules_file = tmp_path / "correlation.json"
+    rules_file.write_text(json.dumps([{
+        "name": "beacon_after_login",
+        "title": "Beacon after login - {host}",
+        "key": ["host"],
+        "steps": [
+            {"event_types": ["login"], "match": {"details.success": True}},
+            {"event_types": ["network"], "match": {"details.port": 4444}},
+        ],
+        "within_minutes": 5,
+    }]))
+    monkeypatch.setattr(get_settings(), "correlation_rules_file", str(rules_file))
+    assert engine.reload(force=True)
+    assert not engine.errors
+
+    def network(seconds: float, port: int) -> LogEvent:
+        return LogEvent(
+            organisation_id="org_1", host="WS-01", user="alice", event_type="network", source="EDR",
+            timestamp=START + timedelta(seconds=seconds), details={"port": port},
+        )
+
+    events = [login(0, True), network(10, 443), network(20, 4444)]
+    assert fired(engine, events) == [[], [], ["beacon_after_login"]]
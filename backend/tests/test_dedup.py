@@ -0,0 +1,73 @@
+"""Fingerprint deduplication: Bloom filters and the exact confirmation"""
+import asyncio
+
+from app.services import dedup
+from app.services.dedup import BloomFilter, DuplicateFilter, TimeWindowedBloomFilter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_bloom_filter_has_no_false_negatives_and_bounded_false_positives():
+    bloom = BloomFilter(capacity=10000, error_rate=0.01)
+    for i in range(10000):
+        bloom.add(f"seen-{i}")
+
+    assert all(f"seen-{i}" in bloom for i in range(10000))
+    false_positives = sum(f"new-{i}" in bloom for i in range(10000))
+    assert false_positives < 300  # 1% target, with room for variance
+
+
+def test_windowed_filter_forgets_items_after_all_generations_rotate(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(dedup.time, "monotonic", clock)
+    bloom = TimeWindowedBloomFilter(capacity=1000, error_rate=0.01, window_seconds=400, generations=4)
+
+    bloom.add("retry")
+    for _ in range(3):
+        clock.now += 100
+        assert "retry" in bloom  # still in an older generation
+    assert len(bloom._filters) == 4
+
+    clock.now += 100
+    assert "retry" not in bloom
+    assert len(bloom._filters) == 4
+
+
+def test_windowed_filter_does_not_rotate_within_a_generation(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(dedup.time, "monotonic", clock)
+    bloom = TimeWindowedBloomFilter(capacity=1000, error_rate=0.01, window_seconds=400, generations=4)
+
+    bloom.add("a")
+    clock.now += 99
+    bloom.add("b")
+    assert len(bloom._filters) == 1
+
+
+def test_duplicates_are_confirmed_against_stored_fingerprints(db):
+    async def main():
+        duplicates = DuplicateFilter("logs")
+        await db.logs.insert_one({"organisation_id": "org_1", "fingerprint": "fp-stored"})
+        duplicates.bloom.add("org_1:fp-stored")
+        # Seen by the filter but never stored (its write failed): not a duplicate
+        duplicates.bloom.add("org_1:fp-unwritten")
+
+        found = await duplicates.find_duplicates(db, [
+            ("org_1", "fp-new"),
+            ("org_1", "fp-stored"),
+            ("org_1", "fp-unwritten"),
+            ("org_1", "fp-new"),        # repeated within the call
+            ("org_2", "fp-stored"),     # same fingerprint, other organisation
+        ])
+        return duplicates, found
+
+    duplicates, found = asyncio.run(main())
+    assert found == {1, 3}
+    assert duplicates.confirmations == 1
+    assert duplicates.duplicates == 2
@@ -0,0 +1,59 @@
+"""Merging of debounced endpoint upserts"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.services.endpoint_tracker import EndpointTracker
+
+FILTER = {"organisation_id": "org_1", "host": "WS-01"}
+SEEN = datetime(2025, 11, 19, 10, 30)
+
+
+def test_newest_last_seen_wins_regardless_of_arrival_order():
+    tracker = EndpointTracker()
+    tracker.track(FILTER, {"last_seen": SEEN + timedelta(minutes=5), "ip_address": "10.0.0.2"})
+    tracker.track(FILTER, {"last_seen": SEEN, "ip_address": "10.0.0.1", "os": "Windows"})
+
+    update = tracker._pending[tuple(sorted(FILTER.items()))]
+    assert tracker.pending == 1
+    assert update.set_fields["last_seen"] == SEEN + timedelta(minutes=5)
+    assert update.set_fields["ip_address"] == "10.0.0.2"
+    # Fields only the older update carried are still filled in
+    assert update.set_fields["os"] == "Windows"
+
+
+def test_aware_and_naive_timestamps_merge_as_utc():
+    tracker = EndpointTracker()
+    tracker.track(FILTER, {"last_seen": SEEN, "ip_address": "10.0.0.1"})
+    # 11:45+01:00 is 10:45 UTC, newer than the naive 10:30
+    later = datetime(2025, 11, 19, 11, 45, tzinfo=timezone(timedelta(hours=1)))
+    tracker.track(FILTER, {"last_seen": later, "ip_address": "10.0.0.2"})
+
+    fields = tracker._pending[tuple(sorted(FILTER.items()))].set_fields
+    assert fields["last_seen"] == datetime(2025, 11, 19, 10, 45)
+    assert fields["last_seen"].tzinfo is None
+    assert fields["ip_address"] == "10.0.0.2"
+
+
+def test_first_set_on_insert_value_is_kept():
+    tracker = EndpointTracker()
+    tracker.track(FILTER, {"last_seen": SEEN}, {"first_seen": SEEN})
+    tracker.track(FILTER, {"last_seen": SEEN + timedelta(minutes=1)}, {"first_seen": SEEN + timedelta(minutes=1)})
+
+    assert tracker._pending[tuple(sorted(FILTER.items()))].set_on_insert == {"first_seen": SEEN}
+
+
+def test_flush_writes_one_upsert_per_endpoint(db):
+    async def run():
+        tracker = EndpointTracker()
+        tracker._db = db
+        for minute in range(10):
+            tracker.track(FILTER, {"last_seen": SEEN + timedelta(minutes=minute)}, {"first_seen": SEEN})
+        tracker.track({"organisation_id": "org_1", "host": "WS-02"}, {"last_seen": SEEN})
+        await tracker.flush()
+        return tracker, await db.endpoints.find_one(FILTER), await db.endpoints.count_documents({})
+
+    tracker, endpoint, count = asyncio.run(run())
+    assert count == 2
+    assert tracker.flushed == 2 and tracker.pending == 0
+    assert endpoint["last_seen"] == SEEN + timedelta(minutes=9)
+    assert endpoint["first_seen"] == SEEN
@@ -0,0 +1,63 @@
+"""HyperLogLog sketches and the sliding distinct-count windows built on them"""
+import pytest
+
+from app.services.distinct_counts import HOUR, DistinctCounts
+from app.utils.hyperloglog import HyperLogLog
+
+
+def sketch_of(values, precision: int = 12) -> HyperLogLog:
+    sketch = HyperLogLog(precision)
+    sketch.update(values)
+    return sketch
+
+
+@pytest.mark.parametrize("cardinality", [10, 1000, 50000])
+def test_estimate_is_within_the_error_bound(cardinality):
+    sketch = sketch_of(f"host-{i}" for i in range(cardinality))
+    # 1.04 / sqrt(4096) = 1.6% standard error; allow three of them
+    assert abs(sketch.count() - cardinality) <= max(1, 0.05 * cardinality)
+
+
+def test_repeated_values_are_counted_once():
+    sketch = sketch_of(f"host-{i % 100}" for i in range(10000))
+    assert abs(sketch.count() - 100) <= 2
+
+
+def test_sparse_and_dense_sketches_agree():
+    values = [f"user-{i}" for i in range(3000)]
+    sketch = HyperLogLog(12)
+    for value in values[:200]:
+        sketch.add(value)
+    assert sketch._dense is None
+    sparse_count = sketch.count()
+    sketch.update(values[200:])
+    assert sketch._dense is not None
+
+    assert sparse_count == sketch_of(values[:200]).count()
+    assert sketch.count() == sketch_of(values).count()
+
+
+def test_merge_is_the_union_of_the_sketches():
+    left = sketch_of(f"host-{i}" for i in range(0, 6000))
+    right = sketch_of(f"host-{i}" for i in range(4000, 10000))
+    left.merge(right)
+
+    union = sketch_of(f"host-{i}" for i in range(10000))
+    assert left.count() == union.count()
+    assert dict(left.registers()) == dict(union.registers())
+
+
+def test_merge_rejects_a_different_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(12).merge(HyperLogLog(10))
+
+
+def test_windows_forget_hosts_older_than_24_hours():
+    counts = DistinctCounts(precision=12, max_keys=100)
+    start = 450_000 * HOUR  # mid-2021
+    for hour in range(30):
+        counts._add("org_1", "alice", f"WS-{hour:02d}", start + hour * HOUR, start + hour * HOUR)
+
+    window = counts._user_hosts[("org_1", "alice")]
+    assert counts._count(window, int((start + 29 * HOUR) // HOUR)) == 24
+    assert counts.hosts_for_organisation("org_1") == 0  # every day is far in the past
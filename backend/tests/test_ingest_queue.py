@@ -0,0 +1,48 @@
+"""Detection hand-off for log documents replayed from the ingest spool"""
+import asyncio
+from datetime import datetime
+
+from app.config import get_settings
+from app.services.ingest_queue import IngestQueue
+from app.services.ingestion import IngestionService
+
+
+def replayed_log(i: int):
+    return {
+        "log_id": f"log_{i:04d}",
+        "organisation_id": "org_1",
+        "host": "WS-01",
+        "user": "alice",
+        "event_type": "login",
+        "source": "AD",
+        "timestamp": datetime(2025, 11, 19, 10, 30),
+        "details": {"success": True},
+    }
+
+
+def test_replayed_documents_wait_for_free_slots_and_skip_invalid_ones(db, monkeypatch):
+    monkeypatch.setattr(get_settings(), "ingest_queue_maxsize", 2)
+    monkeypatch.setattr(get_settings(), "ingest_queue_workers", 1)
+    detected = []
+
+    async def detect_event(self, log_event, log_id):
+        await asyncio.sleep(0)
+        detected.append(log_id)
+
+    monkeypatch.setattr(IngestionService, "detect_event", detect_event)
+    documents = [replayed_log(i) for i in range(20)]
+    documents.insert(5, {"log_id": "log_invalid", "organisation_id": "org_1"})
+
+    async def main():
+        queue = IngestQueue()
+        await queue.start(db)
+        try:
+            await queue.submit_replayed(documents)
+        finally:
+            await queue.stop()
+        return queue
+
+    queue = asyncio.run(main())
+    assert detected == [f"log_{i:04d}" for i in range(20)]
+    assert queue.rejected == 0
+    assert queue.failed == 1
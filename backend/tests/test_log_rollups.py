@@ -0,0 +1,41 @@
+"""Hourly log rollups for events stored after their hour left the lookback"""
+import asyncio
+from datetime import datetime, timedelta
+
+from app.models.schemas import LogEvent
+from app.services.log_rollups import LogRollupJob, LogRollupService, floor_hour
+
+
+def event(timestamp: datetime, success: bool = False) -> LogEvent:
+    return LogEvent(
+        organisation_id="org_1", host="WS-01", user="alice", event_type="login",
+        source="AD", timestamp=timestamp, details={"success": success},
+    )
+
+
+def test_backfilled_events_are_added_to_their_hours_rollup(db):
+    hour = floor_hour(datetime.utcnow() - timedelta(days=3))
+    stored = event(hour + timedelta(minutes=20))
+    backfill = [event(hour + timedelta(minutes=5)), event(hour + timedelta(minutes=50))]
+
+    async def main():
+        await db.logs.insert_one(stored.model_dump())
+        await LogRollupService(db).rollup_hour(hour)
+        # The raw log expires; later backfills of the same hour must not reset the rollup
+        await db.logs.delete_many({})
+
+        job = LogRollupJob()
+        job._db = db
+        for late in backfill:
+            job.track_late(late)
+        job.track_late(event(datetime.utcnow()))  # recomputed by the next run instead
+        written = await job.flush_late()
+        return job, written, await db.log_rollups.find({}).to_list(None)
+
+    job, written, rollups = asyncio.run(main())
+    assert job.late_events == 2
+    assert written == 1
+    assert len(rollups) == 1
+    assert rollups[0]["count"] == 3
+    assert rollups[0]["first_seen"] == hour + timedelta(minutes=5)
+    assert rollups[0]["last_seen"] == hour + timedelta(minutes=50)
@@ -0,0 +1,56 @@
+"""Single-pass matching of suspicious process patterns"""
+import os
+
+from app.utils.pattern_matcher import AhoCorasick, PatternSetMatcher, normalised_values
+
+
+def test_overlapping_and_nested_patterns_are_all_reported():
+    automaton = AhoCorasick(["he", "she", "his", "hers"])
+    assert automaton.find_all("ushers") == ["he", "she", "hers"]
+
+
+def test_matches_are_reported_once_in_configured_order():
+    automaton = AhoCorasick(["mimikatz", "psexec", "mimi"])
+    assert automaton.find_all("psexec mimikatz; mimikatz") == ["mimikatz", "psexec", "mimi"]
+    assert automaton.find_all("notepad.exe") == []
+
+
+def test_patterns_are_normalised_and_deduplicated():
+    automaton = AhoCorasick(["PowerShell  -Enc", "powershell -enc", ""])
+    assert len(automaton) == 1
+    details = {"command": "POWERSHELL   -ENC SQBFAFgA", "parent": {"name": "cmd.exe"}}
+    assert automaton.find_all(normalised_values(details)) == ["powershell -enc"]
+
+
+def test_patterns_do_not_match_across_fields():
+    automaton = AhoCorasick(["cmd.exe /c"])
+    assert automaton.find_all(normalised_values({"a": "cmd.exe", "b": "/c whoami"})) == []
+
+
+def test_matcher_reloads_when_the_list_or_the_file_changes(tmp_path):
+    patterns_file = tmp_path / "patterns.txt"
+    patterns_file.write_text("# extra patterns\nrubeus\n\n")
+    matcher = PatternSetMatcher(reload_interval=0)
+
+    automaton = matcher.get(["mimikatz"], str(patterns_file))
+    assert automaton.patterns == ["mimikatz", "rubeus"]
+    assert matcher.get(["mimikatz"], str(patterns_file)) is automaton
+
+    patterns_file.write_text("rubeus\nsharphound\n")
+    stat = patterns_file.stat()
+    os.utime(patterns_file, (stat.st_atime, stat.st_mtime + 10))
+    assert matcher.get(["mimikatz"], str(patterns_file)).patterns == ["mimikatz", "rubeus", "sharphound"]
+
+    assert matcher.get(["psexec"], str(patterns_file)).patterns == ["psexec", "rubeus", "sharphound"]
+
+
+def test_file_changes_are_only_checked_every_reload_interval(tmp_path):
+    patterns_file = tmp_path / "patterns.txt"
+    patterns_file.write_text("rubeus\n")
+    matcher = PatternSetMatcher(reload_interval=3600)
+    automaton = matcher.get([], str(patterns_file))
+
+    patterns_file.write_text("sharphound\n")
+    stat = patterns_file.stat()
+    os.utime(patterns_file, (stat.st_atime, stat.st_mtime + 10))
+    assert matcher.get([], str(patterns_file)) is automaton
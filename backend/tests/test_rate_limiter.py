@@ -0,0 +1,96 @@
+"""Token-bucket ingest rate limiting"""
+import asyncio
+
+import pytest
+
+from app.config import get_settings
+from app.services import rate_limiter
+from app.services.rate_limiter import RateLimiter, RateLimitExceeded, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    monkeypatch.setattr(get_settings(), "rate_limit_enabled", True)
+    return clock
+
+
+def limiter(org_burst: float = 100, host_burst: float = 10) -> RateLimiter:
+    return RateLimiter("test", org_rate=10, org_burst=org_burst, host_rate=1, host_burst=host_burst)
+
+
+def test_bucket_refills_at_its_rate_up_to_the_burst():
+    bucket = TokenBucket(rate=2, burst=10, now=0)
+    bucket.take(10)
+    assert bucket.wait_time(4, now=1) == pytest.approx(1.0)
+    assert bucket.wait_time(4, now=2) == 0
+    assert bucket.wait_time(1, now=1000) == 0
+    assert bucket.tokens == 10
+
+
+def test_request_larger_than_the_burst_is_admitted_into_debt():
+    bucket = TokenBucket(rate=2, burst=10, now=0)
+    assert bucket.wait_time(30, now=0) == 0  # only a full bucket is needed
+    bucket.take(30)
+    assert bucket.tokens == -20
+    # The debt is paid off before the next request: 20 tokens, then 1 more
+    assert bucket.wait_time(1, now=0) == pytest.approx(10.5)
+
+
+def test_a_short_host_bucket_rejects_without_charging_the_organisation(clock):
+    limits = limiter(host_burst=3)
+    limits.acquire([("org_1", "WS-01")] * 3)
+
+    with pytest.raises(RateLimitExceeded) as raised:
+        limits.acquire([("org_1", "WS-01"), ("org_1", "WS-02")])
+    assert raised.value.host == "WS-01"
+    assert raised.value.retry_after == 1
+    assert limits._buckets[("org_1",)].tokens == 97
+
+    stats = limits.stats()
+    assert stats["allowed"] == 3
+    assert stats["throttled"] == 2
+    assert stats["throttled_by_org"] == {"org_1": 2}
+
+
+def test_an_exhausted_organisation_is_rejected_for_every_host(clock):
+    limits = limiter(org_burst=5, host_burst=5)
+    limits.acquire([("org_1", f"WS-{i}") for i in range(5)])
+
+    with pytest.raises(RateLimitExceeded) as raised:
+        limits.acquire([("org_1", "WS-9")])
+    assert raised.value.host is None
+
+    clock.now += 0.1  # one token at 10/s
+    limits.acquire([("org_1", "WS-9")])
+
+
+def test_waiting_requests_are_counted_as_delayed_not_throttled(clock, monkeypatch):
+    async def sleep(seconds):
+        clock.now += seconds
+
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", sleep)
+    limits = limiter(org_burst=100, host_burst=2)
+    events = [("org_1", "WS-01")] * 2
+
+    async def main():
+        await limits.wait(events)
+        started = clock.now
+        await limits.wait(events)
+        return clock.now - started
+
+    waited = asyncio.run(main())
+    assert waited >= 2
+    stats = limits.stats()
+    assert stats["allowed"] == 4
+    assert stats["delayed"] == 2
+    assert stats["throttled"] == 0
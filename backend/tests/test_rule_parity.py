@@ -0,0 +1,96 @@
+"""Batch and single-event ingestion must raise the same rule alerts"""
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.config import get_settings
+from app.database import log_buffer
+from app.models.documents import log_event_list_adapter
+from app.models.schemas import LogEvent
+from app.services.detection_rules import RuleSet, compile_rules, detection_rules
+from app.services.ingestion import IngestionService
+from app.services.window_state import window_state
+
+
+@pytest.fixture(autouse=True)
+def no_alert_suppression(monkeypatch):
+    monkeypatch.setattr(get_settings(), "alert_suppression_window_minutes", 0)
+
+
+def failed_logins(count: int):
+    """Failed logins by one user, one second apart, spread over several hosts."""
+    now = datetime.utcnow()
+    return [
+        {
+            "organisation_id": "org_1",
+            "host": f"WS-{i % 7:02d}",
+            "user": "alice",
+            "event_type": "login",
+            "source": "AD",
+            "timestamp": (now - timedelta(seconds=count - i)).isoformat() + "Z",
+            "details": {"success": False, "ip_address": "10.0.0.5"},
+        }
+        for i in range(count)
+    ]
+
+
+DECLARATIVE_RULES = [
+    {
+        "name": "burst_of_failed_logins",
+        "title": "Failed logins - {user}",
+        "event_types": ["login"],
+        "match": {"details.success": False},
+        "window": {"minutes": 10, "group_by": ["user"], "threshold": 5},
+    },
+    {
+        "name": "failed_logins_across_hosts",
+        "title": "Failed logins on many hosts - {user}",
+        "event_types": ["login"],
+        "match": {"details.success": False},
+        "window": {"minutes": 10, "group_by": ["user"], "distinct": "host", "threshold": 5},
+    },
+]
+
+
+def fresh_declarative_rules() -> RuleSet:
+    compiled, errors = compile_rules(DECLARATIVE_RULES)
+    assert not errors
+    return RuleSet(list(compiled.values()))
+
+
+async def ingest(db, events, batch: bool):
+    log_buffer.bind(db.logs)
+    service = IngestionService(db)
+    if batch:
+        result = await service.ingest_batch(log_event_list_adapter.validate_python(events))
+        created = [bool(item.alert_created) for item in result.results]
+    else:
+        created = [bool((await service.ingest_event(LogEvent(**event))).alert_created) for event in events]
+    alerts = await db.alerts.find({}, {"rule_name": 1}).to_list(None)
+    return created, Counter(alert["rule_name"] for alert in alerts)
+
+
+@pytest.mark.parametrize("window_state_ready", [True, False], ids=["window-state", "database-counts"])
+def test_batch_and_single_ingest_raise_the_same_alerts(db, monkeypatch, window_state_ready):
+    events = failed_logins(10)
+
+    def run(batch: bool):
+        window_state._windows.clear()
+        monkeypatch.setattr(window_state, "ready", window_state_ready)
+        monkeypatch.setattr(detection_rules, "rule_set", fresh_declarative_rules())
+        for collection in ("logs", "alerts"):
+            asyncio.run(db[collection].delete_many({}))
+        return asyncio.run(ingest(db, events, batch))
+
+    single_created, single_alerts = run(batch=False)
+    batch_created, batch_alerts = run(batch=True)
+
+    assert single_alerts, "the scenario should trip the failed-login rules"
+    assert batch_alerts == single_alerts
+    assert batch_created == single_created
+    # The count rules fire from the event that crosses the threshold, not for every event of the batch
+    rules = ("failed_login_threshold", "multiple_host_access") + tuple(rule["name"] for rule in DECLARATIVE_RULES)
+    for rule in rules:
+        assert 0 < batch_alerts[rule] < len(events)
@@ -0,0 +1,146 @@
+"""Spooling ingest writes to disk and replaying them into MongoDB"""
+import asyncio
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import ConnectionFailure
+
+from app import database
+from app.spool import IngestSpool
+
+
+def log(i: int):
+    return {"organisation_id": "org_1", "host": f"WS-{i:02d}", "timestamp": datetime(2025, 11, 19, 10, i)}
+
+
+def run_with_spool(db, tmp_path, scenario):
+    """Run ``scenario(spool)`` with a started spool; the replayer is driven by the test."""
+    async def main():
+        spool = IngestSpool()
+        await spool.start(db, str(tmp_path))
+        try:
+            return await scenario(spool)
+        finally:
+            await spool.stop()
+    return asyncio.run(main())
+
+
+def test_replay_round_trips_documents_and_removes_segments(db, tmp_path):
+    documents = [dict(log(i), _id=ObjectId()) for i in range(5)]
+    replayed = []
+
+    async def on_replayed(batch):
+        replayed.extend(batch)
+
+    async def scenario(spool):
+        spool.on_replayed("logs", on_replayed)
+        await spool.append("logs", documents)
+        assert spool.spooled == 5 and spool.pending_segments == 1
+        await spool.replay()
+        return spool, await db.logs.find({}).sort("host", 1).to_list(None)
+
+    spool, stored = run_with_spool(db, tmp_path, scenario)
+    assert stored == documents  # _id and datetimes survive the extended-JSON round trip
+    assert [document["_id"] for document in replayed] == [document["_id"] for document in documents]
+    assert spool.replayed == 5
+    assert spool.pending_segments == 0
+    assert not list(tmp_path.iterdir())
+
+
+def test_replay_skips_documents_already_written(db, tmp_path):
+    documents = [dict(log(i), _id=ObjectId()) for i in range(4)]
+
+    async def scenario(spool):
+        # The first two reached MongoDB before the write was given up on
+        await db.logs.insert_many([dict(document) for document in documents[:2]])
+        await spool.append("logs", documents)
+        await spool.replay()
+        return spool, await db.logs.count_documents({})
+
+    spool, count = run_with_spool(db, tmp_path, scenario)
+    assert count == 4
+    assert spool.pending_segments == 0
+
+
+def test_replay_resumes_from_the_recorded_offset(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(database.settings, "spool_replay_batch_size", 2)
+    documents = [dict(log(i), _id=ObjectId()) for i in range(6)]
+
+    async def scenario(spool):
+        await spool.append("logs", documents)
+        collection_type = type(db.logs)  # the spool looks its collection up on every batch
+        insert_many = collection_type.insert_many
+        calls = 0
+
+        async def fail_second_batch(collection, batch, **kwargs):
+            nonlocal calls
+            calls += 1
+            if calls == 2:
+                raise ConnectionFailure("primary stepped down")
+            return await insert_many(collection, batch, **kwargs)
+
+        monkeypatch.setattr(collection_type, "insert_many", fail_second_batch)
+        with pytest.raises(ConnectionFailure):
+            await spool.replay()
+        assert await db.logs.count_documents({}) == 2
+        assert spool.pending_segments == 1  # claim released for the next attempt
+
+        await spool.replay()
+        return spool, await db.logs.count_documents({})
+
+    spool, count = run_with_spool(db, tmp_path, scenario)
+    assert count == 6
+    assert spool.replayed == 6
+    assert spool.pending_segments == 0
+
+
+def test_write_or_spool_spools_with_ids_assigned_before_the_first_attempt(db, tmp_path, monkeypatch):
+    documents = [log(i) for i in range(3)]
+
+    async def scenario(spool):
+        monkeypatch.setattr(database, "spool", spool)
+
+        async def unavailable(batch, **kwargs):
+            raise ConnectionFailure("no primary")
+
+        logs = db.logs
+        monkeypatch.setattr(logs, "insert_many", unavailable)
+        written = await database.write_or_spool(logs, documents)
+
+        await spool.replay()
+        return written, await db.logs.find({}).to_list(None)
+
+    written, stored = run_with_spool(db, tmp_path, scenario)
+    assert written is False
+    assert all("_id" in document for document in documents)
+    assert sorted(document["_id"] for document in stored) == sorted(document["_id"] for document in documents)
+
+
+def test_restart_with_the_same_pid_recovers_and_never_overwrites_earlier_segments(db, tmp_path):
+    earlier = [dict(log(i), _id=ObjectId()) for i in range(3)]
+    later = [dict(log(i), _id=ObjectId()) for i in range(3, 5)]
+
+    async def main():
+        # An earlier run with our PID died mid-replay of one segment and mid-append of the next
+        previous = IngestSpool()
+        previous.directory = tmp_path
+        await previous.append("logs", earlier[:2])
+        previous._seal_locked()
+        sealed = next(tmp_path.glob("segment-*.ndjson"))
+        sealed.rename(sealed.with_suffix(".replaying"))
+        await previous.append("logs", earlier[2:])
+
+        spool = IngestSpool()
+        await spool.start(db, str(tmp_path))
+        try:
+            assert not list(tmp_path.glob("*.open")) and not list(tmp_path.glob("*.replaying"))
+            await spool.append("logs", later)
+            await spool.replay()  # the recovered segments
+            await spool.replay()  # then the idle active one
+        finally:
+            await spool.stop()
+        return await db.logs.count_documents({})
+
+    assert asyncio.run(main()) == 5
+    assert not list(tmp_path.iterdir())
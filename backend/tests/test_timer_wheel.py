@@ -0,0 +1,58 @@
+"""Expiry of deadlines on the hashed timer wheel"""
+from app.utils.timer_wheel import TimerWheel
+
+
+def always(key, deadline):
+    return True
+
+
+def test_entries_fire_once_their_deadline_passes():
+    wheel = TimerWheel(slots=8, resolution=10)
+    wheel.advance(0, always)
+    wheel.schedule("a", 25)
+    wheel.schedule("b", 55)
+
+    assert wheel.advance(20, always) == []
+    assert wheel.advance(30, always) == ["a"]
+    assert wheel.advance(60, always) == ["b"]
+    assert len(wheel) == 0
+
+
+def test_deadlines_beyond_one_turn_wait_for_their_turn():
+    wheel = TimerWheel(slots=4, resolution=10)
+    wheel.advance(0, always)
+    wheel.schedule("far", 95)  # same bucket as 15, two turns later
+
+    assert wheel.advance(20, always) == []
+    assert len(wheel) == 1
+    assert wheel.advance(100, always) == ["far"]
+
+
+def test_entries_scheduled_before_the_first_advance_are_not_a_turn_late():
+    wheel = TimerWheel(slots=8, resolution=10)
+    wheel.schedule("later", 1030)
+    wheel.schedule("first", 1000)
+
+    assert wheel.advance(1010, always) == ["first"]
+    assert wheel.advance(1040, always) == ["later"]
+
+    wheel = TimerWheel(slots=8, resolution=10)
+    wheel.schedule("stale", 1000)
+    # First advance long after the deadline, several turns of the wheel away
+    assert wheel.advance(1500, always) == ["stale"]
+
+
+def test_rescheduled_entries_are_dropped_by_is_due():
+    wheel = TimerWheel(slots=8, resolution=10)
+    wheel.advance(0, always)
+    deadlines = {"a": 15}
+    wheel.schedule("a", 15)
+    deadlines["a"] = 45
+    wheel.schedule("a", 45)
+
+    def is_due(key, deadline):
+        return deadlines.get(key) == deadline
+
+    assert wheel.advance(20, is_due) == []
+    assert wheel.advance(50, is_due) == ["a"]
+    assert len(wheel) == 0
@@ -0,0 +1,82 @@
+"""Decoded-size limits of the compressed ingest body decoder"""
+import gzip
+import zlib
+
+import pytest
+from fastapi import HTTPException
+
+from app.utils.wire import ZSTD_AVAILABLE, _Decoder
+
+LIMIT = 1024 * 1024
+
+requires_zstd = pytest.mark.skipif(not ZSTD_AVAILABLE, reason="zstandard is not installed")
+
+
+def decode_all(decoder: _Decoder, body: bytes, chunk_size: int = 64 * 1024) -> bytes:
+    out = []
+    for start in range(0, len(body), chunk_size):
+        out.extend(decoder.decode(body[start:start + chunk_size]))
+    out.append(decoder.finish())
+    return b"".join(out)
+
+
+def test_gzip_within_limit_round_trips():
+    payload = b'{"event_type": "login"}\n' * 1000
+    assert decode_all(_Decoder("gzip", LIMIT), gzip.compress(payload)) == payload
+
+
+def test_deflate_within_limit_round_trips():
+    payload = b"x" * 5000
+    assert decode_all(_Decoder("deflate", LIMIT), zlib.compress(payload)) == payload
+
+
+def test_gzip_bomb_is_rejected_in_bounded_steps():
+    decoder = _Decoder("gzip", LIMIT)
+    with pytest.raises(HTTPException) as raised:
+        decode_all(decoder, gzip.compress(b"\0" * (64 * LIMIT)))
+    assert raised.value.status_code == 413
+    # Decoding stopped at the step that crossed the limit
+    assert decoder.produced <= 2 * LIMIT
+
+
+def test_unsupported_encoding_is_415():
+    with pytest.raises(HTTPException) as raised:
+        _Decoder("br", LIMIT)
+    assert raised.value.status_code == 415
+
+
+@requires_zstd
+def test_zstd_within_limit_round_trips_across_split_chunks_and_frames():
+    import zstandard
+
+    compressor = zstandard.ZstdCompressor()
+    first, second = b"a" * 200_000, b"b" * 300_000
+    body = compressor.compress(first) + compressor.compress(second)
+    assert decode_all(_Decoder("zstd", LIMIT), body, chunk_size=7) == first + second
+
+
+@requires_zstd
+def test_zstd_declared_content_size_over_limit_is_rejected_before_decoding():
+    import zstandard
+
+    body = zstandard.ZstdCompressor().compress(b"\0" * (64 * LIMIT))
+    decoder = _Decoder("zstd", LIMIT)
+    with pytest.raises(HTTPException) as raised:
+        list(decoder.decode(body))
+    assert raised.value.status_code == 413
+    assert decoder.produced == 0
+
+
+@requires_zstd
+def test_zstd_bomb_without_declared_size_is_rejected_in_bounded_steps():
+    import zstandard
+
+    compressor = zstandard.ZstdCompressor(write_content_size=False)
+    chunker = compressor.compressobj()
+    body = b"".join(chunker.compress(b"\0" * LIMIT) for _ in range(64)) + chunker.flush()
+
+    decoder = _Decoder("zstd", LIMIT)
+    with pytest.raises(HTTPException) as raised:
+        decode_all(decoder, body)
+    assert raised.value.status_code == 413
+    assert decoder.produced <= LIMIT + 2 * (1 << 20)